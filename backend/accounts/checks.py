@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Warning
+
+# caches that each process keeps to itself
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def claims_revocation_cache(app_configs, **kwargs):
+    """Warn when token claims are trusted but revocations (accounts.tokens) do not reach other processes."""
+    auth_classes = settings.REST_FRAMEWORK.get('DEFAULT_AUTHENTICATION_CLASSES', ())
+    if 'accounts.principal.ClaimsJWTAuthentication' not in auth_classes:
+        return []
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PER_PROCESS_CACHES:
+        return []
+    return [Warning(
+        f'The default cache ({backend}) is not shared between processes, so a role, tenant or '
+        'active status change revokes token claims only in the process that made it.',
+        hint='Set REDIS_URL so CACHES uses Redis.',
+        id='accounts.W001',
+    )]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:06
+
+import accounts.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', accounts.models.AccountUserManager()),
+            ],
+        ),
+    ]
@@ -1,8 +1,27 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from tenants.models import Tenant
 
 
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # bulk updates skip User.save; revoke the token claims they change
+        if not set(kwargs) & {'role', 'tenant', 'tenant_id', 'is_active', 'is_superuser'}:
+            return super().update(**kwargs)
+        user_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        from .principal import users
+        from .tokens import revoke
+        for user_id in user_ids:
+            users.invalidate(user_id)
+        revoke(*user_ids)
+        return rows
+
+
+class AccountUserManager(UserManager.from_queryset(UserQuerySet)):
+    pass
+
+
 class User(AbstractUser):
     ROLE_CHOICES = (
         ('owner', 'Owner'),
@@ -16,6 +35,47 @@ class User(AbstractUser):
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='admin')
     tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, null=True, blank=True)
 
+    objects = AccountUserManager()
+
+    # fields copied into JWT claims (accounts.tokens); changing one revokes the user's tokens
+    CLAIM_FIELDS = ('role', 'tenant_id', 'is_active', 'is_superuser')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_claims = instance._claim_values()
+        return instance
+
+    def _claim_values(self):
+        # deferred fields are left out rather than loaded
+        return tuple(self.__dict__.get(f) for f in self.CLAIM_FIELDS)
+
+    def refresh_from_db(self, using=None, fields=None):
+        # principals built from token claims (accounts.principal) load deferred fields from the user cache
+        if getattr(self, '_from_claims', False) and fields:
+            from .principal import fill_from_cache
+            if fill_from_cache(self):
+                return
+        super().refresh_from_db(using, fields)
+
+    def save(self, *args, **kwargs):
+        if getattr(self, '_from_claims', False) and kwargs.get('update_fields') is None:
+            # a principal may hold cached values; write only what was changed on it
+            changed = [f.attname for f in self._meta.concrete_fields
+                       if f.attname in self._principal_values
+                       and self.__dict__.get(f.attname) != self._principal_values[f.attname]]
+            if not changed:
+                return
+            kwargs['update_fields'] = changed
+        super().save(*args, **kwargs)
+        from .principal import users
+        users.invalidate(self.pk)
+        claims = self._claim_values()
+        if getattr(self, '_saved_claims', claims) != claims:
+            from .tokens import revoke
+            revoke(self.pk)
+        self._saved_claims = claims
+
     def has_role(self, *roles):
         return self.role in roles or self.is_superuser
 
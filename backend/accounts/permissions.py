@@ -1,5 +1,22 @@
 from rest_framework import permissions
 
+from .tokens import ROLE_CLAIM, SUPERUSER_CLAIM, request_claims
+
+# view class -> ({action: roles}, roles for every other action or None)
+_role_maps = {}
+
+
+def role_map(view_class):
+    """The view's role settings as frozensets, built once per view class."""
+    if view_class not in _role_maps:
+        action_roles = getattr(view_class, 'allowed_action_roles', None) or {}
+        allowed = getattr(view_class, 'allowed_roles', None)
+        _role_maps[view_class] = (
+            {action: frozenset(roles) for action, roles in action_roles.items()},
+            frozenset(allowed) if allowed is not None else None,
+        )
+    return _role_maps[view_class]
+
 
 class RolesAllowed(permissions.BasePermission):
     """Permission that checks a view's `allowed_roles` attribute (list) or `allowed_action_roles` mapping for actions.
@@ -7,24 +24,30 @@ class RolesAllowed(permissions.BasePermission):
     Usage:
       - set `allowed_roles = ['owner', 'admin']` on the view (applies to all actions), or
       - set `allowed_action_roles = {'create': ['owner','admin'], 'pay': ['cashier','manager']}` for per-action control.
+
+    The caller's role comes from the `role` claim of the JWT access token (see
+    accounts.tokens), so no query is needed; sessions, tokens without claims
+    and revoked tokens fall back to the database.
     """
 
     def has_permission(self, request, view):
         if not request.user or not request.user.is_authenticated:
             return False
+        claims = request_claims(request)
+        if claims is None:
+            return False
         # superusers bypass
-        if getattr(request.user, 'is_superuser', False):
+        if claims[SUPERUSER_CLAIM]:
             return True
 
+        action_roles, allowed = role_map(type(view))
         # per-action mapping
         action = getattr(view, 'action', None)
-        action_roles_map = getattr(view, 'allowed_action_roles', None)
-        if action_roles_map and action in action_roles_map:
-            return request.user.role in action_roles_map.get(action, [])
+        if action in action_roles:
+            return claims[ROLE_CLAIM] in action_roles[action]
 
         # global allowed roles
-        allowed = getattr(view, 'allowed_roles', None)
         if allowed is None:
             # default to allow authenticated users
             return True
-        return request.user.role in allowed
\ No newline at end of file
+        return claims[ROLE_CLAIM] in allowed
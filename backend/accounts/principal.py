@@ -0,0 +1,163 @@
+"""Stateless request principal.
+
+ClaimsJWTAuthentication builds `request.user` from the access token's claims
+(accounts.tokens) instead of loading the user row on every request:
+
+- it is an accounts.User instance with id, username, role, tenant_id and
+  is_superuser taken from the token and every other field, is_active included,
+  from a per-process cache of user rows, one query per user per TTL instead of
+  one per request; a user that is gone or inactive is rejected like
+  JWTAuthentication does;
+- `user.tenant` is served from a per-process cache of Tenant objects, so
+  `getattr(request.user, 'tenant')` in get_queryset costs no query.
+
+Entries live for AUTH_PRINCIPAL_CACHE_SECONDS (at most
+AUTH_PRINCIPAL_CACHE_SIZE per cache); saving a user drops it from this
+process' cache right away, other processes pick the change up within the TTL.
+Tenant rows are never dropped early: suspending or changing a tenant reaches
+principals up to AUTH_PRINCIPAL_CACHE_SECONDS later in each process.
+Tokens without claims or with revoked claims are authenticated the usual way,
+loading the user.
+
+`stats()` reports hits, misses and hit rate per cache.
+"""
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from .tokens import ROLE_CLAIM, SUPERUSER_CLAIM, TENANT_CLAIM, is_revoked
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class TTLCache:
+    """Small per-process cache with expiry, a size bound and hit / miss counters."""
+
+    def __init__(self, loader):
+        self.loader = loader
+        self._data = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = self.loader(key)
+        if value is not None:
+            with self._lock:
+                self._data.pop(key, None)
+                while len(self._data) >= _setting('AUTH_PRINCIPAL_CACHE_SIZE', 10000):
+                    # oldest insertion first
+                    self._data.pop(next(iter(self._data)))
+                self._data[key] = (now + _setting('AUTH_PRINCIPAL_CACHE_SECONDS', 60), value)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data),
+                    'hit_rate': round(self.hits / lookups, 4) if lookups else None}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+def _load_user(pk):
+    User = get_user_model()
+    return User.objects.filter(pk=pk).values(*[f.attname for f in User._meta.concrete_fields]).first()
+
+
+def _load_tenant(pk):
+    from tenants.models import Tenant
+
+    return Tenant.objects.filter(pk=pk).first()
+
+
+users = TTLCache(_load_user)
+tenants = TTLCache(_load_tenant)
+
+
+def stats():
+    return {'user': users.stats(), 'tenant': tenants.stats()}
+
+
+def cached_tenant(tenant_id):
+    tenant = tenants.get(str(tenant_id))
+    # callers may change their copy; the cached one stays as loaded
+    return copy.copy(tenant) if tenant is not None else None
+
+
+def _fill(user, values):
+    for attname, value in values.items():
+        if attname not in user.__dict__:
+            user.__dict__[attname] = value
+            user._principal_values[attname] = value
+
+
+def fill_from_cache(user):
+    """Set the deferred fields of a principal from the user cache. False if the user is gone."""
+    values = users.get(user.pk)
+    if values is None:
+        return False
+    _fill(user, values)
+    return True
+
+
+def from_claims(token):
+    """An accounts.User for the token's claims, the other fields from the user cache."""
+    User = get_user_model()
+    user_id = User._meta.pk.to_python(token[api_settings.USER_ID_CLAIM])
+    values = users.get(user_id)
+    if values is None:
+        raise AuthenticationFailed(_('User not found'), code='user_not_found')
+    if not values['is_active']:
+        raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+    claims = {
+        'id': user_id,
+        'role': token[ROLE_CLAIM],
+        'tenant_id': User._meta.get_field('tenant').target_field.to_python(token.get(TENANT_CLAIM)),
+        'is_superuser': token.get(SUPERUSER_CLAIM, False),
+        'is_active': True,
+    }
+    if token.get('username'):
+        claims['username'] = token['username']
+    fields = [f.attname for f in User._meta.concrete_fields if f.attname in claims]
+    user = User.from_db(router.db_for_read(User), fields, [claims[f] for f in fields])
+    user._from_claims = True
+    user._principal_values = dict(claims)
+    _fill(user, values)
+    user._state.fields_cache['tenant'] = cached_tenant(claims['tenant_id']) if claims['tenant_id'] else None
+    return user
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that trusts the token's role / tenant claims instead of loading the user."""
+
+    def get_user(self, validated_token):
+        if ROLE_CLAIM in validated_token and not is_revoked(validated_token):
+            return from_claims(validated_token)
+        return super().get_user(validated_token)
@@ -0,0 +1,121 @@
+"""Role and tenant claims in SimpleJWT access tokens.
+
+Tokens from /token/ carry `username`, `role`, `tenant_id` and `is_superuser`, so
+accounts.permissions.RolesAllowed can authorise a request from the token alone.
+The claims are read from the database only when a token is issued or refreshed
+(/token/refresh/ stamps the current values, not the ones from login).
+
+When a user's role, tenant, active flag or superuser flag changes
+(accounts.models.User.save, or User.objects...update()) the user is added to
+the revocation set: one cache key per user holding the time of the change, kept
+for one access token lifetime, after which every token issued before the change
+has expired anyway. Tokens issued up to that time fall back to the database
+until the client refreshes. Call `revoke` directly after writes that bypass
+both, such as raw SQL.
+
+The revocation set lives in the default cache, which must be shared by every
+process (CACHES from REDIS_URL); the accounts.W001 check warns when it is not.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+ROLE_CLAIM = 'role'
+TENANT_CLAIM = 'tenant_id'
+SUPERUSER_CLAIM = 'is_superuser'
+# when the claims were read from the user; unlike iat, not rounded to the second
+CLAIMS_AT_CLAIM = 'claims_at'
+
+
+def add_claims(token, user):
+    token['username'] = user.username
+    token[ROLE_CLAIM] = user.role
+    token[TENANT_CLAIM] = str(user.tenant_id) if user.tenant_id else None
+    token[SUPERUSER_CLAIM] = user.is_superuser
+    token[CLAIMS_AT_CLAIM] = time.time()
+    return token
+
+
+def _revoked_key(user_id):
+    return f'accounts:token-revoked:{user_id}'
+
+
+def revoke(*user_ids):
+    """Stop trusting the claims of the users' tokens issued until now."""
+    if not user_ids:
+        return
+    lifetime = settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds()
+    now = time.time()
+    cache.set_many({_revoked_key(user_id): now for user_id in user_ids}, timeout=int(lifetime) + 60)
+
+
+def is_revoked(token):
+    revoked_at = cache.get(_revoked_key(token.get(api_settings.USER_ID_CLAIM)))
+    if revoked_at is None:
+        return False
+    if CLAIMS_AT_CLAIM in token:
+        return token[CLAIMS_AT_CLAIM] <= revoked_at
+    # iat has whole seconds: a token from the second of the revocation is treated as revoked
+    return token.get('iat', 0) <= int(revoked_at)
+
+
+def user_claims(user):
+    """Claims for a user, loading it when `user` is not a model instance. None if it is gone or inactive."""
+    User = get_user_model()
+    if not isinstance(user, User):
+        user = (User.objects.filter(pk=user.pk, is_active=True)
+                .only('role', 'tenant_id', 'is_superuser', 'is_active').first())
+        if user is None:
+            return None
+    return {ROLE_CLAIM: user.role, TENANT_CLAIM: str(user.tenant_id) if user.tenant_id else None,
+            SUPERUSER_CLAIM: user.is_superuser}
+
+
+def request_claims(request):
+    """Role / tenant claims of the caller: from the access token, or the database if it has none or was revoked."""
+    if not hasattr(request, '_auth_claims'):
+        token = getattr(request, 'auth', None)
+        if token is not None and ROLE_CLAIM in token and not is_revoked(token):
+            request._auth_claims = {ROLE_CLAIM: token[ROLE_CLAIM], TENANT_CLAIM: token.get(TENANT_CLAIM),
+                                    SUPERUSER_CLAIM: token.get(SUPERUSER_CLAIM, False)}
+        else:
+            request._auth_claims = user_claims(request.user)
+    return request._auth_claims
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return add_claims(super().get_token(user), user)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refresh that stamps the user's current claims on the new access token."""
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = get_user_model().objects.filter(
+            **{api_settings.USER_ID_FIELD: refresh.payload.get(api_settings.USER_ID_CLAIM)}).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+
+        data = {'access': str(add_claims(refresh.access_token, user))}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                try:
+                    refresh.blacklist()
+                except AttributeError:
+                    # token_blacklist app not installed
+                    pass
+            add_claims(refresh, user)
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data['refresh'] = str(refresh)
+        return data
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from tenants.admin_utils import TenantAdminMixin
-from .models import Customer, LoyaltyPoint, Supplier, LoyaltyTransaction, PurchaseHistory
+from .models import Customer, CustomerMetrics, DuplicateCandidate, LoyaltyPoint, Supplier, LoyaltyTransaction, PurchaseHistory
 
 
 @admin.register(Customer)
@@ -40,6 +40,22 @@ class PurchaseHistoryAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at',)
 
 
+@admin.register(CustomerMetrics)
+class CustomerMetricsAdmin(admin.ModelAdmin):
+    list_display = ('customer', 'lifetime_value', 'order_count', 'average_basket', 'last_purchase_at', 'rfm_segment')
+    list_filter = ('rfm_segment',)
+    search_fields = ('customer__first_name', 'customer__last_name', 'customer__email')
+    readonly_fields = [f.name for f in CustomerMetrics._meta.fields]
+
+
+@admin.register(DuplicateCandidate)
+class DuplicateCandidateAdmin(admin.ModelAdmin):
+    list_display = ('customer', 'duplicate_of', 'score', 'status', 'created_at', 'merged_at')
+    list_filter = ('status',)
+    search_fields = ('customer__first_name', 'customer__last_name', 'customer__email', 'customer__phone')
+    raw_id_fields = ('customer', 'duplicate_of')
+
+
 @admin.register(Supplier)
 class SupplierAdmin(TenantAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'contact', 'phone', 'payment_status', 'created_at')
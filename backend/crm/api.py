@@ -1,13 +1,25 @@
-from rest_framework import viewsets, permissions, status
+from django.core.exceptions import ValidationError
+from django.db.models import F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from rest_framework import viewsets, permissions, serializers, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Customer, LoyaltyPoint, Supplier, LoyaltyTransaction, PurchaseHistory
+from .models import Customer, DuplicateCandidate, LoyaltyPoint, Supplier, LoyaltyTransaction, PurchaseHistory
 from .serializers import (
-    CustomerSerializer, LoyaltyPointSerializer, SupplierSerializer,
+    CustomerSerializer, DuplicateCandidateSerializer, LoyaltyPointSerializer, SupplierSerializer,
     LoyaltyTransactionSerializer, PurchaseHistorySerializer
 )
 from accounts.permissions import RolesAllowed
 
+# Customer columns read by Customer.__str__, which the serializers use for customer_name
+CUSTOMER_NAME_FIELDS = ('customer__id', 'customer__first_name', 'customer__last_name', 'customer__email', 'customer__phone')
+
+
+def with_loyalty_balance(qs):
+    """Annotate customers with `loyalty_balance` so serializers need no per-row loyalty query."""
+    balance = LoyaltyPoint.objects.filter(customer=OuterRef('pk')).values('points')[:1]
+    return qs.annotate(loyalty_balance=Coalesce(Subquery(balance), Value(0), output_field=IntegerField()))
+
 
 class IsTenantOwner(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -33,22 +45,145 @@ class TenantScopedViewSet(viewsets.ModelViewSet):
 
 
 class CustomerViewSet(TenantScopedViewSet):
+    """Customers, sortable and filterable by their precomputed CustomerMetrics.
+
+    ?ordering=-lifetime_value (also order_count, average_basket, first_purchase_at,
+    last_purchase_at); filters: segment, min_ltv, max_ltv, min_orders,
+    last_purchase_after, last_purchase_before.
+    """
     serializer_class = CustomerSerializer
     permission_classes = [RolesAllowed]
     allowed_roles = ['owner', 'admin', 'manager', 'cashier']
+    allowed_action_roles = {
+        'export': ['owner', 'admin', 'manager'],
+        'export_job': ['owner', 'admin', 'manager'],
+        'merge': ['owner', 'admin', 'manager'],
+    }
+
+    metrics_ordering_fields = ('lifetime_value', 'order_count', 'average_basket', 'first_purchase_at', 'last_purchase_at')
+    metrics_filters = {
+        'segment': 'metrics__rfm_segment',
+        'min_ltv': 'metrics__lifetime_value__gte',
+        'max_ltv': 'metrics__lifetime_value__lte',
+        'min_orders': 'metrics__order_count__gte',
+        'last_purchase_after': 'metrics__last_purchase_at__gte',
+        'last_purchase_before': 'metrics__last_purchase_at__lte',
+    }
 
     def get_queryset(self):
-        return self.filter_by_tenant(Customer.objects.all())
+        qs = with_loyalty_balance(self.filter_by_tenant(Customer.objects.select_related('metrics')))
+        if self.action != 'list':
+            return qs
+
+        params = self.request.query_params
+        filters = {lookup: params[name] for name, lookup in self.metrics_filters.items() if params.get(name)}
+        if filters:
+            try:
+                qs = qs.filter(**filters)
+            except (ValueError, ValidationError) as exc:
+                raise serializers.ValidationError({'detail': f'Invalid filter value: {exc}'})
+
+        ordering = params.get('ordering', '')
+        if ordering.lstrip('-') in self.metrics_ordering_fields:
+            field = F(f'metrics__{ordering.lstrip("-")}')
+            # metrics is a left join: customers without a row (bulk_create, imports)
+            # stay in the list and sort after everyone else either way
+            order = field.desc(nulls_last=True) if ordering.startswith('-') else field.asc(nulls_last=True)
+            qs = qs.order_by(order, '-pk')
+        return qs
 
     def perform_create(self, serializer):
         tenant = self.get_tenant()
-        serializer.save(tenant=tenant)
+        customer = serializer.save(tenant=tenant)
+
+        # check the new customer against existing ones sharing a phone/email/name key
+        from .tasks import check_customer_duplicates
+        try:
+            check_customer_duplicates.delay(customer.id)
+        except Exception:
+            # If Celery broker is unavailable (dev/test), run the check synchronously
+            try:
+                check_customer_duplicates.run(customer.id)
+            except Exception:
+                pass
+
+    @action(detail=True, methods=['get'])
+    def duplicates(self, request, pk=None):
+        """Pending duplicate candidates involving this customer."""
+        customer = self.get_object()
+        candidates = DuplicateCandidate.objects.filter(
+            Q(customer=customer) | Q(duplicate_of=customer), status='pending'
+        ).select_related('customer', 'duplicate_of')
+        return Response(DuplicateCandidateSerializer(candidates, many=True).data)
+
+    @action(detail=True, methods=['post'])
+    def merge(self, request, pk=None):
+        """Merge the customers in `duplicate_ids` into this one."""
+        from .dedup import merge_customers
+
+        survivor = self.get_object()
+        ids = request.data.get('duplicate_ids') or []
+        if not isinstance(ids, list) or not ids:
+            return Response({'error': 'duplicate_ids must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        duplicates = list(self.filter_by_tenant(Customer.objects.filter(pk__in=ids)).exclude(pk=survivor.pk))
+        if len(duplicates) != len(set(ids) - {survivor.pk}):
+            return Response({'error': 'Unknown customer in duplicate_ids'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            merged = merge_customers(survivor, duplicates)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        survivor = self.get_queryset().get(pk=survivor.pk)
+        return Response({'merged': merged, 'customer': self.get_serializer(survivor).data})
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream every customer of the tenant as CSV or JSONL (?export_format=, ?segment=)."""
+        from django.http import StreamingHttpResponse
+        from .export import EXPORT_FORMATS, export_filename, iter_export
+
+        tenant = self.get_tenant()
+        if tenant is None:
+            return Response({'error': 'A tenant is required for export'}, status=status.HTTP_400_BAD_REQUEST)
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response({'error': f'Unsupported export format: {export_format}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        resp = StreamingHttpResponse(
+            iter_export(tenant, export_format, segment=request.query_params.get('segment')),
+            content_type=EXPORT_FORMATS[export_format][0],
+        )
+        resp['Content-Disposition'] = f'attachment; filename="{export_filename(tenant, export_format)}"'
+        return resp
+
+    @action(detail=False, methods=['post'])
+    def export_job(self, request):
+        """Run the export in the background; the requester gets a notification with the file URL."""
+        from .export import EXPORT_FORMATS
+        from .tasks import export_customers
+
+        tenant = self.get_tenant()
+        if tenant is None:
+            return Response({'error': 'A tenant is required for export'}, status=status.HTTP_400_BAD_REQUEST)
+        export_format = request.data.get('export_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response({'error': f'Unsupported export format: {export_format}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        kwargs = {'tenant_id': str(tenant.pk), 'export_format': export_format,
+                  'segment': request.data.get('segment'), 'requested_by': request.user.pk}
+        try:
+            job = export_customers.delay(**kwargs)
+            return Response({'status': 'queued', 'task_id': job.id}, status=status.HTTP_202_ACCEPTED)
+        except Exception:
+            # If Celery broker is unavailable (dev/test), run the export synchronously
+            result = export_customers.run(**kwargs)
+            return Response(result, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['get'])
     def purchase_history(self, request, pk=None):
         """Get purchase history for a specific customer."""
         customer = self.get_object()
-        purchases = customer.purchases.all()
+        purchases = customer.purchases.select_related('order').only(
+            'id', 'customer', 'amount', 'loyalty_earned', 'created_at', 'order__id', 'order__status')
         serializer = PurchaseHistorySerializer(purchases, many=True)
         return Response(serializer.data)
 
@@ -68,6 +203,8 @@ class LoyaltyPointViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         qs = LoyaltyPoint.objects.select_related('customer').all()
+        if self.action == 'list':
+            qs = qs.only('id', 'points', 'updated_at', *CUSTOMER_NAME_FIELDS)
         # LoyaltyPoints tie to customers which are tenant-scoped via customer. Filter via related customer.
         tenant = self.get_tenant() if hasattr(self, 'get_tenant') else getattr(self.request.user, 'tenant', None)
         if tenant is None and not self.request.user.is_superuser:
@@ -111,8 +248,9 @@ class LoyaltyPointViewSet(viewsets.ModelViewSet):
                 'transaction': LoyaltyTransactionSerializer(transaction).data
             })
         else:
+            # a concurrent redemption spent the balance after the check above
             return Response(
-                {'error': 'Failed to redeem points'},
+                {'error': f'Insufficient points. Available: {loyalty.points}'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
@@ -158,7 +296,8 @@ class LoyaltyTransactionViewSet(viewsets.ReadOnlyModelViewSet):
     allowed_roles = ['owner', 'admin', 'manager']
 
     def get_queryset(self):
-        qs = LoyaltyTransaction.objects.select_related('customer').all()
+        qs = LoyaltyTransaction.objects.select_related('customer').only(
+            'id', 'transaction_type', 'points', 'reason', 'reference_order', 'created_at', *CUSTOMER_NAME_FIELDS)
         # Filter by tenant via customer relationship
         tenant = getattr(self.request.user, 'tenant', None)
         if tenant is None and not self.request.user.is_superuser:
@@ -175,7 +314,8 @@ class PurchaseHistoryViewSet(viewsets.ReadOnlyModelViewSet):
     allowed_roles = ['owner', 'admin', 'manager', 'cashier']
 
     def get_queryset(self):
-        qs = PurchaseHistory.objects.select_related('customer', 'order').all()
+        qs = PurchaseHistory.objects.select_related('customer', 'order').only(
+            'id', 'amount', 'loyalty_earned', 'created_at', 'order__id', 'order__status', *CUSTOMER_NAME_FIELDS)
         # Filter by tenant via customer relationship
         tenant = getattr(self.request.user, 'tenant', None)
         if tenant is None and not self.request.user.is_superuser:
@@ -0,0 +1,300 @@
+"""Customer deduplication and merge engine.
+
+Every Customer carries three normalised blocking keys (email_key, phone_key,
+name_key) that are maintained by Customer.save() and indexed per tenant. Only
+customers sharing at least one key are ever compared, so:
+
+- a new customer is checked with one indexed lookup (`record_candidates`),
+  independent of how many customers the tenant has;
+- a full tenant scan (`scan_tenant`) streams one query per key, ordered by the
+  key, and compares customers inside each block only. Blocks larger than
+  CRM_DEDUP_MAX_BLOCK are skipped, since a key shared by that many customers
+  (a placeholder phone, a shop email) says nothing about identity.
+
+Pairs scoring at least CRM_DEDUP_MIN_SCORE are stored as DuplicateCandidate
+rows for review. When CRM_DEDUP_AUTO_MERGE_SCORE is set, a new customer whose
+best match scores that high is merged straight away. `merge_customers` moves
+loyalty, ledger, purchase and order rows with bulk UPDATEs.
+"""
+import difflib
+import itertools
+import logging
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import Customer, DuplicateCandidate, LoyaltyPoint, LoyaltyTransaction, PurchaseHistory
+
+logger = logging.getLogger(__name__)
+
+KEY_FIELDS = ('email_key', 'phone_key', 'name_key')
+COMPARE_FIELDS = ('id', 'tenant_id', 'first_name', 'last_name') + KEY_FIELDS
+
+# providers that ignore dots in the local part
+_DOTLESS_EMAIL_DOMAINS = {'gmail.com', 'googlemail.com'}
+_PHONE_KEY_DIGITS = 9
+
+
+def normalise_email(email):
+    email = (email or '').strip().lower()
+    if '@' not in email:
+        return ''
+    local, domain = email.rsplit('@', 1)
+    local = local.split('+', 1)[0]
+    if domain in _DOTLESS_EMAIL_DOMAINS:
+        local = local.replace('.', '')
+        domain = 'gmail.com'
+    return f'{local}@{domain}' if local else ''
+
+
+def normalise_phone(phone):
+    """Digits of the national number: '+966 50 123 4567', '0501234567' and '00966501234567' agree."""
+    digits = re.sub(r'\D', '', phone or '')
+    if len(digits) < 7:
+        return ''
+    return digits[-_PHONE_KEY_DIGITS:]
+
+
+def normalise_name(first_name, last_name=''):
+    """Lower-cased, accent-free name tokens in sorted order ('Doe, John' == 'john doe')."""
+    text = unicodedata.normalize('NFKD', f'{first_name or ""} {last_name or ""}')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return ' '.join(sorted(re.findall(r'\w+', text)))
+
+
+def customer_keys(customer):
+    return (
+        normalise_email(customer.email),
+        normalise_phone(customer.phone),
+        normalise_name(customer.first_name, customer.last_name),
+    )
+
+
+def _min_score():
+    return getattr(settings, 'CRM_DEDUP_MIN_SCORE', 0.5)
+
+
+def score_pair(a, b):
+    """Return (score in 0..1, reasons) for two customers with their keys populated."""
+    score = 0.0
+    reasons = []
+    if a.email_key and b.email_key:
+        if a.email_key == b.email_key:
+            score += 0.6
+            reasons.append('email')
+        else:
+            score -= 0.2
+    if a.phone_key and b.phone_key:
+        if a.phone_key == b.phone_key:
+            score += 0.6
+            reasons.append('phone')
+        else:
+            score -= 0.2
+    if a.name_key and b.name_key:
+        if a.name_key == b.name_key:
+            score += 0.3
+            reasons.append('name')
+        elif difflib.SequenceMatcher(None, a.name_key, b.name_key).ratio() >= 0.85:
+            score += 0.15
+            reasons.append('similar_name')
+    return max(0.0, min(score, 1.0)), reasons
+
+
+def find_candidates(customer, limit=50):
+    """Customers in the same tenant sharing a blocking key with `customer`, scored.
+
+    Returns a list of (other, score, reasons) at or above CRM_DEDUP_MIN_SCORE,
+    best first.
+    """
+    keys = Q()
+    for field in KEY_FIELDS:
+        value = getattr(customer, field)
+        if value:
+            keys |= Q(**{field: value})
+    if not keys:
+        return []
+
+    others = (
+        Customer.objects.filter(keys, tenant_id=customer.tenant_id)
+        .exclude(pk=customer.pk)
+        .only(*COMPARE_FIELDS)[:limit]
+    )
+    min_score = _min_score()
+    scored = []
+    for other in others:
+        score, reasons = score_pair(customer, other)
+        if score >= min_score:
+            scored.append((other, score, reasons))
+    scored.sort(key=lambda item: -item[1])
+    return scored
+
+
+def _candidate(newer, older, score, reasons):
+    # the older record is the natural survivor, so it is the one pointed at
+    if newer.pk < older.pk:
+        newer, older = older, newer
+    return DuplicateCandidate(tenant_id=newer.tenant_id, customer_id=newer.pk, duplicate_of_id=older.pk,
+                              score=score, reasons=reasons)
+
+
+def record_candidates(customer):
+    """Check one (usually new) customer and store its candidate pairs. Returns the scored matches."""
+    scored = find_candidates(customer)
+    if scored:
+        DuplicateCandidate.objects.bulk_create(
+            [_candidate(customer, other, score, reasons) for other, score, reasons in scored],
+            ignore_conflicts=True,
+        )
+    return scored
+
+
+def check_new_customer(customer_id):
+    """Incremental dedup for a newly created customer; auto-merges when configured to.
+
+    Returns the surviving customer id.
+    """
+    customer = Customer.objects.filter(pk=customer_id).first()
+    if customer is None:
+        return None
+    scored = record_candidates(customer)
+    threshold = getattr(settings, 'CRM_DEDUP_AUTO_MERGE_SCORE', None)
+    if scored and threshold is not None and scored[0][1] >= threshold:
+        survivor = min([customer, scored[0][0]], key=lambda c: c.pk)
+        duplicate = customer if survivor is not customer else scored[0][0]
+        merge_customers(Customer.objects.get(pk=survivor.pk), [duplicate])
+        return survivor.pk
+    return customer.pk
+
+
+def _max_block():
+    return getattr(settings, 'CRM_DEDUP_MAX_BLOCK', 50)
+
+
+def scan_tenant(tenant, batch_size=2000):
+    """Find duplicate pairs across a whole tenant by blocking on each key.
+
+    Streams one ordered query per key field and scores pairs inside each block;
+    candidates are written in batches with bulk_create. Returns the number of
+    candidate pairs found (including ones already recorded).
+    """
+    max_block = _max_block()
+    min_score = _min_score()
+    found = 0
+    pending = []
+
+    def flush():
+        if pending:
+            DuplicateCandidate.objects.bulk_create(pending, ignore_conflicts=True)
+            pending.clear()
+
+    for field in KEY_FIELDS:
+        base = Customer.objects.filter(tenant=tenant).exclude(**{field: ''})
+        shared = base.values(field).annotate(n=Count('id')).filter(n__gt=1, n__lte=max_block).values(field)
+        rows = (
+            base.filter(**{f'{field}__in': shared})
+            .order_by(field, 'pk')
+            .only(*COMPARE_FIELDS)
+            .iterator(chunk_size=batch_size)
+        )
+        for _key, block in itertools.groupby(rows, key=lambda c: getattr(c, field)):
+            for a, b in itertools.combinations(list(block), 2):
+                score, reasons = score_pair(a, b)
+                if score >= min_score:
+                    pending.append(_candidate(a, b, score, reasons))
+                    found += 1
+            if len(pending) >= batch_size:
+                flush()
+    flush()
+    return found
+
+
+def rebuild_keys(tenant=None, batch_size=2000):
+    """Recompute blocking keys for rows written without save() (bulk imports, old data)."""
+    qs = Customer.objects.order_by('pk').only('id', 'first_name', 'last_name', 'email', 'phone', *KEY_FIELDS)
+    if tenant is not None:
+        qs = qs.filter(tenant=tenant)
+    changed = 0
+    last_pk = 0
+    while True:
+        batch = list(qs.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return changed
+        last_pk = batch[-1].pk
+        dirty = []
+        for customer in batch:
+            keys = customer_keys(customer)
+            if keys != tuple(getattr(customer, f) for f in KEY_FIELDS):
+                customer.email_key, customer.phone_key, customer.name_key = keys
+                dirty.append(customer)
+        if dirty:
+            Customer.objects.bulk_update(dirty, list(KEY_FIELDS))
+            changed += len(dirty)
+
+
+def merge_customers(survivor, duplicates):
+    """Fold `duplicates` into `survivor` and delete them.
+
+    Loyalty balances are summed, ledger, purchase and order rows are re-pointed
+    with one UPDATE per table, blank contact fields on the survivor are filled
+    from the duplicates, and the survivor's metrics are rebuilt. Candidate pairs
+    within the merged group are marked 'merged' and kept; other pairs of the
+    deleted customers are dropped.
+    Returns the number of customers merged away.
+    """
+    from pos.models import Order
+    from .loyalty import ensure_loyalty_rows
+    from .metrics import recompute_customer_metrics
+
+    dup_ids = sorted({d.pk for d in duplicates} - {survivor.pk})
+    if not dup_ids:
+        return 0
+
+    with transaction.atomic():
+        # lock every row involved in a fixed order so concurrent merges cannot deadlock
+        locked = {
+            c.pk: c for c in Customer.objects.select_for_update().filter(pk__in=[survivor.pk, *dup_ids]).order_by('pk')
+        }
+        if survivor.pk not in locked:
+            raise Customer.DoesNotExist(f'Customer {survivor.pk} no longer exists')
+        if any(c.tenant_id != survivor.tenant_id for c in locked.values()):
+            raise ValueError('Cannot merge customers from different tenants')
+        dup_ids = [pk for pk in dup_ids if pk in locked]
+
+        moved_points = LoyaltyPoint.objects.filter(customer_id__in=dup_ids).aggregate(total=Sum('points'))['total'] or 0
+        if moved_points:
+            ensure_loyalty_rows([survivor.pk])
+            LoyaltyPoint.objects.filter(customer_id=survivor.pk).update(
+                points=F('points') + moved_points, updated_at=timezone.now())
+        LoyaltyPoint.objects.filter(customer_id__in=dup_ids).delete()
+
+        LoyaltyTransaction.objects.filter(customer_id__in=dup_ids).update(customer_id=survivor.pk)
+        PurchaseHistory.objects.filter(customer_id__in=dup_ids).update(customer_id=survivor.pk)
+        Order.objects.filter(customer_id__in=dup_ids).update(customer_id=survivor.pk)
+
+        target = locked[survivor.pk]
+        filled = []
+        for field in ('last_name', 'email', 'phone', 'address'):
+            if not getattr(target, field):
+                value = next((getattr(locked[pk], field) for pk in dup_ids if getattr(locked[pk], field)), '')
+                if value:
+                    setattr(target, field, value)
+                    filled.append(field)
+        if filled:
+            target.save(update_fields=filled + ['updated_at'])
+
+        group = [survivor.pk, *dup_ids]
+        DuplicateCandidate.objects.filter(customer_id__in=group, duplicate_of_id__in=group).update(
+            status='merged', merged_at=timezone.now())
+        DuplicateCandidate.objects.filter(Q(customer_id__in=dup_ids) | Q(duplicate_of_id__in=dup_ids)).exclude(
+            status='merged').delete()
+        Customer.objects.filter(pk__in=dup_ids).delete()
+        recompute_customer_metrics(customer_ids=[survivor.pk])
+
+    for field in ['updated_at'] + filled:
+        setattr(survivor, field, getattr(target, field))
+    logger.info(f"Merged customers {dup_ids} into {survivor.pk}")
+    return len(dup_ids)
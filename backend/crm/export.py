@@ -0,0 +1,147 @@
+"""Streaming customer export (CSV / JSONL) with loyalty and spend columns.
+
+Rows come from a single query that left-joins LoyaltyPoint and CustomerMetrics,
+read with `.iterator(chunk_size=...)` so neither Django's result cache nor the
+encoded output ever holds more than one chunk. The same generators back the
+StreamingHttpResponse in CustomerViewSet.export and the background job that
+writes the file to object storage.
+"""
+import csv
+import json
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.db.models import F, IntegerField, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Customer
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+# (output column, queryset value expression)
+EXPORT_COLUMNS = [
+    ('id', 'id'),
+    ('first_name', 'first_name'),
+    ('last_name', 'last_name'),
+    ('email', 'email'),
+    ('phone', 'phone'),
+    ('created_at', 'created_at'),
+    ('loyalty_points', 'loyalty_points'),
+    ('lifetime_value', 'metrics__lifetime_value'),
+    ('order_count', 'metrics__order_count'),
+    ('average_basket', 'metrics__average_basket'),
+    ('last_purchase_at', 'metrics__last_purchase_at'),
+    ('rfm_segment', 'metrics__rfm_segment'),
+]
+
+
+def _chunk_size():
+    return getattr(settings, 'CRM_EXPORT_CHUNK_SIZE', 2000)
+
+
+def export_queryset(tenant, segment=None):
+    qs = Customer.objects.filter(tenant=tenant)
+    if segment:
+        qs = qs.filter(metrics__rfm_segment=segment)
+    return (
+        qs.annotate(loyalty_points=Coalesce(F('loyalty__points'), Value(0), output_field=IntegerField()))
+        .order_by('pk')
+        .values_list(*[expr for _col, expr in EXPORT_COLUMNS])
+    )
+
+
+def iter_export_rows(tenant, segment=None):
+    """Yield one dict per customer, streaming from the database in chunks."""
+    columns = [col for col, _expr in EXPORT_COLUMNS]
+    for values in export_queryset(tenant, segment=segment).iterator(chunk_size=_chunk_size()):
+        yield dict(zip(columns, values))
+
+
+def _plain(value):
+    if value is None:
+        return ''
+    if isinstance(value, (int, str)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+class _Echo:
+    """File-like object whose write() hands back the line instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([col for col, _expr in EXPORT_COLUMNS])
+    for row in rows:
+        yield writer.writerow([_plain(v) for v in row.values()])
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        yield json.dumps({k: _plain(v) for k, v in row.items()}, ensure_ascii=False) + '\n'
+
+
+def iter_export(tenant, export_format='csv', segment=None):
+    """Encoded export lines (str) for `export_format` ('csv' or 'jsonl')."""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unsupported export format: {export_format}')
+    rows = iter_export_rows(tenant, segment=segment)
+    return iter_csv(rows) if export_format == 'csv' else iter_jsonl(rows)
+
+
+def export_filename(tenant, export_format):
+    return f"customers-{tenant.slug}-{timezone.now():%Y%m%d-%H%M%S}.{EXPORT_FORMATS[export_format][1]}"
+
+
+def write_export_to_storage(tenant, export_format='csv', segment=None):
+    """Write the export to a temp file, then to S3 (or MEDIA_ROOT/exports as a fallback).
+
+    Returns a dict with the storage key, a download URL and the row count.
+    """
+    filename = export_filename(tenant, export_format)
+    key = f"exports/customers/{tenant.pk}/{filename}"
+    content_type = EXPORT_FORMATS[export_format][0]
+
+    rows = 0
+    with tempfile.TemporaryFile('w+b', suffix=f'.{export_format}') as tmp:
+        for line in iter_export(tenant, export_format, segment=segment):
+            tmp.write(line.encode('utf-8'))
+            rows += 1
+        if export_format == 'csv':
+            rows -= 1  # header line
+        url = _store(tmp, key, content_type)
+    return {'key': key, 'url': url, 'rows': rows, 'format': export_format}
+
+
+def _store(tmp, key, content_type):
+    bucket = getattr(settings, 'AWS_STORAGE_BUCKET_NAME', None)
+    if bucket:
+        try:
+            from receipts.utils import get_s3_client, get_presigned_url
+            tmp.seek(0)
+            get_s3_client().upload_fileobj(tmp, bucket, key, ExtraArgs={'ContentType': content_type})
+            return get_presigned_url(key) or f"{settings.AWS_S3_ENDPOINT_URL}/{bucket}/{key}"
+        except Exception as e:
+            logger.warning(f"Customer export upload to S3 failed, storing locally: {e}")
+
+    path = os.path.join(settings.MEDIA_ROOT, *key.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp.seek(0)
+    with open(path, 'wb') as out:
+        # copy in blocks so the file is never read into memory at once
+        for block in iter(lambda: tmp.read(64 * 1024), b''):
+            out.write(block)
+    return f"file://{path}"
@@ -0,0 +1,134 @@
+"""Loyalty point engine.
+
+Balances are changed with single UPDATE statements using F() expressions, so
+concurrent earns and redemptions never overwrite each other. A redemption only
+applies when the balance covers it (`points >= amount` is part of the UPDATE's
+WHERE clause), which makes "check then redeem" race-free without holding row
+locks. Ledger rows (LoyaltyTransaction) are written with bulk_create.
+
+Tenants listed in LOYALTY_BATCH_ACCRUAL_TENANTS (tenant slugs) do not accrue
+points when an order is paid. Their purchases are left pending and the nightly
+`crm.tasks.accrue_pending_loyalty` task credits them in bulk.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import LoyaltyPoint, LoyaltyTransaction, PurchaseHistory
+
+
+def uses_batch_accrual(customer):
+    slugs = getattr(settings, 'LOYALTY_BATCH_ACCRUAL_TENANTS', ())
+    # check the setting first so the common case costs no tenant query
+    if not slugs or customer.tenant_id is None:
+        return False
+    return customer.tenant.slug in slugs
+
+
+def ensure_loyalty_rows(customer_ids):
+    """Create missing LoyaltyPoint rows for the given customers in one insert."""
+    customer_ids = set(customer_ids)
+    existing = set(LoyaltyPoint.objects.filter(customer_id__in=customer_ids).values_list('customer_id', flat=True))
+    missing = customer_ids - existing
+    if missing:
+        LoyaltyPoint.objects.bulk_create([LoyaltyPoint(customer_id=cid) for cid in missing], ignore_conflicts=True)
+
+
+def earn(customer_id, amount, reason='', reference_order=None):
+    """Credit `amount` points. Returns the LoyaltyTransaction, or None for a non-positive amount."""
+    if amount <= 0:
+        return None
+    with transaction.atomic():
+        updated = LoyaltyPoint.objects.filter(customer_id=customer_id).update(
+            points=F('points') + amount, updated_at=timezone.now())
+        if not updated:
+            ensure_loyalty_rows([customer_id])
+            LoyaltyPoint.objects.filter(customer_id=customer_id).update(
+                points=F('points') + amount, updated_at=timezone.now())
+        return LoyaltyTransaction.objects.create(
+            customer_id=customer_id, transaction_type='earn', points=amount,
+            reason=reason, reference_order=reference_order)
+
+
+def redeem(customer_id, amount, reason='', reference_order=None):
+    """Debit `amount` points if the balance covers it.
+
+    Returns the LoyaltyTransaction, or None when the amount is non-positive or
+    the balance is insufficient at the moment the UPDATE runs.
+    """
+    if amount <= 0:
+        return None
+    with transaction.atomic():
+        updated = LoyaltyPoint.objects.filter(customer_id=customer_id, points__gte=amount).update(
+            points=F('points') - amount, updated_at=timezone.now())
+        if not updated:
+            return None
+        return LoyaltyTransaction.objects.create(
+            customer_id=customer_id, transaction_type='redeem', points=-amount,
+            reason=reason, reference_order=reference_order)
+
+
+def accrue_bulk(entries):
+    """Credit many earn entries at once.
+
+    `entries` is an iterable of (customer_id, points, reason, reference_order_id).
+    Deltas are summed per customer and applied with a single UPDATE ... CASE
+    statement, and all ledger rows go in with one bulk_create. Returns the
+    number of transactions written.
+    """
+    entries = [e for e in entries if e[1] > 0]
+    if not entries:
+        return 0
+
+    deltas = defaultdict(int)
+    for customer_id, points, _reason, _order_id in entries:
+        deltas[customer_id] += points
+
+    with transaction.atomic():
+        ensure_loyalty_rows(deltas)
+        LoyaltyPoint.objects.filter(customer_id__in=deltas).update(
+            points=F('points') + Case(
+                *[When(customer_id=cid, then=Value(delta)) for cid, delta in deltas.items()],
+                default=Value(0), output_field=IntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+        LoyaltyTransaction.objects.bulk_create([
+            LoyaltyTransaction(customer_id=cid, transaction_type='earn', points=points,
+                               reason=reason, reference_order_id=order_id)
+            for cid, points, reason, order_id in entries
+        ])
+    return len(entries)
+
+
+def accrue_pending_purchases(tenant=None, batch_size=1000):
+    """Credit purchases recorded without accrual (batch-mode tenants).
+
+    Works through pending PurchaseHistory rows in chunks of `batch_size`; each
+    chunk is claimed with select_for_update(skip_locked) so two workers never
+    credit the same purchase, and is committed together with its ledger rows. Returns the number of purchases accrued.
+    """
+    total = 0
+    while True:
+        with transaction.atomic():
+            qs = PurchaseHistory.objects.filter(loyalty_accrued_at__isnull=True)
+            if tenant is not None:
+                qs = qs.filter(customer__tenant=tenant)
+            batch = list(
+                qs.select_for_update(skip_locked=True, of=('self',))
+                .order_by('id')
+                .values_list('id', 'customer_id', 'loyalty_earned', 'order_id')[:batch_size]
+            )
+            if not batch:
+                return total
+            accrue_bulk([
+                (customer_id, points, f'Purchase Order #{order_id}', order_id)
+                for _pk, customer_id, points, order_id in batch
+            ])
+            PurchaseHistory.objects.filter(id__in=[row[0] for row in batch]).update(loyalty_accrued_at=timezone.now())
+        total += len(batch)
+        if len(batch) < batch_size:
+            return total
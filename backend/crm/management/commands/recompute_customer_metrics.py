@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from crm.metrics import recompute_customer_metrics, refresh_segments
+from tenants.models import Tenant
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the CRM customer metrics table from purchase history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', help='Only recompute customers of the tenant with this slug')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--segments-only', action='store_true',
+                            help='Only re-score RFM segments from the stored counters')
+
+    def handle(self, *args, **options):
+        if options['segments_only']:
+            changed = refresh_segments(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Updated RFM segments for {changed} customers'))
+            return
+
+        tenant = None
+        if options['tenant']:
+            try:
+                tenant = Tenant.objects.get(slug=options['tenant'])
+            except Tenant.DoesNotExist:
+                raise CommandError(f"Tenant '{options['tenant']}' not found")
+
+        written = recompute_customer_metrics(tenant=tenant, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Recomputed metrics for {written} customers'))
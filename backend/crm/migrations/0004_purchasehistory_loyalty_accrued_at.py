@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:09
+
+from django.db import migrations, models
+
+
+def mark_existing_purchases_accrued(apps, schema_editor):
+    # purchases recorded before batch accrual existed were credited immediately
+    PurchaseHistory = apps.get_model('crm', 'PurchaseHistory')
+    PurchaseHistory.objects.filter(loyalty_accrued_at__isnull=True).update(loyalty_accrued_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0003_purchasehistory_loyaltytransaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchasehistory',
+            name='loyalty_accrued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_existing_purchases_accrued, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='purchasehistory',
+            index=models.Index(fields=['loyalty_accrued_at'], name='crm_purchas_loyalty_0a291f_idx'),
+        ),
+    ]
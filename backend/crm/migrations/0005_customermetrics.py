@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0002_alter_tenant_options_tenant_business_address_and_more'),
+        ('crm', '0004_purchasehistory_loyalty_accrued_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerMetrics',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='metrics', serialize=False, to='crm.customer')),
+                ('lifetime_value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('order_count', models.IntegerField(default=0)),
+                ('average_basket', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('first_purchase_at', models.DateTimeField(blank=True, null=True)),
+                ('last_purchase_at', models.DateTimeField(blank=True, null=True)),
+                ('rfm_score', models.CharField(blank=True, help_text='Recency, frequency and monetary scores (1-5 each)', max_length=3)),
+                ('rfm_segment', models.CharField(blank=True, choices=[('champion', 'Champion'), ('loyal', 'Loyal'), ('promising', 'Promising'), ('new', 'New'), ('needs_attention', 'Needs Attention'), ('at_risk', 'At Risk'), ('hibernating', 'Hibernating')], max_length=20)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tenant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='tenants.tenant')),
+            ],
+            options={
+                'verbose_name': 'Customer Metrics',
+                'verbose_name_plural': 'Customer Metrics',
+                'indexes': [models.Index(fields=['tenant', '-lifetime_value'], name='crm_custome_tenant__a9a289_idx'), models.Index(fields=['tenant', '-order_count'], name='crm_custome_tenant__117de6_idx'), models.Index(fields=['tenant', '-last_purchase_at'], name='crm_custome_tenant__91fd3b_idx'), models.Index(fields=['tenant', 'rfm_segment'], name='crm_custome_tenant__c43679_idx')],
+            },
+        ),
+    ]
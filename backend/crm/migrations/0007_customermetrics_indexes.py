@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:36
+
+from django.db import migrations, models
+
+
+def add_missing_metrics(apps, schema_editor):
+    Customer = apps.get_model('crm', 'Customer')
+    CustomerMetrics = apps.get_model('crm', 'CustomerMetrics')
+    missing = Customer.objects.filter(metrics__isnull=True).values_list('pk', 'tenant_id')
+    CustomerMetrics.objects.bulk_create(
+        [CustomerMetrics(customer_id=pk, tenant_id=tenant_id) for pk, tenant_id in missing.iterator()],
+        batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0006_customer_dedup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customermetrics',
+            index=models.Index(fields=['tenant', '-average_basket'], name='crm_custome_tenant__6a0746_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customermetrics',
+            index=models.Index(fields=['tenant', 'first_purchase_at'], name='crm_custome_tenant__1797f1_idx'),
+        ),
+        migrations.RunPython(add_missing_metrics, migrations.RunPython.noop),
+    ]
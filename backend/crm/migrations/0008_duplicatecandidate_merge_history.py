@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0007_customermetrics_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='duplicatecandidate',
+            name='merged_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='duplicatecandidate',
+            name='customer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicate_candidates', to='crm.customer'),
+        ),
+        migrations.AlterField(
+            model_name='duplicatecandidate',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='crm.customer'),
+        ),
+    ]
@@ -11,11 +11,23 @@ class Customer(models.Model):
     phone = models.CharField(max_length=50, blank=True, db_index=True)
     address = models.TextField(blank=True)
 
+    # normalised blocking keys for duplicate detection, maintained by save(); see crm.dedup
+    email_key = models.CharField(max_length=254, blank=True, editable=False)
+    phone_key = models.CharField(max_length=20, blank=True, editable=False)
+    name_key = models.CharField(max_length=300, blank=True, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    KEY_SOURCE_FIELDS = {'first_name', 'last_name', 'email', 'phone'}
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['tenant', 'email_key']),
+            models.Index(fields=['tenant', 'phone_key']),
+            models.Index(fields=['tenant', 'name_key']),
+        ]
         verbose_name = 'Customer'
         verbose_name_plural = 'Customers'
 
@@ -23,6 +35,19 @@ class Customer(models.Model):
         name = f"{self.first_name} {self.last_name}".strip()
         return name or (self.email or self.phone or 'Customer')
 
+    def save(self, *args, **kwargs):
+        from .dedup import customer_keys
+        self.email_key, self.phone_key, self.name_key = customer_keys(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and self.KEY_SOURCE_FIELDS & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'email_key', 'phone_key', 'name_key'}
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            # a zeroed metrics row from the start, so metrics-sorted lists can join on it
+            CustomerMetrics.objects.bulk_create(
+                [CustomerMetrics(customer_id=self.pk, tenant_id=self.tenant_id)], ignore_conflicts=True)
+
     def get_or_create_loyalty(self):
         """Get or create the loyalty points record for this customer."""
         loyalty, created = LoyaltyPoint.objects.get_or_create(customer=self)
@@ -39,32 +64,21 @@ class LoyaltyPoint(models.Model):
 
     def add_points(self, amount, reason='', reference_order=None):
         """Add loyalty points and create a transaction record."""
-        if amount <= 0:
-            return None
-        self.points += amount
-        self.save(update_fields=['points', 'updated_at'])
-        transaction = LoyaltyTransaction.objects.create(
-            customer=self.customer,
-            transaction_type='earn',
-            points=amount,
-            reason=reason,
-            reference_order=reference_order
-        )
+        from .loyalty import earn
+        transaction = earn(self.customer_id, amount, reason=reason, reference_order=reference_order)
+        if transaction is not None:
+            self.refresh_from_db(fields=['points', 'updated_at'])
         return transaction
 
     def redeem_points(self, amount, reason='', reference_order=None):
-        """Redeem loyalty points and create a transaction record."""
-        if amount <= 0 or self.points < amount:
-            return None
-        self.points -= amount
-        self.save(update_fields=['points', 'updated_at'])
-        transaction = LoyaltyTransaction.objects.create(
-            customer=self.customer,
-            transaction_type='redeem',
-            points=-amount,
-            reason=reason,
-            reference_order=reference_order
-        )
+        """Redeem loyalty points and create a transaction record.
+
+        The balance check happens in the database, so a stale `self.points`
+        can never let two concurrent redemptions overdraw the account.
+        """
+        from .loyalty import redeem
+        transaction = redeem(self.customer_id, amount, reason=reason, reference_order=reference_order)
+        self.refresh_from_db(fields=['points', 'updated_at'])
         return transaction
 
 
@@ -99,10 +113,13 @@ class PurchaseHistory(models.Model):
     order = models.OneToOneField('pos.Order', on_delete=models.CASCADE, related_name='purchase_record')
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     loyalty_earned = models.IntegerField(default=0)
+    # null while the points are still waiting for the nightly batch accrual
+    loyalty_accrued_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['loyalty_accrued_at'])]
         verbose_name = 'Purchase History'
         verbose_name_plural = 'Purchase Histories'
 
@@ -111,32 +128,119 @@ class PurchaseHistory(models.Model):
 
     @staticmethod
     def create_from_order(order):
-        """Create purchase history record and accrue loyalty points when order is paid."""
+        """Create purchase history record and accrue loyalty points when order is paid.
+
+        Tenants in batch accrual mode only get the purchase row here; their points
+        are credited by the nightly crm.tasks.accrue_pending_loyalty run.
+        """
+        from django.db import transaction
+        from django.utils import timezone
+        from .loyalty import earn, uses_batch_accrual
+        from .metrics import record_purchase
+
         if not order.customer:
             return None
         
         # Calculate loyalty points (1 point per currency unit)
         loyalty_points = int(order.total)
-        
-        # Create purchase history
-        purchase = PurchaseHistory.objects.create(
-            customer=order.customer,
-            order=order,
-            amount=order.total,
-            loyalty_earned=loyalty_points
-        )
-        
-        # Accrue loyalty points
-        loyalty = order.customer.get_or_create_loyalty()
-        loyalty.add_points(
-            amount=loyalty_points,
-            reason=f'Purchase Order #{order.id}',
-            reference_order=order
-        )
+        deferred = loyalty_points > 0 and uses_batch_accrual(order.customer)
+
+        with transaction.atomic():
+            purchase = PurchaseHistory.objects.create(
+                customer=order.customer,
+                order=order,
+                amount=order.total,
+                loyalty_earned=loyalty_points,
+                loyalty_accrued_at=None if deferred else timezone.now(),
+            )
+            if not deferred:
+                earn(order.customer_id, loyalty_points,
+                     reason=f'Purchase Order #{order.id}', reference_order=order)
+            record_purchase(order.customer, purchase.amount, purchase.created_at)
         
         return purchase
 
 
+class CustomerMetrics(models.Model):
+    """Lifetime purchase metrics per customer, kept up to date as orders are paid.
+
+    Created zeroed with the customer (Customer.save), updated incrementally by
+    PurchaseHistory.create_from_order and rebuilt in bulk by the
+    `recompute_customer_metrics` command; see crm.metrics.
+    """
+    SEGMENT_CHOICES = [
+        ('champion', 'Champion'),
+        ('loyal', 'Loyal'),
+        ('promising', 'Promising'),
+        ('new', 'New'),
+        ('needs_attention', 'Needs Attention'),
+        ('at_risk', 'At Risk'),
+        ('hibernating', 'Hibernating'),
+    ]
+
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='metrics')
+    # denormalised from customer so the list indexes can lead with tenant
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, null=True, blank=True)
+    lifetime_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.IntegerField(default=0)
+    average_basket = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    first_purchase_at = models.DateTimeField(null=True, blank=True)
+    last_purchase_at = models.DateTimeField(null=True, blank=True)
+    rfm_score = models.CharField(max_length=3, blank=True, help_text='Recency, frequency and monetary scores (1-5 each)')
+    rfm_segment = models.CharField(max_length=20, choices=SEGMENT_CHOICES, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tenant', '-lifetime_value']),
+            models.Index(fields=['tenant', '-order_count']),
+            models.Index(fields=['tenant', '-average_basket']),
+            models.Index(fields=['tenant', 'first_purchase_at']),
+            models.Index(fields=['tenant', '-last_purchase_at']),
+            models.Index(fields=['tenant', 'rfm_segment']),
+        ]
+        verbose_name = 'Customer Metrics'
+        verbose_name_plural = 'Customer Metrics'
+
+    def __str__(self):
+        return f"{self.customer_id} - {self.lifetime_value} over {self.order_count} orders"
+
+
+class DuplicateCandidate(models.Model):
+    """A pair of customers the dedup engine thinks may be the same person.
+
+    Merged pairs are kept as history: the side that was merged away is set to
+    NULL when its customer is deleted.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('merged', 'Merged'),
+        ('dismissed', 'Dismissed'),
+    ]
+
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, null=True, blank=True)
+    customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='duplicate_candidates')
+    duplicate_of = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    score = models.FloatField()
+    reasons = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    created_at = models.DateTimeField(auto_now_add=True)
+    merged_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-score', '-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'duplicate_of'], name='uniq_crm_duplicate_pair'),
+        ]
+        indexes = [models.Index(fields=['tenant', 'status', '-score'])]
+        verbose_name = 'Duplicate Candidate'
+        verbose_name_plural = 'Duplicate Candidates'
+
+    def __str__(self):
+        return f"{self.customer_id} ~ {self.duplicate_of_id} ({self.score:.2f})"
+
+
 class Supplier(models.Model):
     tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, null=True, blank=True)
     name = models.CharField(max_length=255)
@@ -1,17 +1,32 @@
 from rest_framework import serializers
-from .models import Customer, LoyaltyPoint, Supplier, LoyaltyTransaction, PurchaseHistory
+from .models import (
+    Customer, CustomerMetrics, DuplicateCandidate, LoyaltyPoint, Supplier, LoyaltyTransaction, PurchaseHistory
+)
+
+
+class CustomerMetricsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerMetrics
+        fields = ['lifetime_value', 'order_count', 'average_basket', 'first_purchase_at',
+                  'last_purchase_at', 'rfm_score', 'rfm_segment']
+        read_only_fields = fields
 
 
 class CustomerSerializer(serializers.ModelSerializer):
     loyalty_points = serializers.SerializerMethodField()
+    # None until the customer's first paid order (or a metrics recompute)
+    metrics = CustomerMetricsSerializer(read_only=True)
     
     class Meta:
         model = Customer
-        fields = ['id', 'first_name', 'last_name', 'email', 'phone', 'address', 'loyalty_points', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'loyalty_points', 'created_at', 'updated_at']
+        fields = ['id', 'first_name', 'last_name', 'email', 'phone', 'address', 'loyalty_points', 'metrics', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'loyalty_points', 'metrics', 'created_at', 'updated_at']
     
     def get_loyalty_points(self, obj):
         """Include current loyalty points in customer data."""
+        # CustomerViewSet annotates the balance; fall back to the relation elsewhere
+        if hasattr(obj, 'loyalty_balance'):
+            return obj.loyalty_balance
         try:
             return obj.loyalty.points
         except LoyaltyPoint.DoesNotExist:
@@ -58,6 +73,24 @@ class PurchaseHistorySerializer(serializers.ModelSerializer):
         return obj.order.status if obj.order else None
 
 
+class DuplicateCandidateSerializer(serializers.ModelSerializer):
+    customer_name = serializers.SerializerMethodField()
+    duplicate_of_name = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DuplicateCandidate
+        fields = ['id', 'customer', 'customer_name', 'duplicate_of', 'duplicate_of_name', 'score', 'reasons', 'status',
+                  'created_at', 'merged_at']
+        read_only_fields = fields
+
+    def get_customer_name(self, obj):
+        # None once the customer was merged away
+        return str(obj.customer) if obj.customer_id else None
+
+    def get_duplicate_of_name(self, obj):
+        return str(obj.duplicate_of) if obj.duplicate_of_id else None
+
+
 class SupplierSerializer(serializers.ModelSerializer):
     class Meta:
         model = Supplier
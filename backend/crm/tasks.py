@@ -0,0 +1,83 @@
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(Exception,),
+    retry_kwargs={'max_retries': 3, 'countdown': 300},
+    retry_backoff=True
+)
+def accrue_pending_loyalty(self, batch_size=1000):
+    """
+    Credit loyalty points for purchases recorded by batch accrual tenants.
+    Runs nightly; see crm.loyalty for how the batches are applied.
+    """
+    from .loyalty import accrue_pending_purchases
+
+    accrued = accrue_pending_purchases(batch_size=batch_size)
+    logger.info(f"Accrued loyalty points for {accrued} pending purchases")
+    return {'status': 'success', 'accrued': accrued}
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(Exception,),
+    retry_kwargs={'max_retries': 3, 'countdown': 300},
+    retry_backoff=True
+)
+def refresh_customer_segments(self):
+    """
+    Re-score RFM segments nightly; recency moves even for customers who do not buy.
+    """
+    from .metrics import refresh_segments
+
+    changed = refresh_segments()
+    logger.info(f"Refreshed RFM segments for {changed} customers")
+    return {'status': 'success', 'changed': changed}
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(Exception,),
+    retry_kwargs={'max_retries': 2, 'countdown': 60},
+    retry_backoff=True
+)
+def export_customers(self, tenant_id, export_format='csv', segment=None, requested_by=None):
+    """
+    Write a tenant's customer export to object storage and notify the requester.
+    """
+    from notifications.dispatch import notify
+    from tenants.models import Tenant
+    from .export import write_export_to_storage
+
+    tenant = Tenant.objects.get(pk=tenant_id)
+    result = write_export_to_storage(tenant, export_format=export_format, segment=segment)
+    logger.info(f"Exported {result['rows']} customers for tenant {tenant.slug} to {result['key']}")
+
+    if requested_by:
+        notify(
+            [requested_by],
+            'customer_export_ready',
+            data={'type': 'customer_export', 'url': result['url'], 'key': result['key']},
+            context={'rows': result['rows'], 'export_format': export_format.upper()}
+        )
+    return {'status': 'success', **result}
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(Exception,),
+    retry_kwargs={'max_retries': 3, 'countdown': 60},
+    retry_backoff=True
+)
+def check_customer_duplicates(self, customer_id):
+    """
+    Incremental dedup for a newly created customer (indexed lookups on its blocking keys only).
+    """
+    from .dedup import check_new_customer
+
+    survivor_id = check_new_customer(customer_id)
+    return {'status': 'success', 'customer_id': survivor_id}
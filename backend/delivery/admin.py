@@ -1,6 +1,6 @@
 from django.contrib import admin
 from tenants.admin_utils import TenantAdminMixin
-from .models import Delivery, DeliveryPersonnel, Address, ShippingFeeRule
+from .models import Delivery, DeliveryEvent, DeliveryPersonnel, Address, ShippingFeeRule
 
 
 class DeliveryPersonnelAdmin(TenantAdminMixin, admin.ModelAdmin):
@@ -20,39 +20,48 @@ class ShippingFeeRuleAdmin(TenantAdminMixin, admin.ModelAdmin):
     list_filter = ('zone',)
 
 
+class DeliveryEventInline(admin.TabularInline):
+    model = DeliveryEvent
+    extra = 0
+    can_delete = False
+    fields = ('from_status', 'to_status', 'actor', 'created_at')
+    readonly_fields = fields
+
+
 @admin.register(Delivery)
 class DeliveryAdmin(TenantAdminMixin, admin.ModelAdmin):
     list_display = ('order_reference', 'tracking_number', 'status', 'delivery_person', 'fee', 'created_at', 'updated_at')
     search_fields = ('order_reference', 'tracking_number')
     list_filter = ('status', 'created_at')
     readonly_fields = ('created_at', 'updated_at')
+    raw_id_fields = ('order',)
+    inlines = [DeliveryEventInline]
     actions = ['mark_picked_up', 'mark_in_transit', 'mark_delivered', 'mark_failed']
 
+    def _bulk_transition(self, request, queryset, to_status, label):
+        from .state import bulk_transition
+        result = bulk_transition(queryset, to_status, actor=request.user)
+        message = f"{len(result['updated'])} deliveries marked as {label}"
+        if result['skipped']:
+            message += f" ({len(result['skipped'])} skipped: status does not allow it)"
+        self.message_user(request, message)
+
     def mark_picked_up(self, request, queryset):
-        for delivery in queryset:
-            delivery.mark_picked_up()
-        self.message_user(request, f"{queryset.count()} deliveries marked as picked up")
+        self._bulk_transition(request, queryset, 'picked_up', 'picked up')
     mark_picked_up.short_description = "Mark selected as picked up"
 
     def mark_in_transit(self, request, queryset):
-        for delivery in queryset:
-            delivery.mark_in_transit()
-        self.message_user(request, f"{queryset.count()} deliveries marked as in transit")
+        self._bulk_transition(request, queryset, 'in_transit', 'in transit')
     mark_in_transit.short_description = "Mark selected as in transit"
 
     def mark_delivered(self, request, queryset):
-        for delivery in queryset:
-            delivery.mark_delivered()
-        self.message_user(request, f"{queryset.count()} deliveries marked as delivered")
+        self._bulk_transition(request, queryset, 'delivered', 'delivered')
     mark_delivered.short_description = "Mark selected as delivered"
 
     def mark_failed(self, request, queryset):
-        for delivery in queryset:
-            delivery.mark_failed()
-        self.message_user(request, f"{queryset.count()} deliveries marked as failed")
+        self._bulk_transition(request, queryset, 'failed', 'failed')
     mark_failed.short_description = "Mark selected as failed"
 
-
 admin.site.register(DeliveryPersonnel, DeliveryPersonnelAdmin)
 admin.site.register(Address, AddressAdmin)
 admin.site.register(ShippingFeeRule, ShippingFeeRuleAdmin)
@@ -1,13 +1,15 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.conf import settings
 from django.core.mail import send_mail
 from accounts.permissions import RolesAllowed
 from .models import Delivery, DeliveryPersonnel, Address, ShippingFeeRule
 from .serializers import (
-    DeliverySerializer, DeliveryPersonnelSerializer, 
+    DeliverySerializer, DeliveryEventSerializer, DeliveryPersonnelSerializer,
     AddressSerializer, ShippingFeeRuleSerializer
 )
+from .state import InvalidTransition, bulk_transition, transition
 
 
 class DeliveryViewSet(viewsets.ModelViewSet):
@@ -22,6 +24,10 @@ class DeliveryViewSet(viewsets.ModelViewSet):
         'mark_in_transit': ['owner', 'admin', 'manager'],
         'mark_delivered': ['owner', 'admin', 'manager'],
         'mark_failed': ['owner', 'admin', 'manager'],
+        'bulk_transition': ['owner', 'admin', 'manager'],
+        'events': ['owner', 'admin', 'manager', 'cashier'],
+        'optimise_routes': ['owner', 'admin', 'manager'],
+        'dispatch_now': ['owner', 'admin', 'manager'],
     }
 
     def get_queryset(self):
@@ -38,6 +44,14 @@ class DeliveryViewSet(viewsets.ModelViewSet):
         tenant = getattr(self.request.user, 'tenant', None)
         serializer.save(tenant=tenant)
 
+    def _transition(self, to_status, **kwargs):
+        delivery = self.get_object()
+        try:
+            transition(delivery, to_status, actor=self.request.user, **kwargs)
+        except InvalidTransition as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(DeliverySerializer(delivery).data)
+
     @action(detail=True, methods=['post'])
     def assign(self, request, pk=None):
         """Assign a delivery person to this delivery."""
@@ -47,38 +61,102 @@ class DeliveryViewSet(viewsets.ModelViewSet):
             return Response({'error': 'delivery_person_id is required'}, status=status.HTTP_400_BAD_REQUEST)
         try:
             delivery_person = DeliveryPersonnel.objects.get(id=delivery_person_id, tenant=delivery.tenant)
-            delivery.assign(delivery_person)
-            return Response(DeliverySerializer(delivery).data)
         except DeliveryPersonnel.DoesNotExist:
             return Response({'error': 'Delivery person not found'}, status=status.HTTP_404_NOT_FOUND)
+        return self._transition('assigned', delivery_person=delivery_person)
 
     @action(detail=True, methods=['post'])
     def mark_picked_up(self, request, pk=None):
         """Mark delivery as picked up."""
-        delivery = self.get_object()
-        delivery.mark_picked_up()
-        return Response(DeliverySerializer(delivery).data)
+        return self._transition('picked_up')
 
     @action(detail=True, methods=['post'])
     def mark_in_transit(self, request, pk=None):
         """Mark delivery as in transit."""
-        delivery = self.get_object()
-        delivery.mark_in_transit()
-        return Response(DeliverySerializer(delivery).data)
+        return self._transition('in_transit')
 
     @action(detail=True, methods=['post'])
     def mark_delivered(self, request, pk=None):
         """Mark delivery as delivered."""
-        delivery = self.get_object()
-        delivery.mark_delivered()
-        return Response(DeliverySerializer(delivery).data)
+        return self._transition('delivered')
 
     @action(detail=True, methods=['post'])
     def mark_failed(self, request, pk=None):
         """Mark delivery as failed."""
+        return self._transition('failed')
+
+    @action(detail=True, methods=['get'])
+    def events(self, request, pk=None):
+        """Status history of this delivery, oldest first."""
         delivery = self.get_object()
-        delivery.mark_failed()
-        return Response(DeliverySerializer(delivery).data)
+        return Response(DeliveryEventSerializer(delivery.events.all(), many=True).data)
+
+    @action(detail=False, methods=['post'])
+    def bulk_transition(self, request):
+        """Move many deliveries to one status, e.g. after a warehouse scan.
+
+        Body: {"status": "picked_up", "delivery_ids": [...]} or
+        {"status": "picked_up", "tracking_numbers": [...]}. Deliveries whose
+        current status does not allow the change are returned as skipped.
+        """
+        to_status = request.data.get('status')
+        if to_status not in dict(Delivery.STATUS_CHOICES):
+            return Response({'error': 'A valid status is required'}, status=status.HTTP_400_BAD_REQUEST)
+        delivery_ids = request.data.get('delivery_ids') or []
+        tracking_numbers = request.data.get('tracking_numbers') or []
+        if not isinstance(delivery_ids, list) or not isinstance(tracking_numbers, list):
+            return Response({'error': 'delivery_ids and tracking_numbers must be lists'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not delivery_ids and not tracking_numbers:
+            return Response({'error': 'delivery_ids or tracking_numbers is required'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        limit = getattr(settings, 'DELIVERY_BULK_TRANSITION_LIMIT', 1000)
+        if len(delivery_ids) + len(tracking_numbers) > limit:
+            return Response({'error': f'At most {limit} deliveries per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        qs = self.get_queryset()
+        try:
+            qs = qs.filter(pk__in=delivery_ids) if delivery_ids else qs.filter(tracking_number__in=tracking_numbers)
+            result = bulk_transition(qs, to_status, actor=request.user)
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid delivery_ids'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'status': to_status,
+            'updated': len(result['updated']),
+            'updated_ids': result['updated'],
+            'skipped_ids': result['skipped'],
+        })
+
+    @action(detail=False, methods=['post'])
+    def optimise_routes(self, request):
+        """Plan multi-stop routes for pending deliveries and assign them to available drivers.
+
+        Body: {"max_stops": 30, "dry_run": false}. With dry_run the plan is
+        returned without assigning anything.
+        """
+        from .routing import optimise_routes
+        tenant = getattr(request.user, 'tenant', None)
+        if tenant is None:
+            return Response({'error': 'A tenant is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            max_stops = int(request.data.get('max_stops') or 0) or None
+        except (TypeError, ValueError):
+            return Response({'error': 'max_stops must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        if max_stops is not None and max_stops < 1:
+            return Response({'error': 'max_stops must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+        summary = optimise_routes(tenant, max_stops=max_stops, actor=request.user, dry_run=dry_run)
+        return Response(summary, status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def dispatch_now(self, request):
+        """Run one automatic dispatch tick for the user's tenant now."""
+        from .dispatch import dispatch_tenant
+        tenant = getattr(request.user, 'tenant', None)
+        if tenant is None:
+            return Response({'error': 'A tenant is required'}, status=status.HTTP_400_BAD_REQUEST)
+        offers = dispatch_tenant(tenant)
+        return Response({'offers': [offer['payload'] for offer in offers]})
 
 
 class DeliveryPersonnelViewSet(viewsets.ModelViewSet):
@@ -125,6 +203,9 @@ class ShippingFeeRuleViewSet(viewsets.ModelViewSet):
     serializer_class = ShippingFeeRuleSerializer
     permission_classes = [RolesAllowed]
     allowed_roles = ['owner', 'admin']
+    allowed_action_roles = {
+        'quote': ['owner', 'admin', 'manager', 'cashier'],
+    }
 
     def get_queryset(self):
         user = self.request.user
@@ -140,3 +221,37 @@ class ShippingFeeRuleViewSet(viewsets.ModelViewSet):
         tenant = getattr(self.request.user, 'tenant', None)
         serializer.save(tenant=tenant)
 
+    @action(detail=False, methods=['post'])
+    def quote(self, request):
+        """Quote shipping fees for many addresses at once.
+
+        Body: {"address_ids": [...]} for saved addresses and/or
+        {"addresses": [{"zone": ..., "latitude": ..., "longitude": ...}]} for
+        addresses typed at checkout. Quotes come back in the same order.
+        """
+        from .fees import quote_fees
+        tenant = getattr(request.user, 'tenant', None)
+        if tenant is None:
+            return Response({'error': 'A tenant is required'}, status=status.HTTP_400_BAD_REQUEST)
+        address_ids = request.data.get('address_ids') or []
+        raw = request.data.get('addresses') or []
+        if not isinstance(address_ids, list) or not isinstance(raw, list):
+            return Response({'error': 'address_ids and addresses must be lists'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = getattr(settings, 'DELIVERY_FEE_QUOTE_LIMIT', 500)
+        if len(address_ids) + len(raw) > limit:
+            return Response({'error': f'At most {limit} addresses per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            saved = Address.objects.filter(tenant=tenant, pk__in=address_ids).only('id', 'zone', 'latitude', 'longitude')
+            by_id = {a.pk: a for a in saved}
+            addresses = [by_id[int(pk)] for pk in address_ids if int(pk) in by_id]
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid address_ids'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = AddressSerializer(data=raw, many=True)
+        serializer.is_valid(raise_exception=True)
+        addresses += [Address(**data) for data in serializer.validated_data]
+
+        quotes = quote_fees(tenant, addresses)
+        return Response({'quotes': [
+            {'address_id': address.pk, **q} for address, q in zip(addresses, quotes)
+        ]})
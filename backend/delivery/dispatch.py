@@ -0,0 +1,188 @@
+"""Automatic driver dispatch.
+
+Each tick (`dispatch_tenant`) takes a tenant's oldest pending deliveries and
+its available drivers and gives every delivery, oldest first, the cheapest free
+driver, where
+
+    cost = distance to pickup (km)
+           + DISPATCH_LOAD_WEIGHT * assignments in the last DISPATCH_LOAD_WINDOW_HOURS
+           - DISPATCH_RATING_WEIGHT * average rating
+
+and drivers further than DISPATCH_MAX_DISTANCE_KM from the pickup are not
+considered. The pickup is the tenant's business location, or the delivery
+address when the tenant has none.
+
+The whole batch is applied in one transaction. Driver rows are locked with
+SKIP LOCKED and only drivers still "available" are used, so a driver who works
+for several tenants is never booked by two ticks at once; matched drivers flip
+to "busy" in a single UPDATE. Deliveries move to "assigned" through
+delivery.state.bulk_transition and the DriverAssignment rows are bulk
+inserted. After commit every matched driver is sent an offer over the channel
+layer (the `user_<id>` group used by notifications.consumers).
+
+Only tenants listed in DELIVERY_AUTO_DISPATCH_TENANTS (slugs) are dispatched.
+`delivery.tasks.dispatch_pending_deliveries` runs every few seconds and fans
+out one `dispatch_tenant_deliveries` task per tenant, so tenants are handled in
+parallel by the Celery worker pool; a cache lock keeps a tenant to one tick at
+a time.
+"""
+import logging
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Delivery
+from .routing import ACTIVE_ASSIGNMENT_STATUSES, distance_matrix
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def dispatch_tenant_slugs():
+    return list(_setting('DELIVERY_AUTO_DISPATCH_TENANTS', ()))
+
+
+def _pending(tenant, batch_size):
+    return list(
+        Delivery.objects.select_for_update(skip_locked=True, of=('self',))
+        .filter(tenant=tenant, status='pending', address__latitude__isnull=False, address__longitude__isnull=False)
+        .exclude(driver_assignments__status__in=ACTIVE_ASSIGNMENT_STATUSES)
+        .order_by('created_at', 'pk')
+        .values_list('pk', 'fee', 'tracking_number', 'address__line1', 'address__latitude', 'address__longitude')
+        [:batch_size]
+    )
+
+
+def _candidates(tenant, now):
+    from drivers.models import DriverProfile
+
+    fresh_after = now - timedelta(minutes=_setting('DISPATCH_LOCATION_MAX_AGE_MINUTES', 10))
+    load_since = now - timedelta(hours=_setting('DISPATCH_LOAD_WINDOW_HOURS', 8))
+    ids = list(
+        DriverProfile.objects.filter(
+            assigned_businesses=tenant, status='available', is_active=True, is_blocked=False,
+            verification_status='approved', current_latitude__isnull=False, current_longitude__isnull=False,
+            last_location_update__gte=fresh_after,
+        ).values_list('pk', flat=True)
+    )
+    if not ids:
+        return []
+    # lock the drivers so a tick for another tenant cannot book them at the same time
+    locked = list(
+        DriverProfile.objects.select_for_update(skip_locked=True)
+        .filter(pk__in=ids, status='available')
+        .values_list('pk', flat=True)
+    )
+    return list(
+        DriverProfile.objects.filter(pk__in=locked)
+        .annotate(load=Count('assignments', filter=Q(assignments__assigned_at__gte=load_since)))
+        .order_by('pk')
+        .values_list('pk', 'user_id', 'current_latitude', 'current_longitude', 'average_rating', 'load')
+    )
+
+
+def match(pickups, drivers):
+    """Greedy oldest-first matching.
+
+    `pickups` is a list of (lat, lng), oldest delivery first; `drivers` a list
+    of (lat, lng, rating, load). Returns a list of (pickup index, driver index,
+    distance_km).
+    """
+    if not pickups or not drivers:
+        return []
+    dist = distance_matrix(pickups, [(d[0], d[1]) for d in drivers])
+    penalty = np.array([
+        _setting('DISPATCH_LOAD_WEIGHT', 1.0) * d[3] - _setting('DISPATCH_RATING_WEIGHT', 2.0) * float(d[2] or 0)
+        for d in drivers
+    ])
+    cost = dist + penalty[None, :]
+    cost[dist > _setting('DISPATCH_MAX_DISTANCE_KM', 15.0)] = np.inf
+
+    taken = np.zeros(len(drivers), dtype=bool)
+    pairs = []
+    for i in range(len(pickups)):
+        row = np.where(taken, np.inf, cost[i])
+        j = int(row.argmin())
+        if not np.isfinite(row[j]):
+            continue
+        taken[j] = True
+        pairs.append((i, j, float(dist[i, j])))
+        if taken.all():
+            break
+    return pairs
+
+
+def dispatch_tenant(tenant, batch_size=None, now=None):
+    """Run one dispatch tick for a tenant. Returns the list of offers made."""
+    from drivers.models import DriverAssignment, DriverProfile
+    from .state import bulk_transition
+
+    now = now or timezone.now()
+    batch_size = batch_size or _setting('DISPATCH_BATCH_SIZE', 100)
+    depot = None
+    if tenant.business_latitude is not None and tenant.business_longitude is not None:
+        depot = (float(tenant.business_latitude), float(tenant.business_longitude))
+
+    with transaction.atomic():
+        deliveries = _pending(tenant, batch_size)
+        if not deliveries:
+            return []
+        drivers = _candidates(tenant, now)
+        pickups = [depot or (float(d[4]), float(d[5])) for d in deliveries]
+        pairs = match(pickups, [(float(d[2]), float(d[3]), d[4], d[5]) for d in drivers])
+        if not pairs:
+            return []
+
+        by_delivery = {deliveries[i][0]: (deliveries[i], drivers[j], km) for i, j, km in pairs}
+        moved = set(bulk_transition(Delivery.objects.filter(pk__in=by_delivery), 'assigned')['updated'])
+        chosen = [by_delivery[pk] for pk in by_delivery if pk in moved]
+        DriverProfile.objects.filter(pk__in=[driver[0] for _d, driver, _km in chosen]).update(
+            status='busy', updated_at=now)
+        assignments = DriverAssignment.objects.bulk_create([
+            DriverAssignment(driver_id=driver[0], delivery_id=delivery[0], business_id=tenant.pk,
+                             delivery_fee=delivery[1])
+            for delivery, driver, _km in chosen
+        ])
+        offers = [
+            {
+                'user_id': driver[1],
+                'payload': {
+                    'type': 'dispatch.offer',
+                    'assignment_id': str(assignment.pk),
+                    'delivery_id': delivery[0],
+                    'tracking_number': delivery[2],
+                    'address': delivery[3],
+                    'distance_km': round(km, 2),
+                },
+            }
+            for assignment, (delivery, driver, km) in zip(assignments, chosen)
+        ]
+        transaction.on_commit(lambda: push_offers(offers))
+
+    logger.info(f"Dispatch tick for tenant {tenant.pk}: {len(offers)} of {len(deliveries)} deliveries matched")
+    return offers
+
+
+def push_offers(offers):
+    """Send offers to drivers' notification sockets; drivers without a user account are skipped."""
+    offers = [o for o in offers if o['user_id'] is not None]
+    if not offers:
+        return
+    try:
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        layer = get_channel_layer()
+        if layer is None:
+            return
+        for offer in offers:
+            async_to_sync(layer.group_send)(
+                f"user_{offer['user_id']}", {'type': 'notification', 'payload': offer['payload']})
+    except Exception as e:
+        logger.warning(f"Could not push dispatch offers: {e}")
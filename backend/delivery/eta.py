@@ -0,0 +1,272 @@
+"""Delivery ETA estimation.
+
+Speed profiles
+    `rebuild_speed_profiles` streams recent LocationHistory, pairs consecutive
+    points of the same assignment and sums distance and time per (tenant,
+    zone of the delivery, local hour of day). Each tenant/zone gets one
+    SpeedProfile row holding 24 speeds, plus a tenant-wide row (zone '').
+    Hours with less than DELIVERY_ETA_MIN_SAMPLE_MINUTES of driving are left
+    empty and fall back to the tenant-wide profile, then to
+    DELIVERY_ETA_DEFAULT_SPEED_KMH.
+
+Estimates
+    `estimate_etas` loads the profiles into a NumPy lookup table and computes
+    ETAs for every picked-up / in-transit delivery in one vectorised pass:
+    straight-line distance from the driver's last position to the address,
+    times DELIVERY_ETA_ROUTE_FACTOR, over the profile speed for the zone and
+    current hour. Estimates are stored with one bulk_update.
+
+Customers are only emailed (delivery.tasks.send_delivery_eta_update) the first
+time, and after that only when the arrival time moved by at least
+DELIVERY_ETA_CHANGE_MINUTES and DELIVERY_ETA_CHANGE_RATIO of the remaining time.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Delivery, SpeedProfile
+from .routing import ACTIVE_ASSIGNMENT_STATUSES, EARTH_RADIUS_KM
+
+logger = logging.getLogger(__name__)
+
+HOURS = 24
+MIN_SPEED_KMH = 5.0
+MAX_SPEED_KMH = 120.0
+# consecutive pings further apart than this are treated as a gap, not travel
+MAX_SEGMENT_SECONDS = 600
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _zone_key(zone):
+    return (zone or '').strip().lower()
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Element-wise haversine distance (km) for arrays of coordinates in degrees."""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _local_hours(epoch_seconds):
+    offset = timezone.localtime().utcoffset().total_seconds()
+    return (((np.asarray(epoch_seconds) + offset) // 3600) % HOURS).astype(int)
+
+
+class _Accumulator:
+    """Distance and driving time per (tenant, zone) bucket and hour."""
+
+    def __init__(self):
+        self.index = {}
+        self.km = []
+        self.seconds = []
+
+    def bucket(self, key):
+        if key not in self.index:
+            self.index[key] = len(self.index)
+            self.km.append(np.zeros(HOURS))
+            self.seconds.append(np.zeros(HOURS))
+        return self.index[key]
+
+    def add(self, rows):
+        """`rows`: list of (assignment_id, tenant_id, zone, lat, lng, epoch) ordered by assignment, time."""
+        if len(rows) < 2:
+            return
+        assignment = np.array([r[0] for r in rows], dtype=object)
+        lat = np.array([r[3] for r in rows], dtype=float)
+        lng = np.array([r[4] for r in rows], dtype=float)
+        epoch = np.array([r[5] for r in rows], dtype=float)
+
+        same = assignment[1:] == assignment[:-1]
+        dt = np.diff(epoch)
+        keep = same & (dt > 0) & (dt <= MAX_SEGMENT_SECONDS)
+        if not keep.any():
+            return
+        km = haversine_km(lat[:-1], lng[:-1], lat[1:], lng[1:])
+        hours = _local_hours(epoch[:-1])
+        buckets = np.array([self.bucket((r[1], _zone_key(r[2]))) for r in rows[:-1]])
+
+        km_table = np.zeros((len(self.index), HOURS))
+        sec_table = np.zeros((len(self.index), HOURS))
+        np.add.at(km_table, (buckets[keep], hours[keep]), km[keep])
+        np.add.at(sec_table, (buckets[keep], hours[keep]), dt[keep])
+        for i in range(len(self.index)):
+            self.km[i] += km_table[i]
+            self.seconds[i] += sec_table[i]
+
+    def profiles(self, min_seconds):
+        """Yield (tenant_id, zone, hourly speeds with None gaps, total km), tenant-wide rows included."""
+        per_tenant = defaultdict(lambda: [np.zeros(HOURS), np.zeros(HOURS)])
+        for (tenant_id, zone), i in self.index.items():
+            per_tenant[tenant_id][0] += self.km[i]
+            per_tenant[tenant_id][1] += self.seconds[i]
+            if not zone:
+                # addresses without a zone only count towards the tenant-wide row
+                continue
+            yield tenant_id, zone, self._speeds(self.km[i], self.seconds[i], min_seconds), float(self.km[i].sum())
+        for tenant_id, (km, seconds) in per_tenant.items():
+            yield tenant_id, '', self._speeds(km, seconds, min_seconds), float(km.sum())
+
+    @staticmethod
+    def _speeds(km, seconds, min_seconds):
+        speeds = []
+        for h in range(HOURS):
+            if seconds[h] >= min_seconds:
+                speeds.append(round(float(np.clip(km[h] / seconds[h] * 3600, MIN_SPEED_KMH, MAX_SPEED_KMH)), 1))
+            else:
+                speeds.append(None)
+        return speeds
+
+
+def rebuild_speed_profiles(days=None, chunk_size=20000, now=None):
+    """Recompute SpeedProfile rows from the last `days` of LocationHistory. Returns rows written."""
+    from drivers.models import LocationHistory
+
+    now = now or timezone.now()
+    days = days or _setting('DELIVERY_ETA_HISTORY_DAYS', 14)
+    history = (
+        LocationHistory.objects.filter(timestamp__gte=now - timedelta(days=days), assignment__isnull=False)
+        .order_by('assignment_id', 'timestamp')
+        .values_list('assignment_id', 'assignment__business_id', 'assignment__delivery__address__zone',
+                     'latitude', 'longitude', 'timestamp')
+        .iterator(chunk_size=chunk_size)
+    )
+
+    acc = _Accumulator()
+    chunk = []
+    for assignment_id, tenant_id, zone, lat, lng, ts in history:
+        chunk.append((assignment_id, tenant_id, zone, float(lat), float(lng), ts.timestamp()))
+        if len(chunk) >= chunk_size:
+            acc.add(chunk)
+            # keep the last point so the segment across the chunk boundary is counted
+            chunk = chunk[-1:]
+    acc.add(chunk)
+
+    min_seconds = _setting('DELIVERY_ETA_MIN_SAMPLE_MINUTES', 10) * 60
+    rows = [
+        SpeedProfile(tenant_id=tenant_id, zone=zone, hourly_kmh=speeds, sample_km=round(km, 3), updated_at=now)
+        for tenant_id, zone, speeds, km in acc.profiles(min_seconds)
+    ]
+    if rows:
+        SpeedProfile.objects.bulk_create(rows, update_conflicts=True, unique_fields=['tenant', 'zone'],
+                                         update_fields=['hourly_kmh', 'sample_km', 'updated_at'])
+    logger.info(f"Rebuilt {len(rows)} delivery speed profiles from {days} days of location history")
+    return len(rows)
+
+
+class SpeedTable:
+    """SpeedProfile rows as a (profiles x 24) array for vectorised lookups."""
+
+    def __init__(self, profiles):
+        self.index = {}
+        table = []
+        for tenant_id, zone, hourly in profiles:
+            self.index[(tenant_id, _zone_key(zone))] = len(table)
+            speeds = list(hourly or [])[:HOURS] + [None] * (HOURS - len(hourly or []))
+            table.append([np.nan if v is None else float(v) for v in speeds])
+        # trailing all-NaN row is what unknown profiles point at
+        table.append([np.nan] * HOURS)
+        self.table = np.array(table, dtype=float)
+        self.missing = len(table) - 1
+
+    @classmethod
+    def load(cls, tenant_ids):
+        return cls(SpeedProfile.objects.filter(tenant_id__in=set(tenant_ids))
+                   .values_list('tenant_id', 'zone', 'hourly_kmh'))
+
+    def speeds(self, tenant_ids, zones, hours):
+        """Speed (km/h) per entry: zone profile, else tenant-wide profile, else the default."""
+        zone_rows = np.array([self.index.get((t, _zone_key(z)), self.missing) for t, z in zip(tenant_ids, zones)])
+        tenant_rows = np.array([self.index.get((t, ''), self.missing) for t in tenant_ids])
+        hours = np.asarray(hours)
+        speed = self.table[zone_rows, hours]
+        speed = np.where(np.isnan(speed), self.table[tenant_rows, hours], speed)
+        return np.where(np.isnan(speed), float(_setting('DELIVERY_ETA_DEFAULT_SPEED_KMH', 25.0)), speed)
+
+
+def _in_transit(now):
+    from drivers.models import DriverAssignment
+
+    fresh_after = now - timedelta(minutes=_setting('DELIVERY_ETA_LOCATION_MAX_AGE_MINUTES', 15))
+    rows = (
+        DriverAssignment.objects.filter(
+            status__in=ACTIVE_ASSIGNMENT_STATUSES, delivery__status__in=['picked_up', 'in_transit'],
+            driver__current_latitude__isnull=False, driver__current_longitude__isnull=False,
+            driver__last_location_update__gte=fresh_after,
+            delivery__address__latitude__isnull=False, delivery__address__longitude__isnull=False,
+        )
+        .order_by('delivery_id', '-assigned_at')
+        .values_list('delivery_id', 'delivery__tenant_id', 'delivery__address__zone',
+                     'driver__current_latitude', 'driver__current_longitude',
+                     'delivery__address__latitude', 'delivery__address__longitude', 'delivery__eta_notified_arrival')
+    )
+    seen = set()
+    unique = []
+    for row in rows:
+        # a delivery with several open assignments follows its latest one
+        if row[0] not in seen:
+            seen.add(row[0])
+            unique.append(row)
+    return unique
+
+
+def should_notify(estimated, notified, now):
+    """True when the customer has not been told an ETA yet or it moved materially."""
+    if notified is None:
+        return True
+    shift = abs((estimated - notified).total_seconds()) / 60
+    remaining = max((estimated - now).total_seconds() / 60, 0)
+    return (shift >= _setting('DELIVERY_ETA_CHANGE_MINUTES', 10)
+            and shift >= _setting('DELIVERY_ETA_CHANGE_RATIO', 0.2) * remaining)
+
+
+def estimate_etas(now=None):
+    """Estimate ETAs for all in-transit deliveries and queue emails for material changes.
+
+    Returns {'estimated': n, 'notified': [(delivery_id, minutes), ...]}.
+    """
+    now = now or timezone.now()
+    rows = _in_transit(now)
+    if not rows:
+        return {'estimated': 0, 'notified': []}
+
+    columns = list(zip(*rows))
+    km = haversine_km(columns[3], columns[4], columns[5], columns[6]) * _setting('DELIVERY_ETA_ROUTE_FACTOR', 1.3)
+    hour = int(_local_hours([now.timestamp()])[0])
+    speeds = SpeedTable.load(columns[1]).speeds(columns[1], columns[2], np.full(len(rows), hour))
+    minutes = np.maximum(np.ceil(km / speeds * 60), 1).astype(int)
+
+    updates, notify = [], []
+    for row, eta_minutes in zip(rows, minutes.tolist()):
+        delivery = Delivery(pk=row[0], estimated_arrival=now + timedelta(minutes=eta_minutes),
+                            eta_notified_arrival=row[7])
+        if should_notify(delivery.estimated_arrival, row[7], now):
+            delivery.eta_notified_arrival = delivery.estimated_arrival
+            notify.append((row[0], eta_minutes))
+        updates.append(delivery)
+
+    with transaction.atomic():
+        Delivery.objects.bulk_update(updates, ['estimated_arrival', 'eta_notified_arrival'], batch_size=500)
+        if notify:
+            transaction.on_commit(lambda: _send_updates(notify))
+
+    logger.info(f"Estimated ETAs for {len(updates)} deliveries, {len(notify)} customer updates queued")
+    return {'estimated': len(updates), 'notified': notify}
+
+
+def _send_updates(notify):
+    from .tasks import send_delivery_eta_update
+
+    for delivery_id, minutes in notify:
+        try:
+            send_delivery_eta_update.delay(delivery_id, minutes)
+        except Exception as e:
+            logger.warning(f"Could not queue ETA update for delivery {delivery_id}: {e}")
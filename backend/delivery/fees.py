@@ -0,0 +1,158 @@
+"""Shipping fee quotes.
+
+A tenant's ShippingFeeRule rows are loaded once into a FeeTable: per zone, the
+distance bands sorted by min_distance, so a quote is a dict lookup plus a
+bisect instead of a query and a loop over rules. Distance is the great-circle
+(haversine) distance from the tenant's business location to the address.
+
+Tables are kept per process and tagged with a version stored in the Django
+cache. Saving or deleting a rule bumps the tenant's version (see the signal
+receivers in delivery.models), so every process rebuilds its table on its next
+quote; a quote costs one cache read per call, not per address.
+
+Addresses whose zone has no band covering the distance fall back to the
+DELIVERY_DEFAULT_FEE_ZONE zone ("default" unless configured).
+"""
+import bisect
+import math
+import threading
+import uuid
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ShippingFeeRule
+
+EARTH_RADIUS_KM = 6371.0088
+CENT = Decimal('0.01')
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres between two points given in degrees."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _zone_key(zone):
+    return (zone or '').strip().lower()
+
+
+class FeeTable:
+    """Distance bands per zone for one tenant.
+
+    Each zone holds its rules sorted by min_distance, plus the running maximum
+    of max_distance so a lookup can stop as soon as no earlier band can reach
+    the distance. When bands overlap, the one starting furthest out wins.
+    """
+
+    def __init__(self, rules):
+        bands = defaultdict(list)
+        for rule in rules:
+            bands[_zone_key(rule.zone)].append(
+                (rule.min_distance, rule.max_distance, rule.pk, rule.base_fee, rule.per_km_fee))
+        self._zones = {}
+        for zone, zone_bands in bands.items():
+            zone_bands.sort()
+            reach, top = [], -math.inf
+            for band in zone_bands:
+                top = max(top, band[1])
+                reach.append(top)
+            self._zones[zone] = ([b[0] for b in zone_bands], reach, zone_bands)
+
+    def __len__(self):
+        return sum(len(bands) for _starts, _reach, bands in self._zones.values())
+
+    def find(self, zone, distance_km):
+        """Return (rule_id, base_fee, per_km_fee) for the band covering `distance_km`, or None."""
+        entry = self._zones.get(_zone_key(zone))
+        if entry is None:
+            return None
+        starts, reach, bands = entry
+        i = bisect.bisect_right(starts, distance_km) - 1
+        while i >= 0 and reach[i] >= distance_km:
+            min_distance, max_distance, rule_id, base_fee, per_km_fee = bands[i]
+            if max_distance >= distance_km:
+                return rule_id, base_fee, per_km_fee
+            i -= 1
+        return None
+
+
+def _version_key(tenant_id):
+    return f'delivery:fee-rules:{tenant_id}'
+
+
+def _current_version(tenant_id):
+    key = _version_key(tenant_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_fee_table(tenant_id):
+    """Make every process rebuild the tenant's FeeTable on its next quote."""
+    cache.set(_version_key(tenant_id), uuid.uuid4().hex, None)
+    with _tables_lock:
+        _tables.pop(tenant_id, None)
+
+
+def get_fee_table(tenant):
+    tenant_id = getattr(tenant, 'pk', tenant)
+    version = _current_version(tenant_id)
+    cached = _tables.get(tenant_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    table = FeeTable(ShippingFeeRule.objects.filter(tenant_id=tenant_id).only(
+        'id', 'zone', 'base_fee', 'per_km_fee', 'min_distance', 'max_distance'))
+    with _tables_lock:
+        _tables[tenant_id] = (version, table)
+    return table
+
+
+def _origin(tenant):
+    if tenant.business_latitude is None or tenant.business_longitude is None:
+        return None
+    return float(tenant.business_latitude), float(tenant.business_longitude)
+
+
+def _quote(table, origin, address, default_zone):
+    if origin is None or address.latitude is None or address.longitude is None:
+        return {'fee': None, 'distance_km': None, 'zone': address.zone, 'rule_id': None, 'error': 'missing_coordinates'}
+
+    distance = Decimal(str(haversine_km(origin[0], origin[1], address.latitude, address.longitude))).quantize(
+        CENT, rounding=ROUND_HALF_UP)
+    zone = address.zone
+    band = table.find(zone, distance)
+    if band is None:
+        zone = default_zone
+        band = table.find(zone, distance)
+    if band is None:
+        return {'fee': None, 'distance_km': distance, 'zone': zone, 'rule_id': None, 'error': 'no_matching_rule'}
+
+    rule_id, base_fee, per_km_fee = band
+    fee = (base_fee + distance * per_km_fee).quantize(CENT, rounding=ROUND_HALF_UP)
+    return {'fee': fee, 'distance_km': distance, 'zone': zone, 'rule_id': rule_id, 'error': None}
+
+
+def quote_fees(tenant, addresses):
+    """Quote many addresses (saved or unsaved Address instances) in one call.
+
+    Returns a list of dicts in the order given, each with fee, distance_km,
+    zone, rule_id and error (None, 'missing_coordinates' or 'no_matching_rule').
+    """
+    table = get_fee_table(tenant)
+    origin = _origin(tenant)
+    default_zone = getattr(settings, 'DELIVERY_DEFAULT_FEE_ZONE', 'default')
+    return [_quote(table, origin, address, default_zone) for address in addresses]
+
+
+def quote_fee(tenant, address):
+    """Fee for one address as a Decimal, or None when it cannot be quoted."""
+    return quote_fees(tenant, [address])[0]['fee']
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from delivery.models import Delivery, parse_order_reference
+from pos.models import Order
+
+
+class Command(BaseCommand):
+    help = ('Link deliveries to their pos.Order using the id in order_reference ("ORD-123"). '
+            'Only deliveries without an order are touched, and only orders of the same tenant are linked.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Count matches without saving')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        linked = unmatched = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                Delivery.objects.filter(order__isnull=True, pk__gt=last_pk)
+                .order_by('pk').values_list('pk', 'tenant_id', 'order_reference')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+
+            wanted = {pk: (tenant_id, parse_order_reference(reference)) for pk, tenant_id, reference in batch}
+            order_tenants = dict(
+                Order.objects.filter(pk__in={order_id for _t, order_id in wanted.values() if order_id})
+                .values_list('pk', 'tenant_id')
+            )
+            updates = [
+                Delivery(pk=pk, order_id=order_id)
+                for pk, (tenant_id, order_id) in wanted.items()
+                if order_id in order_tenants and order_tenants[order_id] == tenant_id
+            ]
+            linked += len(updates)
+            unmatched += len(batch) - len(updates)
+            if updates and not options['dry_run']:
+                with transaction.atomic():
+                    Delivery.objects.bulk_update(updates, ['order'])
+
+        verb = 'Would link' if options['dry_run'] else 'Linked'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {linked} deliveries to their orders; {unmatched} references did not match an order"
+        ))
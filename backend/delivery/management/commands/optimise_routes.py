@@ -0,0 +1,81 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from delivery.routing import distance_matrix, nearest_neighbour, plan_routes, route_length, two_opt
+from tenants.models import Tenant
+
+
+class Command(BaseCommand):
+    help = ('Plan and assign delivery routes for a tenant, or benchmark the solver on synthetic stops '
+            '(--synthetic N) and print solve time and total route distance.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('tenant', nargs='?', help='Tenant slug')
+        parser.add_argument('--max-stops', type=int, default=None)
+        parser.add_argument('--dry-run', action='store_true', help='Print the plan without assigning')
+        parser.add_argument('--synthetic', type=int, default=None,
+                            help='Benchmark on this many random stops instead of a tenant')
+        parser.add_argument('--zones', type=int, default=8, help='Zones for --synthetic')
+        parser.add_argument('--radius-km', type=float, default=25.0, help='Spread of --synthetic stops')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if options['synthetic']:
+            return self._benchmark(options)
+        if not options['tenant']:
+            raise CommandError('Give a tenant slug or --synthetic N')
+        try:
+            tenant = Tenant.objects.get(slug=options['tenant'])
+        except Tenant.DoesNotExist:
+            raise CommandError(f"Tenant '{options['tenant']}' not found")
+
+        from delivery.routing import optimise_routes
+        summary = optimise_routes(tenant, max_stops=options['max_stops'], dry_run=options['dry_run'])
+        for route in summary['routes']:
+            self.stdout.write(f"driver {route['driver_id']}: {len(route['delivery_ids'])} stops, "
+                              f"{route['distance_km']} km")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(summary['routes'])} routes, {summary['total_distance_km']} km, "
+            f"{len(summary['unassigned'])} unassigned, solved in {summary['solve_seconds']:.3f}s"
+        ))
+
+    def _benchmark(self, options):
+        rng = random.Random(options['seed'])
+        depot = (24.7136, 46.6753)
+        spread = options['radius_km'] / 111.0
+        stops = []
+        for i in range(options['synthetic']):
+            dlat, dlng = rng.uniform(-spread, spread), rng.uniform(-spread, spread)
+            # zones are pie slices around the depot, like districts around a store
+            zone = int((math.atan2(dlat, dlng) + math.pi) / (2 * math.pi) * options['zones']) % options['zones']
+            stops.append((i, f'zone-{zone}', depot[0] + dlat, depot[1] + dlng))
+        max_stops = options['max_stops'] or 30
+
+        started = time.monotonic()
+        baseline = plan_routes(depot, stops, max_stops, max_passes=0)
+        nn_seconds = time.monotonic() - started
+
+        started = time.monotonic()
+        routes = plan_routes(depot, stops, max_stops)
+        seconds = time.monotonic() - started
+
+        nn_km = sum(r['distance_km'] for r in baseline)
+        km = sum(r['distance_km'] for r in routes)
+        self.stdout.write(f"{len(stops)} stops, {len(routes)} routes of at most {max_stops} stops")
+        self.stdout.write(f"nearest-neighbour: {nn_km:.1f} km in {nn_seconds:.3f}s")
+        self.stdout.write(self.style.SUCCESS(
+            f"nearest-neighbour + 2-opt: {km:.1f} km in {seconds:.3f}s "
+            f"({100 * (nn_km - km) / nn_km:.1f}% shorter)"
+        ))
+
+        # one single route over every stop shows how 2-opt scales with route length
+        points = [depot] + [(s[2], s[3]) for s in stops]
+        dist = distance_matrix(points)
+        nn = nearest_neighbour(dist)
+        started = time.monotonic()
+        improved = two_opt(nn, dist)
+        seconds = time.monotonic() - started
+        self.stdout.write(f"single {len(stops)}-stop route: {route_length(nn, dist):.1f} km -> "
+                          f"{route_length(improved, dist):.1f} km after 2-opt in {seconds:.3f}s")
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0004_deliveryevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='route_id',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='route_sequence',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
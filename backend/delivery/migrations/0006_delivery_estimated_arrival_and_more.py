@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0002_alter_tenant_options_tenant_business_address_and_more'),
+        ('delivery', '0005_delivery_route_id_delivery_route_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='estimated_arrival',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='eta_notified_arrival',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='SpeedProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zone', models.CharField(blank=True, max_length=50)),
+                ('hourly_kmh', models.JSONField(default=list, help_text='24 speeds in km/h (local hour 0-23); null where data is thin')),
+                ('sample_km', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='speed_profiles', to='tenants.tenant')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='speedprofile',
+            constraint=models.UniqueConstraint(fields=('tenant', 'zone'), name='uniq_delivery_speed_profile'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0001_initial'),
+        ('delivery', '0006_delivery_estimated_arrival_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deliveries', to='pos.order'),
+        ),
+    ]
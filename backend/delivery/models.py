@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from tenants.models import Tenant
 
 
@@ -32,6 +34,12 @@ class Address(models.Model):
         return f"{self.label or self.line1 or 'Address'}"
 
 
+def parse_order_reference(reference):
+    """Order id from an order reference like "ORD-123" or "123", or None."""
+    tail = (reference or '').strip().rsplit('-', 1)[-1]
+    return int(tail) if tail.isdigit() else None
+
+
 class Delivery(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -44,12 +52,19 @@ class Delivery(models.Model):
 
     tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, null=True, blank=True)
     order_reference = models.CharField(max_length=200, db_index=True)
+    order = models.ForeignKey('pos.Order', null=True, blank=True, on_delete=models.SET_NULL, related_name='deliveries')
     tracking_number = models.CharField(max_length=200, blank=True, db_index=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     delivery_person = models.ForeignKey(DeliveryPersonnel, null=True, blank=True, on_delete=models.SET_NULL)
     address = models.ForeignKey(Address, null=True, blank=True, on_delete=models.SET_NULL)
     fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     expected_delivery = models.DateTimeField(null=True, blank=True)
+    # set by route optimisation (delivery.routing): the route and the stop's position on it
+    route_id = models.UUIDField(null=True, blank=True, db_index=True)
+    route_sequence = models.PositiveIntegerField(null=True, blank=True)
+    # latest arrival estimate (delivery.eta) and the estimate the customer was last emailed
+    estimated_arrival = models.DateTimeField(null=True, blank=True)
+    eta_notified_arrival = models.DateTimeField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -60,31 +75,79 @@ class Delivery(models.Model):
     def __str__(self):
         return f"Delivery {self.tracking_number or self.order_reference} ({self.status})"
 
-    def assign(self, delivery_person):
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.order_id is None:
+            # clients that only send "ORD-<id>" still get the order linked
+            order_id = parse_order_reference(self.order_reference)
+            if order_id is not None:
+                from pos.models import Order
+                self.order_id = Order.objects.filter(pk=order_id, tenant_id=self.tenant_id).values_list(
+                    'pk', flat=True).first()
+        super().save(*args, **kwargs)
+
+    def assign(self, delivery_person, actor=None):
         """Assign a delivery person and update status."""
-        self.delivery_person = delivery_person
-        self.status = 'assigned'
-        self.save()
+        from .state import transition
+        transition(self, 'assigned', actor=actor, delivery_person=delivery_person)
 
-    def mark_picked_up(self):
+    def mark_picked_up(self, actor=None):
         """Mark as picked up."""
-        self.status = 'picked_up'
-        self.save()
+        from .state import transition
+        transition(self, 'picked_up', actor=actor)
 
-    def mark_in_transit(self):
+    def mark_in_transit(self, actor=None):
         """Mark as in transit."""
-        self.status = 'in_transit'
-        self.save()
+        from .state import transition
+        transition(self, 'in_transit', actor=actor)
 
-    def mark_delivered(self):
+    def mark_delivered(self, actor=None):
         """Mark as delivered."""
-        self.status = 'delivered'
-        self.save()
+        from .state import transition
+        transition(self, 'delivered', actor=actor)
 
-    def mark_failed(self):
+    def mark_failed(self, actor=None):
         """Mark as failed."""
-        self.status = 'failed'
-        self.save()
+        from .state import transition
+        transition(self, 'failed', actor=actor)
+
+
+class DeliveryEvent(models.Model):
+    """One status change of a delivery; created_at is the time of the transition."""
+    delivery = models.ForeignKey(Delivery, on_delete=models.CASCADE, related_name='events')
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, null=True, blank=True)
+    from_status = models.CharField(max_length=20, choices=Delivery.STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=Delivery.STATUS_CHOICES)
+    actor = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL,
+                              related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['delivery', 'created_at']),
+            models.Index(fields=['tenant', 'to_status', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.delivery_id}: {self.from_status} -> {self.to_status}"
+
+
+class SpeedProfile(models.Model):
+    """Typical travel speed per hour of day for a tenant's zone (zone '' = whole tenant).
+
+    Rebuilt from drivers' LocationHistory by delivery.eta.rebuild_speed_profiles.
+    """
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name='speed_profiles')
+    zone = models.CharField(max_length=50, blank=True)
+    hourly_kmh = models.JSONField(default=list, help_text='24 speeds in km/h (local hour 0-23); null where data is thin')
+    sample_km = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['tenant', 'zone'], name='uniq_delivery_speed_profile')]
+
+    def __str__(self):
+        return f"{self.tenant_id} / {self.zone or '*'}"
 
 
 class ShippingFeeRule(models.Model):
@@ -118,3 +181,17 @@ class ShippingFeeRule(models.Model):
 
     def __str__(self):
         return f"Delivery {self.order_reference} - {self.status}"
+
+
+# Keep cached fee tables (delivery.fees) in step with the rules
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+
+@receiver([post_save, post_delete], sender=ShippingFeeRule)
+def invalidate_fee_rules(sender, instance, **kwargs):
+    from django.db import transaction
+    from .fees import invalidate_fee_table
+    tenant_id = instance.tenant_id
+    # after commit, so no process can rebuild its table from the old rows
+    transaction.on_commit(lambda: invalidate_fee_table(tenant_id))
@@ -0,0 +1,234 @@
+"""Batch route optimisation for pending deliveries.
+
+`optimise_routes` takes a tenant's pending deliveries that have address
+coordinates and its available drivers, and:
+
+1. groups the stops by address zone and splits each zone into routes of at
+   most DELIVERY_ROUTE_MAX_STOPS stops by sweeping around the depot (the
+   tenant's business location, or the stops' centroid when it is not set);
+2. orders every route with nearest-neighbour from the depot, then improves it
+   with 2-opt, both on a NumPy haversine distance matrix;
+3. gives the longest routes to the nearest free drivers, moves the deliveries
+   to "assigned" with one bulk transition, stores each stop's route id and
+   sequence on the delivery, and writes the DriverAssignment rows with one
+   bulk_create.
+
+Routes are open paths (depot -> last stop); drivers do not return to the depot.
+Stops that do not fit on a route for an available driver stay pending.
+"""
+import logging
+import math
+import time
+import uuid
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import Delivery
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+ACTIVE_ASSIGNMENT_STATUSES = ('assigned', 'accepted', 'started')
+
+
+def distance_matrix(points, targets=None):
+    """Haversine distances (km) from each of `points` to each of `targets` (default: `points`).
+
+    Both are sequences of (lat, lng) in degrees; the result has shape
+    (len(points), len(targets)).
+    """
+    points = np.radians(np.asarray(points, dtype=float))
+    targets = points if targets is None else np.radians(np.asarray(targets, dtype=float))
+    lat, lng = points[:, 0], points[:, 1]
+    tlat, tlng = targets[:, 0], targets[:, 1]
+    dlat = lat[:, None] - tlat[None, :]
+    dlng = lng[:, None] - tlng[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(tlat)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def route_length(order, dist):
+    order = np.asarray(order)
+    return float(dist[order[:-1], order[1:]].sum())
+
+
+def nearest_neighbour(dist, start=0):
+    """Visit order starting at `start`, always moving to the closest unvisited point."""
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    order = [start]
+    for _ in range(n - 1):
+        nxt = int(np.where(visited, np.inf, dist[order[-1]]).argmin())
+        visited[nxt] = True
+        order.append(nxt)
+    return order
+
+
+def two_opt(order, dist, max_passes=50):
+    """Improve an open path (first point fixed) by reversing segments while it gets shorter.
+
+    For each start position the gain of every possible segment end is computed
+    in one vectorised step and the best reversal is applied.
+    """
+    route = np.array(order)
+    n = len(route)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 1):
+            a, b = route[i - 1], route[i]
+            ends = route[i + 1:]
+            after = route[i + 2:]
+            # removing a-b and c-e, adding a-c and b-e; the last c has no e
+            delta = dist[a, ends] - dist[a, b]
+            delta[:-1] += dist[b, after] - dist[ends[:-1], after]
+            j = int(delta.argmin())
+            if delta[j] < -1e-9:
+                route[i:i + j + 2] = route[i:i + j + 2][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return route.tolist()
+
+
+def solve_route(depot, points, max_passes=50):
+    """Order `points` ((lat, lng) pairs) for a driver starting at `depot`.
+
+    Returns (indexes into points in visiting order, distance in km).
+    """
+    dist = distance_matrix([depot] + list(points))
+    order = two_opt(nearest_neighbour(dist), dist, max_passes=max_passes)
+    return [i - 1 for i in order[1:]], route_length(order, dist)
+
+
+def sweep_split(depot, points, parts):
+    """Split points into `parts` angular sectors around the depot, starting at the widest gap."""
+    if parts <= 1:
+        return [list(range(len(points)))]
+    pts = np.asarray(points, dtype=float)
+    angles = np.arctan2(pts[:, 0] - depot[0], (pts[:, 1] - depot[1]) * math.cos(math.radians(depot[0])))
+    order = np.argsort(angles)
+    gaps = np.diff(np.append(angles[order], angles[order][0] + 2 * math.pi))
+    order = np.roll(order, -(int(gaps.argmax()) + 1))
+    return [chunk.tolist() for chunk in np.array_split(order, parts)]
+
+
+def plan_routes(depot, stops, max_stops, max_passes=50):
+    """Build routes for `stops`, a list of (key, zone, lat, lng).
+
+    Returns a list of dicts with zone, keys (in visiting order) and
+    distance_km, longest route first.
+    """
+    by_zone = defaultdict(list)
+    for stop in stops:
+        by_zone[(stop[1] or '').strip().lower()].append(stop)
+
+    routes = []
+    for zone, zone_stops in by_zone.items():
+        points = [(s[2], s[3]) for s in zone_stops]
+        for chunk in sweep_split(depot, points, math.ceil(len(zone_stops) / max_stops)):
+            order, distance = solve_route(depot, [points[i] for i in chunk], max_passes=max_passes)
+            routes.append({
+                'zone': zone,
+                'keys': [zone_stops[chunk[i]][0] for i in order],
+                'start': points[chunk[order[0]]],
+                'distance_km': distance,
+            })
+    routes.sort(key=lambda r: -len(r['keys']))
+    return routes
+
+
+def _match_drivers(routes, drivers, depot):
+    """Pair routes (longest first) with the free driver closest to each route's first stop."""
+    free = list(drivers)
+    pairs = []
+    for route in routes:
+        if not free:
+            break
+        locations = [(lat, lng) if lat is not None and lng is not None else depot for _pk, lat, lng in free]
+        dist = distance_matrix([route['start']], locations)[0]
+        pairs.append((route, free.pop(int(dist.argmin()))[0]))
+    return pairs
+
+
+def _max_stops():
+    return getattr(settings, 'DELIVERY_ROUTE_MAX_STOPS', 30)
+
+
+def optimise_routes(tenant, max_stops=None, actor=None, dry_run=False):
+    """Plan and (unless dry_run) assign routes for a tenant's pending deliveries.
+
+    Returns a summary dict: routes (driver_id, route_id, delivery_ids,
+    distance_km), unassigned delivery ids, total_distance_km and solve_seconds.
+    """
+    from drivers.models import DriverAssignment, DriverProfile
+    from .state import bulk_transition
+
+    max_stops = max_stops or _max_stops()
+    stops = [
+        (pk, zone, float(lat), float(lng))
+        for pk, zone, lat, lng in Delivery.objects.filter(
+            tenant=tenant, status='pending',
+            address__latitude__isnull=False, address__longitude__isnull=False,
+        ).order_by('pk').values_list('pk', 'address__zone', 'address__latitude', 'address__longitude')
+    ]
+    drivers = list(
+        DriverProfile.objects.filter(assigned_businesses=tenant, status='available', is_active=True, is_blocked=False)
+        .exclude(assignments__status__in=ACTIVE_ASSIGNMENT_STATUSES)
+        .order_by('pk').distinct()
+        .values_list('pk', 'current_latitude', 'current_longitude')
+    )
+    summary = {'routes': [], 'unassigned': [s[0] for s in stops], 'total_distance_km': 0.0, 'solve_seconds': 0.0}
+    if not stops or not drivers:
+        return summary
+
+    if tenant.business_latitude is not None and tenant.business_longitude is not None:
+        depot = (float(tenant.business_latitude), float(tenant.business_longitude))
+    else:
+        depot = (sum(s[2] for s in stops) / len(stops), sum(s[3] for s in stops) / len(stops))
+
+    started = time.monotonic()
+    routes = plan_routes(depot, stops, max_stops)
+    pairs = _match_drivers(routes, [(pk, lat, lng) for pk, lat, lng in drivers], depot)
+    summary['solve_seconds'] = time.monotonic() - started
+
+    planned = {}
+    for route, driver_id in pairs:
+        route_id = uuid.uuid4()
+        for sequence, delivery_id in enumerate(route['keys'], start=1):
+            planned[delivery_id] = (driver_id, route_id, sequence)
+        summary['routes'].append({
+            'driver_id': driver_id, 'route_id': route_id,
+            'delivery_ids': route['keys'], 'distance_km': round(route['distance_km'], 3),
+        })
+
+    if not dry_run and planned:
+        with transaction.atomic():
+            moved = bulk_transition(Delivery.objects.filter(pk__in=planned), 'assigned', actor=actor)['updated']
+            rows = Delivery.objects.filter(pk__in=moved).only('pk', 'fee', 'tenant_id')
+            updates, assignments = [], []
+            for delivery in rows:
+                driver_id, route_id, sequence = planned[delivery.pk]
+                delivery.route_id, delivery.route_sequence = route_id, sequence
+                updates.append(delivery)
+                assignments.append(DriverAssignment(driver_id=driver_id, delivery_id=delivery.pk,
+                                                    business_id=tenant.pk, delivery_fee=delivery.fee))
+            Delivery.objects.bulk_update(updates, ['route_id', 'route_sequence'])
+            DriverAssignment.objects.bulk_create(assignments)
+        skipped = set(planned) - set(moved)
+        if skipped:
+            # changed status while we were solving; they drop out of their routes
+            for route in summary['routes']:
+                route['delivery_ids'] = [pk for pk in route['delivery_ids'] if pk not in skipped]
+            planned = {pk: v for pk, v in planned.items() if pk not in skipped}
+
+    summary['unassigned'] = [s[0] for s in stops if s[0] not in planned]
+    summary['total_distance_km'] = round(sum(r['distance_km'] for r in summary['routes']), 3)
+    logger.info(
+        f"Route optimisation for tenant {tenant.pk}: {len(planned)} stops on {len(summary['routes'])} routes, "
+        f"{summary['total_distance_km']} km, solved in {summary['solve_seconds']:.3f}s"
+    )
+    return summary
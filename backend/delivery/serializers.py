@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Delivery, DeliveryPersonnel, Address, ShippingFeeRule
+from .models import Delivery, DeliveryEvent, DeliveryPersonnel, Address, ShippingFeeRule
 
 
 class DeliveryPersonnelSerializer(serializers.ModelSerializer):
@@ -31,11 +31,20 @@ class DeliverySerializer(serializers.ModelSerializer):
     class Meta:
         model = Delivery
         fields = [
-            'id', 'order_reference', 'tracking_number', 'status',
+            'id', 'order_reference', 'order', 'tracking_number', 'status',
             'delivery_person', 'delivery_person_id', 'address', 'address_id',
-            'fee', 'expected_delivery', 'created_at', 'updated_at'
+            'fee', 'expected_delivery', 'route_id', 'route_sequence', 'estimated_arrival', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        # status only changes through the transition actions (see delivery.state)
+        read_only_fields = ['id', 'status', 'route_id', 'route_sequence', 'estimated_arrival', 'created_at', 'updated_at']
+
+    def validate_order(self, order):
+        request = self.context.get('request')
+        user = getattr(request, 'user', None)
+        if order is not None and user is not None and not user.is_superuser \
+                and order.tenant_id != getattr(user, 'tenant_id', None):
+            raise serializers.ValidationError('Order not found.')
+        return order
 
     def create(self, validated_data):
         delivery_person_id = validated_data.pop('delivery_person_id', None)
@@ -61,6 +70,12 @@ class DeliverySerializer(serializers.ModelSerializer):
         return instance
 
 
+class DeliveryEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeliveryEvent
+        fields = ['id', 'from_status', 'to_status', 'actor', 'created_at']
+
+
 class ShippingFeeRuleSerializer(serializers.ModelSerializer):
     class Meta:
         model = ShippingFeeRule
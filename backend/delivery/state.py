@@ -0,0 +1,128 @@
+"""Delivery status state machine.
+
+Every status change goes through `transition` (one delivery) or
+`bulk_transition` (many, e.g. a warehouse scan marking a batch picked up).
+Both validate the change against TRANSITIONS, write the new status with an
+UPDATE, record a DeliveryEvent per delivery (the event's created_at is the
+transition timestamp) and enqueue `notify_delivery_status_change` once the
+surrounding transaction commits, so no notification goes out for a change that
+was rolled back.
+
+`bulk_transition` costs one locking SELECT, one UPDATE and one bulk INSERT
+regardless of how many deliveries move; deliveries whose current status does
+not allow the change are skipped and reported back.
+"""
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Delivery, DeliveryEvent
+
+logger = logging.getLogger(__name__)
+
+# current status -> statuses it may move to
+TRANSITIONS = {
+    'pending': {'assigned', 'picked_up', 'in_transit', 'failed'},
+    'assigned': {'assigned', 'picked_up', 'in_transit', 'failed'},
+    'picked_up': {'in_transit', 'delivered', 'failed'},
+    'in_transit': {'delivered', 'failed'},
+    'delivered': set(),
+    'failed': {'pending', 'assigned'},
+}
+
+
+class InvalidTransition(ValueError):
+    """Raised when a delivery cannot move from its current status to the requested one."""
+
+    def __init__(self, from_status, to_status):
+        self.from_status = from_status
+        self.to_status = to_status
+        super().__init__(f"Cannot change delivery status from '{from_status}' to '{to_status}'")
+
+
+def allowed_sources(to_status):
+    """Statuses from which `to_status` can be reached."""
+    if to_status not in TRANSITIONS:
+        raise ValueError(f'Unknown delivery status: {to_status}')
+    return [status for status, targets in TRANSITIONS.items() if to_status in targets]
+
+
+def can_transition(from_status, to_status):
+    return to_status in TRANSITIONS.get(from_status, ())
+
+
+def _enqueue_notifications(changes):
+    from .tasks import notify_delivery_status_change
+
+    for delivery_id, old_status, new_status in changes:
+        try:
+            notify_delivery_status_change.delay(delivery_id, old_status, new_status)
+        except Exception:
+            # If Celery broker is unavailable (dev/test), notify synchronously
+            try:
+                notify_delivery_status_change.run(delivery_id, old_status, new_status)
+            except Exception as e:
+                logger.warning(f"Could not notify status change for delivery {delivery_id}: {e}")
+
+
+def transition(delivery, to_status, actor=None, delivery_person=None):
+    """Move one delivery to `to_status`, or raise InvalidTransition.
+
+    The row is locked while its current status is checked, so two concurrent
+    changes are applied one after the other. `delivery_person` is set together
+    with the status (used by assignment). Updates `delivery` in place and
+    returns the DeliveryEvent.
+    """
+    sources = allowed_sources(to_status)
+    now = timezone.now()
+    with transaction.atomic():
+        from_status = (
+            Delivery.objects.select_for_update().filter(pk=delivery.pk).values_list('status', flat=True).first()
+        )
+        if from_status is None:
+            raise Delivery.DoesNotExist(f'Delivery {delivery.pk} no longer exists')
+        if from_status not in sources:
+            raise InvalidTransition(from_status, to_status)
+
+        updates = {'status': to_status, 'updated_at': now}
+        if delivery_person is not None:
+            updates['delivery_person'] = delivery_person
+        Delivery.objects.filter(pk=delivery.pk).update(**updates)
+        event = DeliveryEvent.objects.create(
+            delivery_id=delivery.pk, tenant_id=delivery.tenant_id, from_status=from_status,
+            to_status=to_status, actor=actor, created_at=now)
+        changes = [(delivery.pk, from_status, to_status)]
+        transaction.on_commit(lambda: _enqueue_notifications(changes))
+
+    for field, value in updates.items():
+        setattr(delivery, field, value)
+    return event
+
+
+def bulk_transition(deliveries, to_status, actor=None):
+    """Move every delivery in the `deliveries` queryset that is allowed to reach `to_status`.
+
+    Returns {'updated': [ids], 'skipped': [ids]}, where skipped deliveries were
+    in a status that does not lead to `to_status`.
+    """
+    sources = allowed_sources(to_status)
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            deliveries.select_for_update().order_by('pk').values_list('pk', 'tenant_id', 'status')
+        )
+        movable = [row for row in rows if row[2] in sources]
+        skipped = [pk for pk, _tenant_id, status in rows if status not in sources]
+        if movable:
+            Delivery.objects.filter(pk__in=[pk for pk, _t, _s in movable]).update(status=to_status, updated_at=now)
+            DeliveryEvent.objects.bulk_create([
+                DeliveryEvent(delivery_id=pk, tenant_id=tenant_id, from_status=status,
+                              to_status=to_status, actor=actor, created_at=now)
+                for pk, tenant_id, status in movable
+            ])
+            changes = [(pk, status, to_status) for pk, _tenant_id, status in movable]
+            transaction.on_commit(lambda: _enqueue_notifications(changes))
+
+    logger.info(f"Bulk delivery transition to {to_status}: {len(movable)} updated, {len(skipped)} skipped")
+    return {'updated': [pk for pk, _t, _s in movable], 'skipped': skipped}
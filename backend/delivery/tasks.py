@@ -5,7 +5,7 @@ from celery import shared_task
 from django.core.mail import send_mail
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from notifications.models import Notification
+from notifications.dispatch import notify
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,6 +13,14 @@ logger = logging.getLogger(__name__)
 User = get_user_model()
 
 
+def _customer_email(delivery):
+    """Email of the customer on the delivery's order; expects `order__customer` to be select_related."""
+    order = delivery.order
+    if order is None or order.customer is None:
+        return None
+    return order.customer.email or None
+
+
 @shared_task(
     bind=True,
     autoretry_for=(Exception,),
@@ -34,7 +42,7 @@ def notify_delivery_status_change(self, delivery_id, old_status, new_status):
         from delivery.models import Delivery
         
         delivery = Delivery.objects.select_related(
-            'delivery_person', 'address', 'tenant'
+            'delivery_person', 'address', 'tenant', 'order__customer'
         ).get(id=delivery_id)
         
         # Status messages
@@ -48,32 +56,11 @@ def notify_delivery_status_change(self, delivery_id, old_status, new_status):
         }
         
         # Notify customer (via order)
-        customer_email = None
+        customer_email = _customer_email(delivery)
         try:
-            # Find order by order_reference
-            from pos.models import Order
-            order = Order.objects.filter(
-                tenant=delivery.tenant
-            ).select_related('customer').first()
-            
-            # Try to match by ID in order_reference (e.g., "ORD-123")
-            if delivery.order_reference:
-                try:
-                    order_id = int(delivery.order_reference.split('-')[-1])
-                    order = Order.objects.filter(
-                        id=order_id,
-                        tenant=delivery.tenant
-                    ).select_related('customer').first()
-                except (ValueError, IndexError):
-                    pass
-            
-            if order and order.customer:
-                customer = order.customer
-                customer_email = customer.email
-                
-                if customer_email:
-                    subject = f"Delivery Update - {delivery.tracking_number}"
-                    message = f"""
+            if customer_email:
+                subject = f"Delivery Update - {delivery.tracking_number}"
+                message = f"""
 Dear Customer,
 
 Your delivery status has been updated:
@@ -88,16 +75,16 @@ Delivery Address: {delivery.address.line1 if delivery.address else 'N/A'}
 
 Thank you for your business!
 """
-                    
-                    send_mail(
-                        subject=subject,
-                        message=message,
-                        from_email=settings.DEFAULT_FROM_EMAIL,
-                        recipient_list=[customer_email],
-                        fail_silently=True
-                    )
-                    
-                    logger.info(f"Customer email sent for delivery {delivery_id} status change: {old_status} -> {new_status}")
+                
+                send_mail(
+                    subject=subject,
+                    message=message,
+                    from_email=settings.DEFAULT_FROM_EMAIL,
+                    recipient_list=[customer_email],
+                    fail_silently=True
+                )
+                
+                logger.info(f"Customer email sent for delivery {delivery_id} status change: {old_status} -> {new_status}")
         except Exception as e:
             logger.warning(f"Could not notify customer for delivery {delivery_id}: {e}")
         
@@ -111,17 +98,15 @@ Thank you for your business!
                     email=delivery.delivery_person.phone  # Simplified - might need better matching
                 )[:1]
                 
-                for user in personnel_users:
-                    Notification.objects.create(
-                        recipient=user,
-                        title=f"Delivery Assignment - {delivery.tracking_number}",
-                        body=f"New delivery assigned. Address: {delivery.address.line1 if delivery.address else 'N/A'}",
-                        channel='in_app',
-                        data={
-                            'delivery_id': delivery_id,
-                            'tracking_number': delivery.tracking_number
-                        }
-                    )
+                notify(
+                    personnel_users,
+                    'delivery_assigned',
+                    data={
+                        'delivery_id': delivery_id,
+                        'tracking_number': delivery.tracking_number
+                    },
+                    context={'address': delivery.address.line1 if delivery.address else 'N/A'}
+                )
             except Exception as e:
                 logger.warning(f"Could not notify delivery person: {e}")
         
@@ -134,26 +119,15 @@ Thank you for your business!
                     is_active=True
                 )
                 
-                for manager in managers:
-                    Notification.objects.create(
-                        recipient=manager,
-                        title=f"Delivery Failed - {delivery.tracking_number}",
-                        body=f"Delivery failed for order. Please review and take action.",
-                        channel='email',
-                        data={
-                            'delivery_id': delivery_id,
-                            'tracking_number': delivery.tracking_number
-                        }
-                    )
-                    
-                    if manager.email:
-                        send_mail(
-                            subject=f"Delivery Failed - {delivery.tracking_number}",
-                            message=f"Delivery {delivery.tracking_number} has failed. Please review the details and take appropriate action.",
-                            from_email=settings.DEFAULT_FROM_EMAIL,
-                            recipient_list=[manager.email],
-                            fail_silently=True
-                        )
+                notify(
+                    managers,
+                    'delivery_failed',
+                    data={
+                        'delivery_id': delivery_id,
+                        'tracking_number': delivery.tracking_number
+                    },
+                    channels=['in_app', 'email']
+                )
             except Exception as e:
                 logger.error(f"Failed to notify managers about failed delivery: {e}")
         
@@ -170,6 +144,9 @@ Thank you for your business!
         raise
 
 
+OVERDUE_STATUSES = ['assigned', 'picked_up', 'in_transit']
+
+
 @shared_task(
     bind=True,
     autoretry_for=(Exception,),
@@ -180,78 +157,45 @@ def check_overdue_deliveries(self):
     """
     Check for deliveries that are overdue and send alerts.
     Run periodically (e.g., daily) to identify stuck deliveries.
+
+    Coordinator only: streams overdue delivery IDs ordered by tenant in one
+    query and queues one notify_overdue_deliveries task per tenant, so large
+    backlogs are alerted in parallel across workers.
     """
+    from itertools import groupby
+    from operator import itemgetter
     from django.utils import timezone
-    from datetime import timedelta
     from delivery.models import Delivery
     
     try:
         today = timezone.now().date()
         
         # Find deliveries that are overdue (expected_delivery in past, not delivered/failed)
-        overdue_deliveries = Delivery.objects.filter(
+        overdue = Delivery.objects.filter(
             expected_delivery__lt=today,
-            status__in=['assigned', 'picked_up', 'in_transit']
-        ).select_related('tenant', 'delivery_person')
-        
-        overdue_count = overdue_deliveries.count()
-        logger.info(f"Found {overdue_count} overdue deliveries")
-        
-        if overdue_count == 0:
-            return {'status': 'success', 'overdue_count': 0}
-        
-        # Group by tenant
-        tenants = {}
-        for delivery in overdue_deliveries:
-            tenant = delivery.tenant
-            if tenant not in tenants:
-                tenants[tenant] = []
-            tenants[tenant].append(delivery)
+            status__in=OVERDUE_STATUSES
+        ).order_by('tenant_id', 'pk').values_list('tenant_id', 'pk').iterator(chunk_size=5000)
         
-        notifications_sent = 0
+        overdue_count = tenants = queued = notifications_sent = 0
+        for tenant_id, rows in groupby(overdue, key=itemgetter(0)):
+            delivery_ids = [pk for _tenant_id, pk in rows]
+            overdue_count += len(delivery_ids)
+            tenants += 1
+            tenant_id = str(tenant_id) if tenant_id is not None else None
+            try:
+                notify_overdue_deliveries.delay(tenant_id, delivery_ids)
+                queued += 1
+            except Exception:
+                # If Celery broker is unavailable (dev/test), alert synchronously
+                notifications_sent += notify_overdue_deliveries.run(tenant_id, delivery_ids)['notifications_sent']
         
-        # Notify managers for each tenant
-        for tenant, deliveries in tenants.items():
-            managers = User.objects.filter(
-                tenant=tenant,
-                role__in=['owner', 'admin', 'manager'],
-                is_active=True
-            )
-            
-            delivery_list = "\n".join([
-                f"- {d.tracking_number}: Expected {d.expected_delivery}, Status: {d.status}"
-                for d in deliveries
-            ])
-            
-            for manager in managers:
-                try:
-                    Notification.objects.create(
-                        recipient=manager,
-                        title=f"Overdue Deliveries Alert: {len(deliveries)} deliveries",
-                        body=f"The following deliveries are overdue:\n\n{delivery_list}\n\nPlease review and update status.",
-                        channel='email',
-                        data={
-                            'overdue_count': len(deliveries),
-                            'delivery_ids': [d.id for d in deliveries]
-                        }
-                    )
-                    notifications_sent += 1
-                    
-                    if manager.email:
-                        send_mail(
-                            subject=f"Overdue Deliveries Alert - {len(deliveries)} items",
-                            message=f"Overdue deliveries:\n\n{delivery_list}",
-                            from_email=settings.DEFAULT_FROM_EMAIL,
-                            recipient_list=[manager.email],
-                            fail_silently=True
-                        )
-                        
-                except Exception as e:
-                    logger.error(f"Failed to notify manager about overdue deliveries: {e}")
+        logger.info(f"Found {overdue_count} overdue deliveries across {tenants} tenants, {queued} alert tasks queued")
         
         return {
             'status': 'success',
             'overdue_count': overdue_count,
+            'tenants': tenants,
+            'tasks_queued': queued,
             'notifications_sent': notifications_sent
         }
         
@@ -260,6 +204,62 @@ def check_overdue_deliveries(self):
         raise
 
 
+@shared_task(
+    bind=True,
+    autoretry_for=(Exception,),
+    retry_kwargs={'max_retries': 3, 'countdown': 120},
+    retry_backoff=True
+)
+def notify_overdue_deliveries(self, tenant_id, delivery_ids):
+    """
+    Alert a tenant's managers about its overdue deliveries in one
+    notifications.dispatch.notify batch (bulk insert, one SMTP connection).
+    
+    Args:
+        tenant_id: Tenant ID (None for deliveries without a tenant)
+        delivery_ids: IDs found overdue by check_overdue_deliveries
+    """
+    from delivery.models import Delivery
+    
+    # skip any that were delivered or failed since the sweep
+    deliveries = list(
+        Delivery.objects.filter(pk__in=delivery_ids, tenant_id=tenant_id, status__in=OVERDUE_STATUSES)
+        .order_by('expected_delivery', 'pk')
+        .values_list('pk', 'tracking_number', 'expected_delivery', 'status')
+    )
+    if not deliveries:
+        return {'status': 'skipped', 'reason': 'nothing_overdue', 'notifications_sent': 0}
+    
+    managers = User.objects.filter(
+        tenant_id=tenant_id,
+        role__in=['owner', 'admin', 'manager'],
+        is_active=True
+    )
+    
+    delivery_list = "\n".join([
+        f"- {tracking_number}: Expected {expected_delivery}, Status: {status}"
+        for _pk, tracking_number, expected_delivery, status in deliveries
+    ])
+    sent = notify(
+        managers,
+        'overdue_deliveries',
+        data={
+            'overdue_count': len(deliveries),
+            'delivery_ids': [d[0] for d in deliveries]
+        },
+        channels=['in_app', 'email'],
+        context={'delivery_list': delivery_list}
+    )
+    
+    return {
+        'status': 'success',
+        'tenant_id': tenant_id,
+        'overdue_count': len(deliveries),
+        'notifications_sent': sent['in_app'],
+        'emails_sent': sent['email']
+    }
+
+
 @shared_task(
     bind=True,
     autoretry_for=(Exception,),
@@ -278,32 +278,14 @@ def send_delivery_eta_update(self, delivery_id, estimated_minutes):
     try:
         from delivery.models import Delivery
         
-        delivery = Delivery.objects.select_related('address').get(id=delivery_id)
+        delivery = Delivery.objects.select_related('address', 'order__customer').get(id=delivery_id)
         
         if delivery.status not in ['picked_up', 'in_transit']:
             logger.warning(f"Delivery {delivery_id} not in transit, skipping ETA update")
             return {'status': 'skipped', 'reason': 'not_in_transit'}
         
         # Get customer email from related order
-        customer_email = None
-        try:
-            # Find order by order_reference
-            from pos.models import Order
-            if delivery.order_reference:
-                try:
-                    order_id = int(delivery.order_reference.split('-')[-1])
-                    order = Order.objects.filter(
-                        id=order_id,
-                        tenant=delivery.tenant
-                    ).select_related('customer').first()
-                    
-                    if order and order.customer:
-                        customer_email = order.customer.email
-                except (ValueError, IndexError):
-                    pass
-        except Exception as e:
-            logger.warning(f"Could not find order for delivery {delivery_id}: {e}")
-        
+        customer_email = _customer_email(delivery)
         if not customer_email:
             return {'status': 'skipped', 'reason': 'no_customer_email'}
         
@@ -347,3 +329,101 @@ Thank you!
     except Exception as e:
         logger.error(f"ETA update failed for delivery {delivery_id}: {e}")
         raise
+
+
+@shared_task(bind=True)
+def dispatch_pending_deliveries(self):
+    """
+    Fan out one dispatch tick per auto-dispatch tenant with pending deliveries.
+    Scheduled by Celery beat every few seconds; the per-tenant tasks run in
+    parallel on the worker pool. See delivery.dispatch.
+    """
+    from delivery.dispatch import dispatch_tenant_slugs
+    from delivery.models import Delivery
+
+    slugs = dispatch_tenant_slugs()
+    if not slugs:
+        return {'status': 'success', 'tenants': 0}
+
+    tenant_ids = list(
+        Delivery.objects.filter(tenant__slug__in=slugs, status='pending')
+        .order_by().values_list('tenant_id', flat=True).distinct()
+    )
+    for tenant_id in tenant_ids:
+        dispatch_tenant_deliveries.delay(str(tenant_id))
+    return {'status': 'success', 'tenants': len(tenant_ids)}
+
+
+# compare-and-delete: only the holder's token releases the lock
+_RELEASE_LOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+
+def _release_lock(cache, key, token):
+    """Delete `key` only while it still holds `token`.
+
+    A tick that outlived DISPATCH_LOCK_SECONDS must not delete the lock a newer
+    tick has taken since. Atomic on Django's Redis cache; other backends check
+    and delete in two steps.
+    """
+    backend = getattr(cache, '_cache', None)
+    if hasattr(backend, 'get_client') and hasattr(backend, '_serializer'):
+        backend.get_client(key, write=True).eval(
+            _RELEASE_LOCK_SCRIPT, 1, cache.make_and_validate_key(key), backend._serializer.dumps(token))
+    elif cache.get(key) == token:
+        cache.delete(key)
+
+
+@shared_task(bind=True)
+def dispatch_tenant_deliveries(self, tenant_id):
+    """
+    Run one dispatch tick for a tenant. A cache lock keeps overlapping ticks for
+    the same tenant from running side by side; across worker processes that
+    needs a shared cache (Redis, see CACHES), a per-process cache only
+    serialises ticks within one worker.
+    """
+    import uuid
+    from django.core.cache import cache
+    from delivery.dispatch import dispatch_tenant
+    from tenants.models import Tenant
+
+    lock_key = f'delivery:dispatch-lock:{tenant_id}'
+    token = uuid.uuid4().hex
+    if not cache.add(lock_key, token, timeout=getattr(settings, 'DISPATCH_LOCK_SECONDS', 60)):
+        return {'status': 'skipped', 'reason': 'tick_in_progress'}
+    try:
+        tenant = Tenant.objects.filter(pk=tenant_id).first()
+        if tenant is None:
+            return {'status': 'skipped', 'reason': 'tenant_not_found'}
+        offers = dispatch_tenant(tenant)
+        return {'status': 'success', 'tenant_id': tenant_id, 'offers': len(offers)}
+    finally:
+        _release_lock(cache, lock_key, token)
+
+
+@shared_task(bind=True)
+def estimate_delivery_etas(self):
+    """
+    Re-estimate ETAs for all in-transit deliveries (every minute) and queue
+    customer emails only for estimates that changed materially. See delivery.eta.
+    """
+    from delivery.eta import estimate_etas
+
+    result = estimate_etas()
+    return {'status': 'success', 'estimated': result['estimated'], 'notified': len(result['notified'])}
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(Exception,),
+    retry_kwargs={'max_retries': 3, 'countdown': 300},
+    retry_backoff=True
+)
+def rebuild_speed_profiles(self):
+    """
+    Rebuild per-zone, per-hour speed profiles from recent driver location history.
+    Runs nightly.
+    """
+    from delivery.eta import rebuild_speed_profiles as rebuild
+
+    written = rebuild()
+    return {'status': 'success', 'profiles': written}
@@ -16,6 +16,7 @@ from inventory.models import Product
 from pos.models import Order, OrderItem
 from payments.models import Payment
 from notifications.models import Notification
+from notifications.unread import tenant_unread
 
 
 @api_view(['GET'])
@@ -134,7 +135,7 @@ def dashboard_3d_metrics(request):
         "summary": {
             "total_orders": Order.objects.filter(tenant=tenant, created_at__range=[start_date, end_date]).count(),
             "active_deliveries": Delivery.objects.filter(tenant=tenant, status__in=['assigned', 'picked_up', 'in_transit']).count(),
-            "pending_notifications": Notification.objects.filter(recipient__tenant=tenant, read=False).count(),
+            "pending_notifications": tenant_unread(tenant),
         }
     })
 
@@ -1,11 +1,9 @@
 from celery import shared_task
 from django.contrib.auth import get_user_model
-from django.core.mail import send_mail
-from django.conf import settings
 from django.db.models import F, Q
 from decimal import Decimal
 from .models import Product
-from notifications.models import Notification
+from notifications.dispatch import notify
 import logging
 
 logger = logging.getLogger(__name__)
@@ -84,43 +82,23 @@ def check_low_stock_and_notify(self):
                 for p in products
             ])
             
-            title = f"Low Stock Alert: {len(products)} product(s) need reordering"
-            body = (
-                f"The following products have reached their low stock threshold:\n\n"
-                f"{product_list}\n\n"
-                f"Please review and reorder as necessary."
-            )
-            
-            # Send notifications
-            for user in users:
-                try:
-                    # Create in-app notification
-                    Notification.objects.create(
-                        recipient=user,
-                        title=title,
-                        body=body,
-                        channel='email',
-                        data={
-                            'tenant_id': tenant.id if tenant else None,
-                            'product_count': len(products),
-                            'product_ids': [p.id for p in products]
-                        }
-                    )
-                    notifications_sent += 1
-                    
-                    # Send email
-                    if user.email:
-                        send_mail(
-                            subject=title,
-                            message=body,
-                            from_email=settings.DEFAULT_FROM_EMAIL,
-                            recipient_list=[user.email],
-                            fail_silently=True
-                        )
-                        emails_sent += 1
-                        
-                except Exception as e:
-                    logger.error(f"Failed to notify user {user.id}: {e}")
+            # One batch per tenant: in-app rows, socket push and emails (see notifications.dispatch)
+            try:
+                sent = notify(
+                    users,
+                    'low_stock',
+                    data={
+                        'tenant_id': str(tenant.id) if tenant else None,
+                        'product_count': len(products),
+                        'product_ids': [p.id for p in products]
+                    },
+                    channels=['in_app', 'email'],
+                    context={'product_list': product_list}
+                )
+                notifications_sent += sent['in_app']
+                emails_sent += sent['email']
+            except Exception as e:
+                logger.error(f"Failed to notify tenant {tenant} about low stock: {e}")
         
         result = {
             'status': 'success',
@@ -168,14 +146,12 @@ def restock_product(self, product_id, quantity, notes=''):
                 is_active=True
             )
             
-            for user in users:
-                Notification.objects.create(
-                    recipient=user,
-                    title=f"Stock Replenished: {product.name}",
-                    body=f"{product.name} has been restocked. New quantity: {product.quantity} {product.unit}",
-                    channel='in_app',
-                    data={'product_id': product_id}
-                )
+            notify(
+                users,
+                'stock_replenished',
+                data={'product_id': product_id},
+                context={'product_name': product.name, 'quantity': product.quantity, 'unit': product.unit}
+            )
         
         return {
             'status': 'success',
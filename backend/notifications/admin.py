@@ -0,0 +1,24 @@
+from django.contrib import admin
+from .models import EmailDeadLetter, QueuedEmail
+
+
+@admin.register(QueuedEmail)
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt_at', 'created_at')
+    search_fields = ('subject',)
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'claimed_at')
+
+
+@admin.register(EmailDeadLetter)
+class EmailDeadLetterAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'attempts', 'last_error', 'queued_at', 'failed_at')
+    search_fields = ('subject', 'last_error')
+    readonly_fields = ('queued_at', 'failed_at')
+    actions = ['requeue']
+
+    def requeue(self, request, queryset):
+        from .mail import requeue_dead_letters
+        count = requeue_dead_letters(queryset)
+        self.message_user(request, f"{count} emails queued again")
+    requeue.short_description = "Queue selected emails again"
@@ -1,18 +1,85 @@
-import json
+import asyncio
+import time
+
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+
+from . import presence
 
 
 class NotificationsConsumer(AsyncJsonWebsocketConsumer):
+    """Pushes a user's notifications to their sockets.
+
+    Heartbeat: the server sends {"type": "ping"} every WS_HEARTBEAT_SECONDS and
+    closes (4008) sockets it has not heard from in WS_HEARTBEAT_TIMEOUT_SECONDS;
+    clients answer with any message, e.g. {"type": "pong"}. Each heartbeat also
+    refreshes the socket in the tenant's presence registry.
+
+    Backpressure: outgoing messages go through a queue of WS_SEND_QUEUE_SIZE
+    drained by one sender task, so a slow client never stalls the channel
+    layer. When the queue is full new notifications are dropped and the client
+    gets one {"type": "notification.resync"} once it catches up, telling it to
+    refetch over the REST API.
+    """
+
     async def connect(self):
-        if self.scope['user'].is_anonymous:
+        user = self.scope['user']
+        if user.is_anonymous:
             await self.close()
             return
-        self.group_name = f'user_{self.scope["user"].id}'
+        self.user_id = user.id
+        self.tenant_id = getattr(user, 'tenant_id', None)
+        self.group_name = f'user_{user.id}'
+        self.last_seen = time.monotonic()
+        self.outbox = asyncio.Queue(maxsize=getattr(settings, 'WS_SEND_QUEUE_SIZE', 100))
+        self.dropped = 0
+        self.tasks = []
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
+        if self.tenant_id:
+            await presence.touch(self.channel_layer, self.tenant_id, self.user_id, self.channel_name)
+        self.tasks += [asyncio.ensure_future(self._heartbeat()), asyncio.ensure_future(self._sender())]
 
     async def disconnect(self, code):
+        if not hasattr(self, 'group_name'):
+            return
+        for task in self.tasks:
+            task.cancel()
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if self.tenant_id:
+            await presence.leave(self.channel_layer, self.tenant_id, self.user_id, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        self.last_seen = time.monotonic()
+        if isinstance(content, dict) and content.get('type') == 'ping':
+            self._queue({'type': 'pong'})
 
     async def notification(self, event):
-        await self.send_json(event['payload'])
+        if not self._queue(event['payload']):
+            self.dropped += 1
+
+    def _queue(self, message):
+        try:
+            self.outbox.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _sender(self):
+        while True:
+            await self.send_json(await self.outbox.get())
+            if self.dropped and self.outbox.empty():
+                dropped, self.dropped = self.dropped, 0
+                await self.send_json({'type': 'notification.resync', 'dropped': dropped})
+
+    async def _heartbeat(self):
+        interval = getattr(settings, 'WS_HEARTBEAT_SECONDS', 30)
+        timeout = getattr(settings, 'WS_HEARTBEAT_TIMEOUT_SECONDS', 75)
+        while True:
+            await asyncio.sleep(interval)
+            if time.monotonic() - self.last_seen > timeout:
+                await self.close(code=4008)
+                return
+            self._queue({'type': 'ping'})
+            if self.tenant_id:
+                await presence.touch(self.channel_layer, self.tenant_id, self.user_id, self.channel_name)
@@ -0,0 +1,237 @@
+"""Central notification dispatcher.
+
+    notify(users, 'low_stock', data, channels=['in_app', 'email'], context={...})
+
+renders the template once for the whole recipient set and then, per channel:
+
+in_app
+    one bulk_create of Notification rows and one bump of the recipients'
+    unread counters (notifications.unread), then a group_send of each row to
+    the recipient's `user_<id>` group (notifications.consumers.NotificationsConsumer);
+email
+    one EmailMessage per recipient with an address, all handed to the email
+    backend in one call (one insert into the outbox, see notifications.mail);
+web_push
+    one send_web_push_notifications task for the whole set, which pushes to
+    all their subscriptions concurrently (notifications.webpush).
+
+Recipients are filtered through users.UserNotificationPreferences (one query
+for the whole set; users without a row get the model defaults): the template's
+topic preference (e.g. notify_delivery_updates) turns the notification off
+altogether, and in_app_notifications / email_notifications /
+push_notifications turn off single channels. Preferences belong to
+users.CustomUser, not AUTH_USER_MODEL; they apply to the user linked through
+CustomUser.account, and users without a linked profile get the defaults.
+Nothing links new profiles yet; users.0002 links existing ones and
+`manage.py link_user_accounts` links later ones, both by email within a tenant.
+
+Socket pushes, emails and web pushes are sent after the surrounding
+transaction commits, so clients never get told about rows they cannot read yet.
+"""
+import json
+import logging
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import QuerySet
+
+from .models import Notification, fingerprint
+from .unread import increment
+
+logger = logging.getLogger(__name__)
+
+CHANNELS = ('in_app', 'email', 'web_push')
+
+# UserNotificationPreferences field per channel
+CHANNEL_PREFERENCES = {
+    'in_app': 'in_app_notifications',
+    'email': 'email_notifications',
+    'web_push': 'push_notifications',
+}
+
+# name -> title, body (str.format templates over data + context) and the topic preference, if any
+TEMPLATES = {
+    'low_stock': {
+        'title': 'Low Stock Alert: {product_count} product(s) need reordering',
+        'body': ('The following products have reached their low stock threshold:\n\n'
+                 '{product_list}\n\n'
+                 'Please review and reorder as necessary.'),
+        'preference': None,
+    },
+    'stock_replenished': {
+        'title': 'Stock Replenished: {product_name}',
+        'body': '{product_name} has been restocked. New quantity: {quantity} {unit}',
+        'preference': None,
+    },
+    'delivery_assigned': {
+        'title': 'Delivery Assignment - {tracking_number}',
+        'body': 'New delivery assigned. Address: {address}',
+        'preference': 'notify_delivery_requests',
+    },
+    'delivery_failed': {
+        'title': 'Delivery Failed - {tracking_number}',
+        'body': 'Delivery {tracking_number} has failed. Please review the details and take appropriate action.',
+        'preference': 'notify_delivery_updates',
+    },
+    'overdue_deliveries': {
+        'title': 'Overdue Deliveries Alert: {overdue_count} deliveries',
+        'body': 'The following deliveries are overdue:\n\n{delivery_list}\n\nPlease review and update status.',
+        'preference': 'notify_delivery_updates',
+    },
+    'customer_export_ready': {
+        'title': 'Customer export ready',
+        'body': '{rows} customers exported as {export_format}.',
+        'preference': None,
+    },
+}
+
+
+def render(template, data=None, context=None):
+    """(title, body) for a registered template name or a {'title', 'body'} dict."""
+    spec = TEMPLATES[template] if isinstance(template, str) else template
+    values = {**(data or {}), **(context or {})}
+    return spec['title'].format_map(values), spec.get('body', '').format_map(values)
+
+
+def _recipients(users):
+    """Active (pk, email) rows for a queryset, model instances or primary keys."""
+    User = get_user_model()
+    if isinstance(users, QuerySet):
+        return list(users.filter(is_active=True).order_by().values_list('pk', 'email').distinct())
+    users = list(users)
+    if all(isinstance(u, User) for u in users):
+        return list({u.pk: (u.pk, u.email) for u in users if u.is_active}.values())
+    ids = [getattr(u, 'pk', u) for u in users]
+    return list(User.objects.filter(pk__in=ids, is_active=True).values_list('pk', 'email'))
+
+
+def _preferences(user_ids, topic):
+    """{user id: {channel: enabled}} for users who want this topic at all."""
+    from users.models import UserNotificationPreferences
+
+    fields = list(CHANNEL_PREFERENCES.values()) + ([topic] if topic else [])
+    defaults = {f: UserNotificationPreferences._meta.get_field(f).default for f in fields}
+    stored = {
+        row['user__account_id']: row
+        for row in UserNotificationPreferences.objects.filter(user__account_id__in=user_ids)
+        .values('user__account_id', *fields)
+    }
+    result = {}
+    for pk in user_ids:
+        prefs = stored.get(pk, defaults)
+        if topic and not prefs[topic]:
+            continue
+        result[pk] = {channel: prefs[field] for channel, field in CHANNEL_PREFERENCES.items()}
+    return result
+
+
+def notify(users, template, data=None, channels=('in_app',), context=None):
+    """Notify a set of users through the given channels.
+
+    `users` is a queryset, a list of users or a list of user ids; `template` a
+    name from TEMPLATES or a {'title', 'body', 'preference'} dict. `data` is
+    stored on the in-app rows and, together with `context`, fills the
+    template. Returns counts per channel plus the created in-app rows.
+    """
+    unknown = set(channels) - set(CHANNELS)
+    if unknown:
+        raise ValueError(f"Unknown notification channels: {', '.join(sorted(unknown))}")
+
+    result = {'recipients': 0, 'in_app': 0, 'email': 0, 'web_push': 0, 'notifications': []}
+    recipients = _recipients(users)
+    if not recipients:
+        return result
+
+    spec = TEMPLATES[template] if isinstance(template, str) else template
+    prefs = _preferences([pk for pk, _email in recipients], spec.get('preference'))
+    recipients = [r for r in recipients if r[0] in prefs]
+    result['recipients'] = len(recipients)
+    if not recipients:
+        return result
+
+    title, body = render(spec, data, context)
+    wants = {
+        channel: [(pk, email) for pk, email in recipients if prefs[pk][channel]]
+        for channel in channels
+    }
+
+    rows = []
+    if wants.get('in_app'):
+        digest = fingerprint(title, body, data, 'in_app')
+        rows = Notification.objects.bulk_create([
+            Notification(recipient_id=pk, title=title, body=body, data=data, channel='in_app', fingerprint=digest)
+            for pk, _email in wants['in_app']
+        ])
+        increment([pk for pk, _email in wants['in_app']])
+    emails = [email for _pk, email in wants.get('email', []) if email]
+    push_users = [pk for pk, _email in wants.get('web_push', [])]
+
+    result.update(in_app=len(rows), email=len(emails), web_push=len(push_users), notifications=rows)
+    transaction.on_commit(lambda: _deliver(rows, title, body, data, emails, push_users))
+    return result
+
+
+def _deliver(rows, title, body, data, emails, push_users):
+    if rows:
+        push_to_sockets(rows)
+    if emails:
+        send_emails(title, body, emails)
+    if push_users:
+        send_web_pushes(push_users, title, body, data)
+
+
+def push_to_sockets(rows):
+    """Send created Notification rows to their recipients' WebSocket groups."""
+    try:
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        layer = get_channel_layer()
+        if layer is None:
+            return
+        for row in rows:
+            async_to_sync(layer.group_send)(f'user_{row.recipient_id}', {
+                'type': 'notification',
+                'payload': {
+                    'type': 'notification.created',
+                    'id': row.pk,
+                    'title': row.title,
+                    'body': row.body,
+                    'data': row.data,
+                    'channel': row.channel,
+                    'created_at': row.created_at.isoformat() if row.created_at else None,
+                },
+            })
+    except Exception as e:
+        logger.warning(f"Could not push notifications to sockets: {e}")
+
+
+def send_emails(subject, body, emails):
+    """One message per address, all handed to the email backend at once. Returns the number accepted."""
+    from django.core.mail import EmailMessage, get_connection
+
+    messages = [
+        EmailMessage(subject=subject, body=body, from_email=settings.DEFAULT_FROM_EMAIL, to=[email])
+        for email in emails
+    ]
+    try:
+        with get_connection(fail_silently=True) as connection:
+            return connection.send_messages(messages) or 0
+    except Exception as e:
+        logger.error(f"Failed to send notification emails: {e}")
+        return 0
+
+
+def send_web_pushes(user_ids, title, body, data=None):
+    """Queue one web push fan-out over all subscriptions of the given users (see notifications.webpush)."""
+    from .tasks import send_web_push_notifications
+
+    payload = json.dumps({'title': title, 'body': body, 'data': data}, default=str)
+    try:
+        send_web_push_notifications.delay(list(user_ids), payload)
+    except Exception:
+        # If Celery broker is unavailable (dev/test), push synchronously
+        try:
+            send_web_push_notifications.run(list(user_ids), payload)
+        except Exception as e:
+            logger.warning(f"Could not send web pushes: {e}")
@@ -0,0 +1,279 @@
+"""Queued email delivery.
+
+With EMAIL_BACKEND = 'notifications.mail.QueuedEmailBackend' every send_mail /
+EmailMessage.send() in the project only inserts QueuedEmail rows (one
+bulk_create per call) and schedules a flush after commit. Tasks never talk to
+SMTP themselves.
+
+`flush_queue` (run by notifications.tasks.flush_email_queue) claims a batch of
+due rows with SKIP LOCKED, sends them one after another over this worker's
+pooled connection to EMAIL_DELIVERY_BACKEND, and
+
+- deletes the rows that went out;
+- reschedules failures with exponential backoff (EMAIL_RETRY_BASE_SECONDS);
+- moves rows to EmailDeadLetter after EMAIL_MAX_ATTEMPTS, or straight away
+  when the server refuses the sender or every recipient.
+
+Sending is throttled to EMAIL_RATE_LIMIT_PER_SECOND across all workers with a
+counter per second in the Django cache.
+
+The pooled connection stays open between flushes and is replaced when it has
+been idle for EMAIL_CONNECTION_IDLE_SECONDS or the server dropped it.
+"""
+import base64
+import logging
+import smtplib
+import threading
+import time
+from datetime import timedelta
+from email.mime.base import MIMEBase
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_FIELDS = ('subject', 'body', 'from_email', 'to', 'cc', 'bcc', 'reply_to', 'headers',
+                  'alternatives', 'attachments')
+
+# the server answered and said no; retrying the same message will not help
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _attachment(attachment):
+    if isinstance(attachment, MIMEBase):
+        filename, content, mimetype = (attachment.get_filename(), attachment.get_payload(decode=True),
+                                       attachment.get_content_type())
+    else:
+        filename, content, mimetype = attachment
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return [filename, base64.b64encode(content).decode('ascii'), mimetype]
+
+
+def message_fields(message):
+    """QueuedEmail field values for an EmailMessage."""
+    return {
+        'subject': message.subject,
+        'body': message.body,
+        'from_email': message.from_email or settings.DEFAULT_FROM_EMAIL,
+        'to': list(message.to),
+        'cc': list(message.cc),
+        'bcc': list(message.bcc),
+        'reply_to': list(message.reply_to),
+        'headers': dict(message.extra_headers),
+        'alternatives': [list(a) for a in getattr(message, 'alternatives', [])],
+        'attachments': [_attachment(a) for a in message.attachments],
+    }
+
+
+def build_message(row, connection=None):
+    """EmailMessage for a QueuedEmail / EmailDeadLetter row."""
+    message = EmailMultiAlternatives(
+        subject=row.subject, body=row.body, from_email=row.from_email, to=row.to, cc=row.cc, bcc=row.bcc,
+        reply_to=row.reply_to, headers=row.headers, connection=connection,
+        alternatives=[tuple(a) for a in row.alternatives],
+    )
+    for filename, content, mimetype in row.attachments:
+        message.attach(filename, base64.b64decode(content), mimetype)
+    return message
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    """Email backend that queues messages in the QueuedEmail table instead of sending them."""
+
+    def send_messages(self, email_messages):
+        from .models import QueuedEmail
+
+        rows = [QueuedEmail(**message_fields(m)) for m in email_messages if m.recipients()]
+        if not rows:
+            return 0
+        try:
+            QueuedEmail.objects.bulk_create(rows)
+        except Exception:
+            if not self.fail_silently:
+                raise
+            logger.exception("Could not queue emails")
+            return 0
+        transaction.on_commit(schedule_flush)
+        return len(rows)
+
+
+def schedule_flush():
+    """Queue one flush a few seconds from now, so messages queued meanwhile go out in the same batch."""
+    from .tasks import flush_email_queue
+
+    delay = _setting('EMAIL_QUEUE_FLUSH_DELAY_SECONDS', 5)
+    if not cache.add('notifications:email-flush-scheduled', 1, timeout=delay):
+        return
+    try:
+        flush_email_queue.apply_async(countdown=delay)
+    except Exception:
+        # If Celery broker is unavailable (dev/test), flush synchronously
+        cache.delete('notifications:email-flush-scheduled')
+        try:
+            flush_email_queue.run()
+        except Exception as e:
+            logger.warning(f"Could not flush email queue: {e}")
+
+
+class ConnectionPool:
+    """One open delivery connection per worker thread, reused across flushes."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def connection(self):
+        idle = _setting('EMAIL_CONNECTION_IDLE_SECONDS', 60)
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and time.monotonic() - self._local.used_at > idle:
+            self.discard()
+            conn = None
+        if conn is None:
+            conn = get_connection(_setting('EMAIL_DELIVERY_BACKEND', 'django.core.mail.backends.smtp.EmailBackend'))
+            conn.open()
+            self._local.conn = conn
+        self._local.used_at = time.monotonic()
+        return conn
+
+    def discard(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+pool = ConnectionPool()
+
+
+def send_pooled(message):
+    """Send one message over the pooled connection, reconnecting once if the server dropped it."""
+    for attempt in (1, 2):
+        connection = pool.connection()
+        try:
+            message.connection = connection
+            if not connection.send_messages([message]):
+                raise smtplib.SMTPException('Message was not accepted')
+            return
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError):
+            pool.discard()
+            if attempt == 2:
+                raise
+        except smtplib.SMTPException:
+            # the server answered; the connection is still good, the message is not
+            raise
+        except OSError:
+            pool.discard()
+            if attempt == 2:
+                raise
+
+
+class RateLimiter:
+    """At most `per_second` sends per wall-clock second across workers sharing the cache."""
+
+    def __init__(self, per_second):
+        self.per_second = per_second
+
+    def wait(self):
+        if not self.per_second:
+            return
+        while True:
+            now = time.time()
+            key = f'notifications:email-rate:{int(now)}'
+            cache.add(key, 0, timeout=2)
+            try:
+                count = cache.incr(key)
+            except ValueError:
+                count = 1
+            if count <= self.per_second:
+                return
+            time.sleep(max(int(now) + 1 - time.time(), 0.01))
+
+
+def _claim_batch(batch_size, now):
+    from .models import QueuedEmail
+
+    stale = now - timedelta(seconds=_setting('EMAIL_CLAIM_TIMEOUT_SECONDS', 600))
+    with transaction.atomic():
+        ids = list(
+            QueuedEmail.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='pending', next_attempt_at__lte=now) | Q(status='sending', claimed_at__lt=stale))
+            .order_by('next_attempt_at', 'id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if ids:
+            QueuedEmail.objects.filter(id__in=ids).update(status='sending', claimed_at=now,
+                                                          attempts=F('attempts') + 1)
+    return list(QueuedEmail.objects.filter(id__in=ids).order_by('next_attempt_at', 'id'))
+
+
+def flush_queue(batch_size=None, now=None):
+    """Send one batch of due emails. Returns counts of claimed, sent, retried and dead-lettered rows."""
+    from .models import EmailDeadLetter, QueuedEmail
+
+    now = now or timezone.now()
+    batch_size = batch_size or _setting('EMAIL_QUEUE_BATCH_SIZE', 200)
+    rows = _claim_batch(batch_size, now)
+    result = {'claimed': len(rows), 'sent': 0, 'retried': 0, 'dead': 0}
+    if not rows:
+        return result
+
+    limiter = RateLimiter(_setting('EMAIL_RATE_LIMIT_PER_SECOND', 50))
+    max_attempts = _setting('EMAIL_MAX_ATTEMPTS', 5)
+    retry_base = _setting('EMAIL_RETRY_BASE_SECONDS', 60)
+    sent, retry, dead = [], [], []
+    for row in rows:
+        limiter.wait()
+        try:
+            send_pooled(build_message(row))
+            sent.append(row.pk)
+        except Exception as e:
+            row.last_error = f"{type(e).__name__}: {e}"[:2000]
+            if isinstance(e, PERMANENT_ERRORS) or row.attempts >= max_attempts:
+                dead.append(row)
+            else:
+                row.status = 'pending'
+                row.next_attempt_at = now + timedelta(seconds=retry_base * 2 ** (row.attempts - 1))
+                retry.append(row)
+
+    with transaction.atomic():
+        if retry:
+            QueuedEmail.objects.bulk_update(retry, ['status', 'next_attempt_at', 'last_error'])
+        if dead:
+            EmailDeadLetter.objects.bulk_create([
+                EmailDeadLetter(attempts=row.attempts, last_error=row.last_error, queued_at=row.created_at,
+                                **{f: getattr(row, f) for f in MESSAGE_FIELDS})
+                for row in dead
+            ])
+        QueuedEmail.objects.filter(pk__in=sent + [row.pk for row in dead]).delete()
+
+    for row in dead:
+        logger.error(f"Email {row.pk} to {', '.join(row.to)} moved to dead letters: {row.last_error}")
+    result.update(sent=len(sent), retried=len(retry), dead=len(dead))
+    return result
+
+
+def requeue_dead_letters(dead_letters):
+    """Put dead letters back on the queue (e.g. after fixing a bad address). Returns the number requeued."""
+    from .models import EmailDeadLetter, QueuedEmail
+
+    dead_letters = list(dead_letters)
+    with transaction.atomic():
+        QueuedEmail.objects.bulk_create([
+            QueuedEmail(**{f: getattr(d, f) for f in MESSAGE_FIELDS}) for d in dead_letters
+        ])
+        EmailDeadLetter.objects.filter(pk__in=[d.pk for d in dead_letters]).delete()
+        transaction.on_commit(schedule_flush)
+    return len(dead_letters)
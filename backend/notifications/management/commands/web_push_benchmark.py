@@ -0,0 +1,85 @@
+import base64
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+
+class _PushServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _PushService(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.latency)
+        # every `gone_every`-th subscription has expired
+        number = int(self.path.rsplit('/', 1)[-1])
+        gone_every = self.server.gone_every
+        self.send_response(410 if gone_every and number % gone_every == 0 else 201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+class Command(BaseCommand):
+    help = ('Benchmark web push fan-out (encryption, VAPID headers, concurrent HTTP) against a local '
+            'push service stand-in and print pushes per second. Nothing is written to the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscriptions', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=32, help='WEB_PUSH_MAX_WORKERS for the run')
+        parser.add_argument('--latency-ms', type=int, default=50, help='Simulated push service round trip')
+        parser.add_argument('--gone-every', type=int, default=50, help='Answer 410 for every Nth subscription')
+
+    def handle(self, *args, **options):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from py_vapid import Vapid
+        from notifications import webpush
+
+        server = _PushServer(('127.0.0.1', 0), _PushService)
+        server.gone_every = options['gone_every']
+        server.latency = options['latency_ms'] / 1000
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{server.server_address[1]}/push'
+
+        vapid = Vapid()
+        vapid.generate_keys()
+        vapid_key = _b64(vapid.private_key.private_numbers().private_value.to_bytes(32, 'big'))
+        subscriptions = []
+        for i in range(1, options['subscriptions'] + 1):
+            public = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+                serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+            # ids that do not exist, so pruning deletes nothing
+            subscriptions.append((-i, f'{base}/{i}', {'p256dh': _b64(public), 'auth': _b64(os.urandom(16))}))
+
+        payload = '{"title": "Benchmark", "body": "Web push fan-out benchmark"}'
+        try:
+            with override_settings(VAPID_PRIVATE_KEY=vapid_key, WEB_PUSH_MAX_WORKERS=options['workers']):
+                webpush._state.update(executor=None, session=None)
+                started = time.monotonic()
+                result = webpush.send_to_subscriptions(subscriptions, payload)
+                seconds = time.monotonic() - started
+        finally:
+            webpush._state.update(executor=None, session=None)
+            server.shutdown()
+            server.server_close()
+
+        self.stdout.write(f"{len(subscriptions)} subscriptions, {options['workers']} workers, "
+                          f"{options['latency_ms']}ms latency: {result}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{seconds:.2f}s, {len(subscriptions) / seconds:.0f} pushes/s"
+        ))
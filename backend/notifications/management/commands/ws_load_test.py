@@ -0,0 +1,84 @@
+import asyncio
+import json
+import resource
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+
+class Command(BaseCommand):
+    help = ('Hold N concurrent notification sockets in this process (JWT handshake, presence, heartbeat '
+            'tasks) over the ASGI interface, push one notification to each and report timings and memory. '
+            'Uses the configured channel layer (Redis) unless --in-memory is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=10000)
+        parser.add_argument('--tenants', type=int, default=20)
+        # the in-memory layer sweeps every channel for expired messages on each operation, so it
+        # slows down quadratically beyond a few thousand sockets; it is fine for quick local runs
+        parser.add_argument('--in-memory', action='store_true', help='Use the in-memory channel layer')
+
+    def handle(self, *args, **options):
+        if not options['in_memory']:
+            return async_to_sync(self.run)(options)
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}):
+            return async_to_sync(self.run)(options)
+
+    async def run(self, options):
+        from asgiref.testing import ApplicationCommunicator
+        from channels.layers import get_channel_layer
+        from channels.routing import URLRouter
+        from rest_framework_simplejwt.tokens import AccessToken
+        from notifications import presence
+        from notifications.middleware import JWTAuthMiddlewareStack
+        from notifications.routing import websocket_urlpatterns
+
+        count, tenants = options['connections'], options['tenants']
+        app = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        layer = get_channel_layer()
+
+        def token(user_id):
+            # synthetic users: the token carries everything the handshake needs
+            t = AccessToken()
+            t['user_id'] = user_id
+            t['tenant_id'] = f'load-{user_id % tenants}'
+            return str(t)
+
+        sockets = [
+            ApplicationCommunicator(app, {'type': 'websocket', 'path': '/ws/notifications/', 'headers': [],
+                                          'query_string': f'token={token(i)}'.encode(), 'subprotocols': []})
+            for i in range(1, count + 1)
+        ]
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        async def connect(socket):
+            await socket.send_input({'type': 'websocket.connect'})
+            return (await socket.receive_output(30))['type'] == 'websocket.accept'
+
+        started = time.monotonic()
+        accepted = sum(await asyncio.gather(*(connect(s) for s in sockets)))
+        connect_seconds = time.monotonic() - started
+        online = sum([len(await presence.online(layer, f'load-{t}')) for t in range(tenants)])
+
+        started = time.monotonic()
+        for i in range(1, count + 1):
+            await layer.group_send(f'user_{i}', {'type': 'notification', 'payload': {'id': i}})
+        received = await asyncio.gather(*(s.receive_output(30) for s in sockets))
+        push_seconds = time.monotonic() - started
+        delivered = sum(1 for i, m in enumerate(received, 1) if json.loads(m['text']).get('id') == i)
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        for socket in sockets:
+            await socket.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.gather(*(s.wait(30) for s in sockets), return_exceptions=True)
+
+        self.stdout.write(f"{accepted}/{count} sockets accepted in {connect_seconds:.2f}s "
+                          f"({accepted / connect_seconds:.0f}/s), {online} online in presence")
+        self.stdout.write(f"{delivered}/{count} notifications delivered in {push_seconds:.2f}s "
+                          f"({delivered / push_seconds:.0f}/s)")
+        self.stdout.write(self.style.SUCCESS(
+            f"~{(rss_after - rss_before) / max(accepted, 1):.1f} KiB per socket "
+            f"(max RSS {rss_after / 1024:.0f} MiB)"
+        ))
@@ -0,0 +1,92 @@
+"""JWT authentication for WebSocket connections.
+
+Browsers cannot set headers on a WebSocket handshake, so the access token comes
+as `?token=<jwt>`; other clients may send the usual `Authorization: Bearer`
+header. The token is checked (signature, expiry, token type) by SimpleJWT and
+turned into a stateless TokenUser without loading the user. The tenant comes
+from the token's `tenant_id` claim (accounts.tokens); older tokens without it
+cost one lookup per user every WS_TENANT_CACHE_SECONDS. Revoked tokens are
+checked against the database and refused for deactivated users.
+
+Connections without a token fall through to Channels' session-based
+AuthMiddlewareStack, so logged-in browser sessions keep working.
+"""
+import logging
+from urllib.parse import parse_qs
+
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+def _raw_token(scope):
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+    if token:
+        return token[0]
+    header_types = settings.SIMPLE_JWT.get('AUTH_HEADER_TYPES', ('Bearer',))
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode('latin1').split()
+            if len(parts) == 2 and parts[0] in header_types:
+                return parts[1]
+    return None
+
+
+def _tenant_id(user_id):
+    from django.contrib.auth import get_user_model
+
+    key = f'ws:tenant:{user_id}'
+    tenant_id = cache.get(key)
+    if tenant_id is None:
+        tenant_id = get_user_model().objects.filter(pk=user_id).values_list('tenant_id', flat=True).first()
+        tenant_id = str(tenant_id) if tenant_id else ''
+        cache.set(key, tenant_id, getattr(settings, 'WS_TENANT_CACHE_SECONDS', 300))
+    return tenant_id or None
+
+
+async def authenticate(raw_token):
+    """A TokenUser (with `tenant_id`) for a valid access token, else AnonymousUser."""
+    from accounts.tokens import TENANT_CLAIM, is_revoked, user_claims
+    from rest_framework_simplejwt.exceptions import TokenError
+    from rest_framework_simplejwt.models import TokenUser
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    try:
+        token = AccessToken(raw_token)
+    except TokenError as e:
+        logger.info(f"Rejected WebSocket token: {e}")
+        return AnonymousUser()
+    user = TokenUser(token)
+    if is_revoked(token):
+        # role / tenant changed or user deactivated since the token was issued
+        claims = await database_sync_to_async(user_claims)(user)
+        if claims is None:
+            return AnonymousUser()
+        tenant_id = claims[TENANT_CLAIM]
+    elif token.get(TENANT_CLAIM) is None:
+        tenant_id = await database_sync_to_async(_tenant_id)(user.id)
+    else:
+        tenant_id = token[TENANT_CLAIM]
+    user.tenant_id = tenant_id
+    return user
+
+
+class JWTAuthMiddleware:
+    def __init__(self, inner):
+        self.inner = inner
+        self.session_stack = AuthMiddlewareStack(inner)
+
+    async def __call__(self, scope, receive, send):
+        raw_token = _raw_token(scope)
+        if raw_token is None:
+            return await self.session_stack(scope, receive, send)
+        scope = dict(scope, user=await authenticate(raw_token))
+        return await self.inner(scope, receive, send)
+
+
+def JWTAuthMiddlewareStack(inner):
+    return JWTAuthMiddleware(inner)
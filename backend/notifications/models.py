@@ -1,7 +1,17 @@
+import hashlib
+import json
+
 from django.db import models
+from django.utils import timezone
 from django.conf import settings
 
 
+def fingerprint(title, body, data, channel):
+    """Hash identifying identical notifications, used to fold repeats into one row."""
+    raw = json.dumps([title, body, data, channel], sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
 class Notification(models.Model):
     CHANNEL_CHOICES = [
         ('email', 'Email'),
@@ -16,13 +26,44 @@ class Notification(models.Model):
     read = models.BooleanField(default=False)
     channel = models.CharField(max_length=20, choices=CHANNEL_CHOICES, default='in_app')
     created_at = models.DateTimeField(auto_now_add=True)
+    # identical repeats are folded into the newest row by notifications.retention
+    fingerprint = models.CharField(max_length=40, blank=True, default='')
+    occurrences = models.PositiveIntegerField(default=1)
+    first_occurred_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', 'fingerprint'], name='notif_recipient_fingerprint'),
+            # unread lists and recounts
+            models.Index(fields=['recipient', 'read', 'created_at'], name='notif_recipient_read_created'),
+            # keyset pages of a user's notifications, newest first
+            models.Index(fields=['recipient', '-created_at', '-id'], name='notif_recipient_created'),
+        ]
 
     def __str__(self):
         return f"Notification to {self.recipient} - {self.title}"
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if not self.fingerprint:
+            self.fingerprint = fingerprint(self.title, self.body, self.data, self.channel)
+        super().save(*args, **kwargs)
+        if adding and not self.read:
+            from .unread import increment
+            increment([self.recipient_id])
+
+
+class UnreadCounter(models.Model):
+    """Number of unread notifications of a user, kept up to date by notifications.unread."""
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+                                related_name='unread_notifications')
+    unread = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.unread} unread notifications for {self.user_id}"
+
 
 class Subscription(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='push_subscriptions')
@@ -35,3 +76,68 @@ class Subscription(models.Model):
 
     def __str__(self):
         return f"Subscription for {self.user} - {self.endpoint[:40]}"
+
+
+class QueuedEmail(models.Model):
+    """Outbox row for an email.
+
+    The queued email backend (notifications.mail.QueuedEmailBackend) only
+    inserts here; `notifications.tasks.flush_email_queue` sends pending rows in
+    batches over a pooled SMTP connection and deletes them once sent. Rows that
+    keep failing are moved to EmailDeadLetter.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+    ]
+
+    subject = models.CharField(max_length=998)
+    body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    reply_to = models.JSONField(default=list, blank=True)
+    headers = models.JSONField(default=dict, blank=True)
+    # [content, mimetype] pairs, e.g. the HTML part of send_mail(html_message=...)
+    alternatives = models.JSONField(default=list, blank=True)
+    # [filename, base64 content, mimetype] triples
+    attachments = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"Email to {', '.join(self.to)} - {self.subject}"
+
+
+class EmailDeadLetter(models.Model):
+    """An email that could not be delivered after EMAIL_MAX_ATTEMPTS tries (or was refused outright)."""
+
+    subject = models.CharField(max_length=998)
+    body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    reply_to = models.JSONField(default=list, blank=True)
+    headers = models.JSONField(default=dict, blank=True)
+    alternatives = models.JSONField(default=list, blank=True)
+    attachments = models.JSONField(default=list, blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    queued_at = models.DateTimeField()
+    failed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-failed_at']
+
+    def __str__(self):
+        return f"Undelivered email to {', '.join(self.to)} - {self.subject}"
@@ -0,0 +1,76 @@
+"""Who is connected to the notifications WebSocket, per tenant.
+
+Every open socket is one member `<user_id>:<channel name>` of its tenant's
+registry, scored with the time it was last seen (connect and every heartbeat of
+notifications.consumers.NotificationsConsumer). A user counts as online while
+at least one of their sockets was seen within PRESENCE_TTL_SECONDS, so sockets
+of a worker that died without saying goodbye drop out on their own.
+
+With the Redis channel layer the registry is a sorted set per tenant on the
+layer's own Redis connections, shared by all ASGI processes. Other layers (the
+in-memory layer in tests and dev) keep it in process memory.
+"""
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+
+_local = {}
+
+
+def _ttl():
+    return getattr(settings, 'PRESENCE_TTL_SECONDS', 90)
+
+
+def _key(tenant_id):
+    return f'presence:{tenant_id}'
+
+
+def _redis(layer, key):
+    # channels_redis layers hand out per-event-loop clients; anything else has no shared store
+    if layer is None or not hasattr(layer, 'consistent_hash'):
+        return None
+    return layer.connection(layer.consistent_hash(key))
+
+
+async def touch(layer, tenant_id, user_id, channel_name):
+    """Register or refresh one socket."""
+    key, member, now = _key(tenant_id), f'{user_id}:{channel_name}', time.time()
+    redis = _redis(layer, key)
+    if redis is None:
+        _local.setdefault(key, {})[member] = now
+        return
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.zadd(key, {member: now})
+        pipe.expire(key, _ttl() * 2)
+        await pipe.execute()
+
+
+async def leave(layer, tenant_id, user_id, channel_name):
+    key, member = _key(tenant_id), f'{user_id}:{channel_name}'
+    redis = _redis(layer, key)
+    if redis is None:
+        _local.get(key, {}).pop(member, None)
+        return
+    await redis.zrem(key, member)
+
+
+async def online(layer, tenant_id):
+    """Ids (as strings) of the tenant's users with at least one live socket."""
+    key, cutoff = _key(tenant_id), time.time() - _ttl()
+    redis = _redis(layer, key)
+    if redis is None:
+        members = _local.get(key, {})
+        for member in [m for m, seen in members.items() if seen < cutoff]:
+            del members[member]
+        return {m.split(':', 1)[0] for m in members}
+    await redis.zremrangebyscore(key, '-inf', cutoff)
+    members = await redis.zrange(key, 0, -1)
+    return {(m.decode() if isinstance(m, bytes) else m).split(':', 1)[0] for m in members}
+
+
+def online_users(tenant_id):
+    """Sync wrapper of `online` on the default channel layer, for views and tasks."""
+    from channels.layers import get_channel_layer
+
+    return async_to_sync(online)(get_channel_layer(), tenant_id)
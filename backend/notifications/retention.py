@@ -0,0 +1,178 @@
+"""Notification retention.
+
+`compact` folds identical notifications of a user into one row. Identical
+means the same fingerprint: title, body, data and channel. The daily low-stock
+alert repeated to every manager is the usual case. The newest row of each group
+is kept with the summed `occurrences`, the time of the first one and its own
+read flag; the older rows are deleted and the users' unread counters
+recounted. Rows from before fingerprints existed get one on the way, a batch
+at a time.
+
+`archive` moves read notifications older than NOTIFICATION_RETENTION_DAYS to
+gzipped JSON Lines files in NOTIFICATION_ARCHIVE_STORAGE, one file per batch
+under NOTIFICATION_ARCHIVE_PREFIX, and then deletes the batch. That is a
+private storage of its own (private S3 objects in production), not the media
+storage, whose objects are public-read.
+
+Both work in batches of NOTIFICATION_RETENTION_BATCH_SIZE rows (groups for
+`compact`), each in its own short transaction that only touches the rows of
+that batch, so the table is never locked and the app keeps writing
+notifications meanwhile.
+`max_batches` bounds a single run; the next run carries on.
+"""
+import gzip
+import io
+import json
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Notification, fingerprint
+from .unread import recount
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = ('id', 'recipient_id', 'title', 'body', 'data', 'read', 'channel', 'created_at',
+                  'fingerprint', 'occurrences', 'first_occurred_at')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _pause():
+    # give concurrent writers room between batches
+    pause = _setting('NOTIFICATION_RETENTION_PAUSE_SECONDS', 0)
+    if pause:
+        time.sleep(pause)
+
+
+def backfill_fingerprints(batch_size=None, max_batches=None):
+    """Fingerprint rows created before fingerprints were stored. Returns rows updated."""
+    batch_size = batch_size or _setting('NOTIFICATION_RETENTION_BATCH_SIZE', 2000)
+    updated = batches = 0
+    while max_batches is None or batches < max_batches:
+        rows = list(Notification.objects.filter(fingerprint='').order_by('id')
+                    .only('id', 'title', 'body', 'data', 'channel')[:batch_size])
+        if not rows:
+            break
+        for row in rows:
+            row.fingerprint = fingerprint(row.title, row.body, row.data, row.channel)
+        Notification.objects.bulk_update(rows, ['fingerprint'])
+        updated += len(rows)
+        batches += 1
+        _pause()
+    return updated
+
+
+def compact(batch_size=None, max_batches=None):
+    """Fold repeated identical notifications into one row per user. Returns groups and rows removed."""
+    batch_size = batch_size or _setting('NOTIFICATION_RETENTION_BATCH_SIZE', 2000)
+    backfill_fingerprints(batch_size, max_batches)
+    result = {'groups': 0, 'removed': 0}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        groups = [
+            (recipient_id, digest) for recipient_id, digest, _n in
+            Notification.objects.exclude(fingerprint='').order_by()
+            .values_list('recipient_id', 'fingerprint').annotate(n=Count('id')).filter(n__gt=1)[:batch_size]
+        ]
+        if not groups:
+            break
+        wanted = set(groups)
+        members = defaultdict(list)
+        for row in (Notification.objects
+                    .filter(recipient_id__in={g[0] for g in groups}, fingerprint__in={g[1] for g in groups})
+                    .only('id', 'recipient_id', 'fingerprint', 'read', 'created_at', 'occurrences',
+                          'first_occurred_at')):
+            if (row.recipient_id, row.fingerprint) in wanted:
+                members[(row.recipient_id, row.fingerprint)].append(row)
+
+        keep, remove = [], []
+        for rows in members.values():
+            rows.sort(key=lambda r: (r.created_at, r.id))
+            newest = rows[-1]
+            newest.occurrences = sum(r.occurrences for r in rows)
+            newest.first_occurred_at = min(r.first_occurred_at or r.created_at for r in rows)
+            keep.append(newest)
+            remove += [r.id for r in rows[:-1]]
+
+        with transaction.atomic():
+            Notification.objects.bulk_update(keep, ['occurrences', 'first_occurred_at'])
+            Notification.objects.filter(id__in=remove).delete()
+            recount({row.recipient_id for row in keep})
+        result['groups'] += len(keep)
+        result['removed'] += len(remove)
+        batches += 1
+        _pause()
+
+    if result['groups']:
+        logger.info(f"Compacted {result['removed']} repeated notifications into {result['groups']} rows")
+    return result
+
+
+def archive_storage():
+    """The storage archives are written to, built from NOTIFICATION_ARCHIVE_STORAGE."""
+    config = settings.NOTIFICATION_ARCHIVE_STORAGE
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+def _archive_name(rows, now):
+    prefix = _setting('NOTIFICATION_ARCHIVE_PREFIX', 'notifications/archive').rstrip('/')
+    return f"{prefix}/{now:%Y/%m/%d}/{now:%H%M%S}-{rows[0]['id']}-{rows[-1]['id']}.jsonl.gz"
+
+
+def _jsonl_gz(rows):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as gz:
+        for row in rows:
+            gz.write(json.dumps(row, default=str).encode('utf-8') + b'\n')
+    return buffer.getvalue()
+
+
+def archive(days=None, batch_size=None, max_batches=None, now=None):
+    """Archive read notifications older than `days` to storage, then delete them.
+
+    Returns {'archived': rows, 'files': [storage names]}.
+    """
+    now = now or timezone.now()
+    days = days or _setting('NOTIFICATION_RETENTION_DAYS', 90)
+    batch_size = batch_size or _setting('NOTIFICATION_RETENTION_BATCH_SIZE', 2000)
+    cutoff = now - timedelta(days=days)
+    result = {'archived': 0, 'files': []}
+    storage = archive_storage()
+    last_id = 0
+    while max_batches is None or len(result['files']) < max_batches:
+        rows = list(
+            Notification.objects.filter(read=True, created_at__lt=cutoff, id__gt=last_id)
+            .order_by('id').values(*ARCHIVE_FIELDS)[:batch_size]
+        )
+        if not rows:
+            break
+        # written before deleting: a failed upload leaves the rows in place for the next run
+        name = storage.save(_archive_name(rows, now), ContentFile(_jsonl_gz(rows)))
+        with transaction.atomic():
+            Notification.objects.filter(id__in=[row['id'] for row in rows], read=True).delete()
+        result['archived'] += len(rows)
+        result['files'].append(name)
+        last_id = rows[-1]['id']
+        _pause()
+
+    if result['archived']:
+        logger.info(f"Archived {result['archived']} notifications older than {days} days "
+                    f"to {len(result['files'])} files")
+    return result
+
+
+def read_archive(name):
+    """Rows of one archive file, for restores and audits."""
+    with archive_storage().open(name, 'rb') as f:
+        return [json.loads(line) for line in gzip.GzipFile(fileobj=f) if line.strip()]
@@ -5,5 +5,6 @@ from .models import Notification
 class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
-        fields = ['id', 'recipient', 'title', 'body', 'data', 'read', 'channel', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'recipient', 'title', 'body', 'data', 'read', 'channel', 'created_at', 'occurrences',
+                  'first_occurred_at']
+        read_only_fields = ['id', 'created_at', 'occurrences', 'first_occurred_at']
@@ -0,0 +1,56 @@
+"""
+Celery tasks for notification delivery and retention.
+"""
+from celery import shared_task
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True)
+def flush_email_queue(self, batch_size=None):
+    """
+    Send a batch of queued emails over this worker's pooled SMTP connection.
+
+    Queued by notifications.mail.QueuedEmailBackend a few seconds after mail is
+    queued, and by Celery beat as a safety net for retries. Re-enqueues itself
+    while a full batch was claimed.
+    """
+    from .mail import flush_queue
+
+    batch_size = batch_size or getattr(settings, 'EMAIL_QUEUE_BATCH_SIZE', 200)
+    result = flush_queue(batch_size=batch_size)
+    if result['claimed'] >= batch_size:
+        flush_email_queue.delay(batch_size=batch_size)
+    if result['claimed']:
+        logger.info(f"Email queue flush: {result}")
+    return {'status': 'success', **result}
+
+
+@shared_task(bind=True)
+def send_web_push_notifications(self, user_ids, payload):
+    """
+    Push a payload to every subscription of the given users, concurrently.
+    Expired subscriptions (404/410) are pruned. See notifications.webpush.
+    """
+    from .webpush import send_to_users
+
+    result = send_to_users(user_ids, payload)
+    return {'status': 'success', **result}
+
+
+@shared_task(bind=True)
+def compact_notifications(self):
+    """
+    Nightly notification retention: fold repeated identical notifications into
+    one row with an occurrence count, then archive read notifications older
+    than NOTIFICATION_RETENTION_DAYS to storage and delete them in batches.
+    See notifications.retention.
+    """
+    from .retention import archive, compact
+
+    max_batches = getattr(settings, 'NOTIFICATION_RETENTION_MAX_BATCHES', 500)
+    compacted = compact(max_batches=max_batches)
+    archived = archive(max_batches=max_batches)
+    return {'status': 'success', **compacted, 'archived': archived['archived'], 'files': len(archived['files'])}
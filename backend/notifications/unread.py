@@ -0,0 +1,67 @@
+"""Per-user unread notification counters.
+
+UnreadCounter holds one row per user, so the unread badge and the dashboard
+never count Notification rows. The counter moves with the hot paths:
+
+- `increment` after notifications are created (Notification.save and the
+  bulk insert in notifications.dispatch), two queries for any number of users;
+- `mark_read` marks rows read and takes the number actually changed off.
+
+Rarer changes (deleting or editing single notifications) call `recount`, which
+counts over the (recipient, read, created_at) index.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Greatest
+
+from .models import Notification, UnreadCounter
+
+
+def increment(user_ids, by=1):
+    """Add `by` to the counters of the given users (each id once per call)."""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return
+    UnreadCounter.objects.bulk_create([UnreadCounter(user_id=pk) for pk in user_ids], ignore_conflicts=True)
+    UnreadCounter.objects.filter(user_id__in=user_ids).update(unread=F('unread') + by)
+
+
+def decrement(user_id, by):
+    if by:
+        UnreadCounter.objects.filter(user_id=user_id).update(unread=Greatest(F('unread') - by, 0))
+
+
+def mark_read(user, ids=None):
+    """Mark the user's notifications (all of them, or the given ids) read. Returns the number changed."""
+    qs = Notification.objects.filter(recipient=user, read=False)
+    if ids is not None:
+        qs = qs.filter(id__in=ids)
+    with transaction.atomic():
+        changed = qs.update(read=True)
+        if ids is None:
+            UnreadCounter.objects.filter(user=user).update(unread=0)
+        else:
+            decrement(user.pk, changed)
+    return changed
+
+
+def recount(user_ids):
+    """Recompute the counters of the given users from their Notification rows."""
+    user_ids = list(set(user_ids))
+    counts = dict(
+        Notification.objects.filter(recipient_id__in=user_ids, read=False).order_by()
+        .values_list('recipient_id').annotate(n=Count('id'))
+    )
+    UnreadCounter.objects.bulk_create(
+        [UnreadCounter(user_id=pk, unread=counts.get(pk, 0)) for pk in user_ids],
+        update_conflicts=True, unique_fields=['user'], update_fields=['unread'],
+    )
+
+
+def unread_count(user):
+    return UnreadCounter.objects.filter(user=user).values_list('unread', flat=True).first() or 0
+
+
+def tenant_unread(tenant):
+    """Unread notifications of all users of a tenant."""
+    return UnreadCounter.objects.filter(user__tenant=tenant).aggregate(total=Sum('unread'))['total'] or 0
@@ -1,20 +1,8 @@
-from pywebpush import webpush, WebPushException
-from django.conf import settings
-
-VAPID_CLAIMS = {
-    'sub': 'mailto:admin@example.com'
-}
-
-
 def send_web_push(subscription_info, payload):
-    try:
-        webpush(
-            subscription_info=subscription_info,
-            data=payload,
-            vapid_private_key=settings.VAPID_PRIVATE_KEY,
-            vapid_public_key=settings.VAPID_PUBLIC_KEY,
-            vapid_claims=VAPID_CLAIMS
-        )
-    except WebPushException as ex:
-        # handle errors/log
-        print('WebPush failed', ex)
+    """Push to one subscription; returns the HTTP status, or None if it failed.
+
+    For many subscriptions use notifications.webpush.send_to_users, which fans
+    out concurrently and prunes expired subscriptions.
+    """
+    from .webpush import push
+    return push(subscription_info, payload)
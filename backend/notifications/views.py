@@ -1,23 +1,61 @@
 from rest_framework import viewsets, decorators, response, permissions
+from rest_framework.pagination import CursorPagination
 from .models import Notification
 from .serializers import NotificationSerializer
+from . import unread
+
+
+class NotificationPagination(CursorPagination):
+    """Keyset pages over (created_at, id), newest first; served by the (recipient, -created_at, -id) index."""
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
 
 
 class NotificationViewSet(viewsets.ModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = NotificationPagination
 
     def get_queryset(self):
         # simple: filter to the current user
-        return self.queryset.filter(recipient=self.request.user)
+        qs = self.queryset.filter(recipient=self.request.user)
+        read = self.request.query_params.get('read')
+        if read in ('true', 'false'):
+            qs = qs.filter(read=read == 'true')
+        return qs
+
+    def perform_update(self, serializer):
+        previous = serializer.instance.recipient_id
+        serializer.save()
+        unread.recount({previous, serializer.instance.recipient_id})
+
+    def perform_destroy(self, instance):
+        recipient_id = instance.recipient_id
+        instance.delete()
+        unread.recount([recipient_id])
 
     @decorators.action(detail=False, methods=['post'])
     def mark_read(self, request):
-        ids = request.data.get('ids', [])
-        qs = self.get_queryset().filter(id__in=ids)
-        qs.update(read=True)
-        return response.Response({'status': 'ok'})
+        # {"ids": [...]} marks those notifications, {"all": true} every unread one
+        ids = None if request.data.get('all') else request.data.get('ids', [])
+        changed = unread.mark_read(request.user, ids)
+        return response.Response({'status': 'ok', 'marked': changed, 'unread': unread.unread_count(request.user)})
+
+    @decorators.action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        return response.Response({'unread': unread.unread_count(request.user)})
+
+    @decorators.action(detail=False, methods=['get'])
+    def presence(self, request):
+        # users of the caller's tenant with an open notifications socket
+        from .presence import online_users
+        tenant_id = getattr(request.user, 'tenant_id', None)
+        if not tenant_id:
+            return response.Response({'online': []})
+        return response.Response({'online': sorted(online_users(tenant_id))})
 
     @decorators.action(detail=False, methods=['post'])
     def subscribe(self, request):
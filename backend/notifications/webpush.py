@@ -0,0 +1,162 @@
+"""Web push delivery.
+
+`send_to_users` loads every Subscription of the given users with one query and
+pushes to all of them concurrently on a per-worker thread pool
+(WEB_PUSH_MAX_WORKERS threads sharing one pooled HTTP session). Per push only
+the payload encryption is done; the VAPID key is parsed once per process and
+the signed VAPID header is reused per push service (audience) until shortly
+before it expires.
+
+Subscriptions the push service reports as gone (404 / 410) are deleted in one
+query after the fan-out. Sent / failed / pruned counts are added to counters in
+the Django cache (see `metrics`) and logged per batch.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+GONE_STATUSES = (404, 410)
+METRIC_KEYS = ('sent', 'failed', 'pruned')
+# signed VAPID headers are valid for 12 hours; re-sign an hour before that
+VAPID_TTL_SECONDS = 12 * 60 * 60
+VAPID_RESIGN_MARGIN_SECONDS = 60 * 60
+
+_lock = threading.Lock()
+_state = {'vapid': None, 'vapid_key': None, 'headers': {}, 'session': None, 'executor': None}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _vapid():
+    from py_vapid import Vapid
+
+    key = settings.VAPID_PRIVATE_KEY
+    if _state['vapid'] is None or _state['vapid_key'] != key:
+        with _lock:
+            _state['vapid'] = Vapid.from_string(private_key=key)
+            _state['vapid_key'] = key
+            _state['headers'] = {}
+    return _state['vapid']
+
+
+def vapid_headers(endpoint, now=None):
+    """Signed VAPID Authorization headers for the push service behind `endpoint`, cached per audience."""
+    url = urlparse(endpoint)
+    audience = f'{url.scheme}://{url.netloc}'
+    now = now or time.time()
+    vapid = _vapid()
+    cached = _state['headers'].get(audience)
+    if cached is None or cached[0] - VAPID_RESIGN_MARGIN_SECONDS < now:
+        with _lock:
+            # another push thread may have signed while we waited
+            cached = _state['headers'].get(audience)
+            if cached is None or cached[0] - VAPID_RESIGN_MARGIN_SECONDS < now:
+                expires = int(now) + VAPID_TTL_SECONDS
+                claims = {'sub': _setting('VAPID_SUBJECT', 'mailto:admin@example.com'), 'aud': audience,
+                          'exp': expires}
+                cached = (expires, vapid.sign(claims))
+                _state['headers'][audience] = cached
+    return cached[1]
+
+
+def _session():
+    if _state['session'] is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        with _lock:
+            if _state['session'] is None:
+                size = _setting('WEB_PUSH_MAX_WORKERS', 32)
+                session = requests.Session()
+                session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=size))
+                session.mount('http://', HTTPAdapter(pool_connections=16, pool_maxsize=size))
+                _state['session'] = session
+    return _state['session']
+
+
+def _executor():
+    if _state['executor'] is None:
+        with _lock:
+            if _state['executor'] is None:
+                _state['executor'] = ThreadPoolExecutor(max_workers=_setting('WEB_PUSH_MAX_WORKERS', 32),
+                                                        thread_name_prefix='webpush')
+    return _state['executor']
+
+
+def push(subscription_info, payload):
+    """Push one payload to one subscription. Returns the HTTP status, or None if the request failed."""
+    from pywebpush import WebPusher
+
+    try:
+        response = WebPusher(subscription_info, requests_session=_session()).send(
+            payload, headers=dict(vapid_headers(subscription_info['endpoint'])),
+            ttl=_setting('WEB_PUSH_TTL_SECONDS', 24 * 60 * 60), timeout=_setting('WEB_PUSH_TIMEOUT_SECONDS', 10),
+        )
+        return response.status_code
+    except Exception as e:
+        logger.warning(f"Web push to {subscription_info.get('endpoint', '')[:60]} failed: {e}")
+        return None
+
+
+def send_to_subscriptions(subscriptions, payload):
+    """Push `payload` to (id, endpoint, keys) subscriptions concurrently and prune the gone ones.
+
+    Returns {'sent', 'failed', 'pruned'}.
+    """
+    from .models import Subscription
+
+    subscriptions = list(subscriptions)
+    if not subscriptions:
+        return dict.fromkeys(METRIC_KEYS, 0)
+    statuses = list(_executor().map(
+        lambda s: push({'endpoint': s[1], 'keys': s[2]}, payload), subscriptions))
+
+    gone = [s[0] for s, status in zip(subscriptions, statuses) if status in GONE_STATUSES]
+    if gone:
+        Subscription.objects.filter(pk__in=gone).delete()
+    sent = sum(1 for status in statuses if status is not None and 200 <= status < 300)
+    result = {'sent': sent, 'failed': len(statuses) - sent - len(gone), 'pruned': len(gone)}
+    record_metrics(result)
+    logger.info(f"Web push: {result['sent']} sent, {result['failed']} failed, {result['pruned']} subscriptions pruned")
+    return result
+
+
+def send_to_users(user_ids, payload):
+    """Push `payload` to every subscription of the given users."""
+    from .models import Subscription
+
+    return send_to_subscriptions(
+        Subscription.objects.filter(user_id__in=list(user_ids)).values_list('pk', 'endpoint', 'keys'), payload)
+
+
+def _metric_key(name):
+    return f'notifications:webpush:{name}'
+
+
+def record_metrics(counts):
+    for name in METRIC_KEYS:
+        if counts.get(name):
+            cache.add(_metric_key(name), 0, timeout=None)
+            try:
+                cache.incr(_metric_key(name), counts[name])
+            except ValueError:
+                cache.set(_metric_key(name), counts[name], timeout=None)
+
+
+def metrics():
+    """Totals of sent / failed / pruned pushes since the counters were last reset."""
+    values = cache.get_many([_metric_key(name) for name in METRIC_KEYS])
+    return {name: values.get(_metric_key(name), 0) for name in METRIC_KEYS}
+
+
+def reset_metrics():
+    cache.delete_many([_metric_key(name) for name in METRIC_KEYS])
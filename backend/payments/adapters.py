@@ -1,10 +1,51 @@
 from abc import ABC, abstractmethod
+import asyncio
+import threading
 import uuid
+import weakref
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+def get_http_timeout():
+    """(connect, read) timeout in seconds for provider HTTP calls."""
+    return (
+        getattr(settings, 'PAYMENT_HTTP_CONNECT_TIMEOUT', 5),
+        getattr(settings, 'PAYMENT_HTTP_TIMEOUT', 20),
+    )
+
+
+def get_http_max_retries():
+    return getattr(settings, 'PAYMENT_HTTP_MAX_RETRIES', 2)
+
+
+def build_http_session(pool_size=None, max_retries=None):
+    """A requests.Session with a pooled keep-alive adapter and idempotent-request retries."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    pool_size = pool_size or getattr(settings, 'PAYMENT_HTTP_POOL_SIZE', 10)
+    retries = Retry(
+        total=get_http_max_retries() if max_retries is None else max_retries,
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 
 class PaymentAdapter(ABC):
-    """Abstract payment adapter interface for creating payment intents and verifying webhooks."""
+    """Abstract payment adapter interface for creating payment intents and verifying webhooks.
+
+    Adapters are shared process-wide through `registry`, so they must not keep
+    per-request state. Provider clients are built lazily and reused.
+    """
 
     @abstractmethod
     def create_payment_intent(self, amount, currency='SAR', metadata=None):
@@ -14,6 +55,19 @@ class PaymentAdapter(ABC):
     def verify_webhook(self, payload, headers):
         pass
 
+    async def acreate_payment_intent(self, amount, currency='SAR', metadata=None):
+        """Async variant for ASGI views.
+
+        Adapters without a native async client run the sync call in a worker thread
+        so the event loop is never blocked on provider I/O.
+        """
+        from asgiref.sync import sync_to_async
+        return await sync_to_async(self.create_payment_intent, thread_sensitive=False)(amount, currency, metadata)
+
+    async def averify_webhook(self, payload, headers):
+        # signature checks are local CPU work; no I/O to offload
+        return self.verify_webhook(payload, headers)
+
 
 class SandboxAdapter(PaymentAdapter):
     """Simple sandbox adapter that fakes intents and webhooks for local testing."""
@@ -27,6 +81,10 @@ class SandboxAdapter(PaymentAdapter):
             'currency': currency,
         }
 
+    async def acreate_payment_intent(self, amount, currency='SAR', metadata=None):
+        # no I/O: answer inline instead of hopping to a thread
+        return SandboxAdapter.create_payment_intent(self, amount, currency, metadata)
+
     def verify_webhook(self, payload, headers):
         # For sandbox, accept a header 'X-SANDBOX-SIGN' == 'ok' as valid
         if headers.get('X-SANDBOX-SIGN') == 'ok':
@@ -46,6 +104,10 @@ class StripeAdapter(SandboxAdapter):
     - Real Stripe (STRIPE_API_KEY + STRIPE_WEBHOOK_SECRET env vars)
     - stripe-mock via Docker (USE_STRIPE_MOCK=True env var)
     - Sandbox mode (fallback)
+
+    Each adapter owns a `stripe.StripeClient` with its own API key, base URL and
+    pooled HTTP session, so nothing is written to the module-level `stripe.api_key`
+    / `stripe.api_base` globals. The client is rebuilt only when the settings change.
     """
 
     def __init__(self):
@@ -54,48 +116,109 @@ class StripeAdapter(SandboxAdapter):
             self.stripe = stripe
         except Exception:
             self.stripe = None
+        self._client = None
+        self._client_config = None
+        self._lock = threading.Lock()
+        # aiohttp sessions are bound to the event loop that created them
+        self._async_clients = weakref.WeakKeyDictionary()
 
-    def _get_stripe_client(self):
-        """Get Stripe client configured for either real or mock API."""
-        if not self.stripe:
-            raise RuntimeError('stripe package not installed')
-        
+    def _client_settings(self):
         use_mock = getattr(settings, 'USE_STRIPE_MOCK', False)
         if use_mock:
             # Point to stripe-mock Docker service
-            self.stripe.api_base = getattr(settings, 'STRIPE_MOCK_URL', 'http://stripe-mock:12111')
-            self.stripe.api_key = 'sk_test_mock'
-        else:
-            # Real Stripe API
-            if not getattr(settings, 'STRIPE_API_KEY', None):
-                raise RuntimeError('STRIPE_API_KEY not configured')
-            self.stripe.api_key = settings.STRIPE_API_KEY
-        
-        return self.stripe
+            return 'sk_test_mock', getattr(settings, 'STRIPE_MOCK_URL', None) or 'http://stripe-mock:12111'
+        # Real Stripe API
+        if not getattr(settings, 'STRIPE_API_KEY', None):
+            raise RuntimeError('STRIPE_API_KEY not configured')
+        return settings.STRIPE_API_KEY, None
+
+    def _get_stripe_client(self):
+        """Get the cached StripeClient configured for either real or mock API."""
+        if not self.stripe:
+            raise RuntimeError('stripe package not installed')
+
+        api_key, api_base = self._client_settings()
+        config = (api_key, api_base, get_http_timeout(), get_http_max_retries())
+        with self._lock:
+            if self._client is None or self._client_config != config:
+                http_client = self.stripe.RequestsClient(timeout=get_http_timeout(), session=build_http_session(max_retries=0))
+                kwargs = {
+                    'http_client': http_client,
+                    # the SDK retries POSTs safely using idempotency keys
+                    'max_network_retries': get_http_max_retries(),
+                }
+                if api_base:
+                    kwargs['base_addresses'] = {'api': api_base}
+                self._client = self.stripe.StripeClient(api_key, **kwargs)
+                self._client_config = config
+            return self._client
+
+    def _get_async_stripe_client(self):
+        """StripeClient backed by aiohttp, one per running event loop."""
+        if not self.stripe:
+            raise RuntimeError('stripe package not installed')
+
+        loop = asyncio.get_running_loop()
+        api_key, api_base = self._client_settings()
+        config = (api_key, api_base, get_http_timeout(), get_http_max_retries())
+        cached = self._async_clients.get(loop)
+        if cached is None or cached[0] != config:
+            http_client = self.stripe.AIOHTTPClient(timeout=get_http_timeout()[1])
+            kwargs = {'http_client': http_client, 'max_network_retries': get_http_max_retries()}
+            if api_base:
+                kwargs['base_addresses'] = {'api': api_base}
+            cached = (config, self.stripe.StripeClient(api_key, **kwargs), http_client)
+            self._async_clients[loop] = cached
+        return cached[1]
+
+    async def aclose(self):
+        """Close the aiohttp session owned by the running loop (e.g. on ASGI shutdown)."""
+        cached = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if cached is not None:
+            await cached[2].close_async()
+
+    @staticmethod
+    def _intent_params(amount, currency, metadata):
+        return {
+            'amount': int(float(amount) * 100),
+            'currency': (currency or 'sar').lower(),
+            'metadata': metadata or {},
+        }
+
+    @staticmethod
+    def _intent_result(intent, amount, currency):
+        return {
+            'id': intent.id,
+            'client_secret': getattr(intent, 'client_secret', None),
+            'amount': float(amount),
+            'currency': currency
+        }
 
     def create_payment_intent(self, amount, currency='SAR', metadata=None):
         try:
             stripe_client = self._get_stripe_client()
-            intent = stripe_client.PaymentIntent.create(
-                amount=int(float(amount) * 100),
-                currency=(currency or 'sar').lower(),
-                metadata=metadata or {}
-            )
-            return {
-                'id': intent.id,
-                'client_secret': getattr(intent, 'client_secret', None),
-                'amount': float(amount),
-                'currency': currency
-            }
+            # StripeClient >= 12 moved services under the `v1` namespace
+            services = getattr(stripe_client, 'v1', stripe_client)
+            intent = services.payment_intents.create(params=self._intent_params(amount, currency, metadata))
+            return self._intent_result(intent, amount, currency)
         except Exception as e:
             # Fallback to sandbox on error
             return super().create_payment_intent(amount, currency, metadata)
 
+    async def acreate_payment_intent(self, amount, currency='SAR', metadata=None):
+        try:
+            stripe_client = self._get_async_stripe_client()
+            services = getattr(stripe_client, 'v1', stripe_client)
+            intent = await services.payment_intents.create_async(params=self._intent_params(amount, currency, metadata))
+            return self._intent_result(intent, amount, currency)
+        except Exception:
+            # Fallback to sandbox on error
+            return SandboxAdapter.create_payment_intent(self, amount, currency, metadata)
+
     def verify_webhook(self, payload, headers):
         if not self.stripe:
             return False
         
-        use_mock = getattr(settings, 'USE_STRIPE_MOCK', False)
         endpoint_secret = getattr(settings, 'STRIPE_WEBHOOK_SECRET', None)
         sig = headers.get('Stripe-Signature') or headers.get('stripe-signature')
         
@@ -103,13 +226,7 @@ class StripeAdapter(SandboxAdapter):
             return False
         
         try:
-            if use_mock:
-                # stripe-mock uses same webhook signature verification
-                self.stripe.api_base = getattr(settings, 'STRIPE_MOCK_URL', 'http://stripe-mock:12111')
-                self.stripe.api_key = 'sk_test_mock'
-            else:
-                self.stripe.api_key = settings.STRIPE_API_KEY
-            
+            # signature verification is local; stripe-mock uses the same scheme
             event = self.stripe.Webhook.construct_event(payload, sig, endpoint_secret)
             return event
         except Exception:
@@ -132,17 +249,62 @@ class WalletsAdapter(SandboxAdapter):
     pass
 
 
+class AdapterRegistry:
+    """Process-wide registry of payment adapters.
+
+    Adapters are constructed lazily on first use and then shared by all requests
+    and threads in the process, so SDK clients and HTTP connection pools are reused.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._aliases = {}
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory, aliases=()):
+        self._factories[name] = factory
+        for alias in aliases:
+            self._aliases[alias] = name
+        self._instances.pop(name, None)
+
+    def resolve(self, provider):
+        provider = (provider or '').lower()
+        provider = self._aliases.get(provider, provider)
+        return provider if provider in self._factories else 'sandbox'
+
+    def get(self, provider):
+        name = self.resolve(provider)
+        adapter = self._instances.get(name)
+        if adapter is None:
+            with self._lock:
+                adapter = self._instances.get(name)
+                if adapter is None:
+                    adapter = self._factories[name]()
+                    self._instances[name] = adapter
+        return adapter
+
+    def reset(self):
+        """Drop constructed adapters; they are rebuilt on next use."""
+        with self._lock:
+            self._instances.clear()
+
+
+registry = AdapterRegistry()
+registry.register('sandbox', SandboxAdapter)
+registry.register('stripe', StripeAdapter, aliases=('visa_mastercard',))
+registry.register('hyperpay', HyperPayAdapter, aliases=('tap', 'paytabs'))
+registry.register('apple_pay', ApplePayAdapter)
+registry.register('google_pay', GooglePayAdapter)
+registry.register('wallet', WalletsAdapter)
+
+
+@receiver(setting_changed)
+def _reset_adapters_on_settings_change(sender, setting, **kwargs):
+    if setting.startswith(('STRIPE_', 'USE_STRIPE_MOCK', 'PAYMENT_HTTP_')):
+        registry.reset()
+
+
 # Helper factory
 def get_adapter(provider='sandbox'):
-    provider = (provider or '').lower()
-    if provider in ('stripe', 'visa_mastercard'):
-        return StripeAdapter()
-    if provider in ('hyperpay', 'tap', 'paytabs'):
-        return HyperPayAdapter()
-    if provider == 'apple_pay':
-        return ApplePayAdapter()
-    if provider == 'google_pay':
-        return GooglePayAdapter()
-    if provider == 'wallet':
-        return WalletsAdapter()
-    return SandboxAdapter()
\ No newline at end of file
+    return registry.get(provider)
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from tenants.admin_utils import TenantAdminMixin
-from .models import Receipt, Payment
+from .models import Receipt, Payment, WebhookEvent
 
 
 @admin.register(Payment)
@@ -17,3 +17,11 @@ class ReceiptAdmin(TenantAdminMixin, admin.ModelAdmin):
     search_fields = ('invoice_no', 'payment_id')
     list_filter = ()
     readonly_fields = ('created_at',)
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('provider', 'event_id', 'payment_id', 'status', 'attempts', 'received_at', 'processed_at')
+    search_fields = ('event_id', 'payment_id')
+    list_filter = ('provider', 'status')
+    readonly_fields = ('received_at', 'processed_at')
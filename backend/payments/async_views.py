@@ -0,0 +1,90 @@
+"""Async (ASGI) variants of the payment intent and webhook endpoints.
+
+DRF's APIView is sync-only, so these are plain Django async class-based views
+(function decorators such as csrf_exempt are not async-aware in Django 4.2).
+Under the ASGI application they run on the event loop: a slow provider call no
+longer pins a worker thread, and many intent requests can wait on the provider
+concurrently.
+The sync views in payments.views stay in place for WSGI deployments.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .adapters import get_adapter
+from .models import WebhookEvent
+from .views import parse_verified_webhook
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_body(request):
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST.dict()
+
+
+def _authenticate(request):
+    """Resolve the caller from a JWT bearer token.
+
+    Session cookies are not accepted: the view is csrf_exempt, so honouring them
+    would let any other site create intents as a logged-in browser user.
+    """
+    from accounts.principal import ClaimsJWTAuthentication
+    try:
+        result = ClaimsJWTAuthentication().authenticate(request)
+    except Exception:
+        return None
+    return result[0] if result is not None else None
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncCreatePaymentIntentView(View):
+    """Create a payment intent; JWT bearer auth only."""
+
+    http_method_names = ['post']
+
+    async def post(self, request):
+        user = await sync_to_async(_authenticate)(request)
+        if user is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+        data = _parse_body(request)
+        if data is None:
+            return JsonResponse({'detail': 'invalid JSON body'}, status=400)
+        amount = data.get('amount')
+        if amount is None:
+            return JsonResponse({'detail': 'amount is required'}, status=400)
+
+        adapter = get_adapter(data.get('provider', 'sandbox'))
+        intent = await adapter.acreate_payment_intent(amount=amount, currency=data.get('currency', 'SAR'),
+                                                      metadata=data.get('metadata'))
+        return JsonResponse(intent, status=201)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPaymentWebhookView(View):
+    http_method_names = ['post']
+
+    async def post(self, request):
+        # same contract as PaymentWebhookView: verify, write to the inbox, ack
+        provider = request.headers.get('X-PAYMENT-PROVIDER', 'paytabs').lower()
+        data = _parse_body(request)
+        if data is None:
+            return JsonResponse({'detail': 'invalid JSON body'}, status=400)
+
+        event = parse_verified_webhook(provider, request.body or b'', request.headers, data)
+        if event is None:
+            return JsonResponse({'status': 'forbidden', 'detail': 'invalid signature'}, status=403)
+        if event:
+            await WebhookEvent.arecord(**event)
+        return JsonResponse({'status': 'ok'})
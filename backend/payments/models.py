@@ -1,3 +1,4 @@
+from decimal import Decimal, InvalidOperation
 from django.db import models
 from tenants.models import Tenant
 
@@ -75,4 +76,78 @@ class Receipt(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Receipt {self.invoice_no} ({self.amount})"
\ No newline at end of file
+        return f"Receipt {self.invoice_no} ({self.amount})"
+
+class WebhookEvent(models.Model):
+    """Inbox row for a verified provider webhook.
+
+    The webhook view only inserts here (ignoring duplicates on provider + event_id)
+    and returns; `payments.tasks.process_webhook_inbox` drains pending rows in batches.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+
+    provider = models.CharField(max_length=50)
+    event_id = models.CharField(max_length=255)
+    payment_id = models.CharField(max_length=200, blank=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    currency = models.CharField(max_length=10, blank=True)
+    payload = models.JSONField(blank=True, null=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['received_at']
+        verbose_name = 'Webhook Event'
+        verbose_name_plural = 'Webhook Events'
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'event_id'], name='uniq_webhook_provider_event'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.provider}:{self.event_id} ({self.status})"
+
+    @staticmethod
+    def build(provider, event_id, payment_id, amount=None, currency='', payload=None):
+        if hasattr(payload, 'dict'):
+            # QueryDict from form-encoded bodies
+            payload = payload.dict()
+        elif payload is not None and not isinstance(payload, dict):
+            payload = dict(payload)
+        try:
+            amount = Decimal(str(amount)) if amount not in (None, '') else None
+        except (InvalidOperation, ValueError):
+            amount = None
+        return WebhookEvent(
+            provider=provider,
+            event_id=str(event_id)[:255],
+            payment_id=str(payment_id),
+            amount=amount,
+            currency=currency or '',
+            payload=payload,
+        )
+
+    @staticmethod
+    def record(*args, **kwargs):
+        """Insert the event unless (provider, event_id) is already in the inbox.
+
+        A single INSERT with ON CONFLICT DO NOTHING, so provider retries cost one
+        statement and never raise.
+        """
+        WebhookEvent.objects.bulk_create([WebhookEvent.build(*args, **kwargs)], ignore_conflicts=True)
+
+    @staticmethod
+    async def arecord(*args, **kwargs):
+        """Async variant of `record` for the ASGI webhook view."""
+        await WebhookEvent.objects.abulk_create([WebhookEvent.build(*args, **kwargs)], ignore_conflicts=True)
@@ -2,6 +2,19 @@ from rest_framework import serializers
 from .models import Payment, Receipt
 
 
+class PaymentListSerializer(serializers.ListSerializer):
+    """Resolve receipt download URLs for a whole page in one query and one bulk presign."""
+
+    def to_representation(self, data):
+        payments = list(data.all() if hasattr(data, 'all') else data)
+        try:
+            from receipts.utils import get_receipt_urls_for_payments
+            self.context['receipt_urls'] = get_receipt_urls_for_payments([p.payment_id for p in payments])
+        except Exception:
+            pass
+        return super().to_representation(payments)
+
+
 class PaymentSerializer(serializers.ModelSerializer):
     receipt_url = serializers.SerializerMethodField()
 
@@ -9,8 +22,12 @@ class PaymentSerializer(serializers.ModelSerializer):
         model = Payment
         fields = ['id', 'payment_id', 'provider', 'status', 'amount', 'currency', 'metadata', 'created_at', 'receipt_url']
         read_only_fields = ['id', 'created_at']
+        list_serializer_class = PaymentListSerializer
 
     def get_receipt_url(self, obj):
+        receipt_urls = self.context.get('receipt_urls')
+        if receipt_urls is not None:
+            return receipt_urls.get(obj.payment_id)
         try:
             r = obj.get_receipt()
             if r:
@@ -0,0 +1,105 @@
+"""
+Celery tasks for payment webhook processing.
+"""
+from datetime import timedelta
+
+from celery import shared_task
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import WebhookEvent
+import logging
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_BATCH_SIZE = 200
+WEBHOOK_MAX_ATTEMPTS = 5
+# a row still 'processing' after this long belongs to a drain task that died; claim it again
+WEBHOOK_CLAIM_TIMEOUT_SECONDS = 600
+
+
+def _claim_webhook_batch(batch_size):
+    """Mark up to `batch_size` pending events as processing and return them.
+
+    On PostgreSQL, SKIP LOCKED lets several drain tasks run side by side without
+    picking up the same rows. Rows left in 'processing' by a worker killed
+    mid-batch are claimed again once WEBHOOK_CLAIM_TIMEOUT_SECONDS have passed.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=WEBHOOK_CLAIM_TIMEOUT_SECONDS)
+    with transaction.atomic():
+        ids = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='pending') | Q(status='failed', attempts__lt=WEBHOOK_MAX_ATTEMPTS)
+                    | Q(status='processing', claimed_at__lt=stale))
+            .order_by('received_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if ids:
+            WebhookEvent.objects.filter(id__in=ids).update(status='processing', claimed_at=now,
+                                                           attempts=F('attempts') + 1)
+    return list(WebhookEvent.objects.filter(id__in=ids))
+
+
+@shared_task(bind=True)
+def process_webhook_inbox(self, batch_size=WEBHOOK_BATCH_SIZE):
+    """
+    Drain the webhook inbox in batches and generate one receipt per paid payment.
+
+    Events for the same payment (provider retries, or several event types for one
+    charge) collapse to a single receipt generation, and payments that already have
+    a receipt are skipped. Receipts are generated inline so a burst of webhooks
+    becomes a handful of drain tasks instead of one Celery message per delivery.
+    Scheduled by Celery beat; re-enqueues itself while a full batch was claimed.
+    """
+    from receipts.models import Receipt
+    from receipts.tasks import generate_receipt_for_payment
+
+    events = _claim_webhook_batch(batch_size)
+    if not events:
+        return {'status': 'success', 'claimed': 0}
+
+    by_payment = {}
+    for event in events:
+        by_payment.setdefault(event.payment_id, []).append(event)
+
+    already_receipted = set(
+        Receipt.objects.filter(payment_id__in=list(by_payment), s3_url__isnull=False)
+        .values_list('payment_id', flat=True)
+    )
+
+    processed_ids = []
+    failed = 0
+    for payment_id, payment_events in by_payment.items():
+        event_ids = [e.id for e in payment_events]
+        if payment_id in already_receipted:
+            processed_ids.extend(event_ids)
+            continue
+        first = payment_events[0]
+        try:
+            generate_receipt_for_payment(
+                payment_id=payment_id,
+                amount=first.amount,
+                currency=first.currency or 'SAR',
+            )
+            processed_ids.extend(event_ids)
+        except Exception as e:
+            failed += len(event_ids)
+            logger.error(f"Webhook processing failed for payment {payment_id}: {e}")
+            WebhookEvent.objects.filter(id__in=event_ids).update(status='failed', last_error=str(e)[:2000])
+
+    if processed_ids:
+        WebhookEvent.objects.filter(id__in=processed_ids).update(
+            status='processed', processed_at=timezone.now(), last_error=''
+        )
+
+    if len(events) >= batch_size:
+        process_webhook_inbox.delay(batch_size=batch_size)
+
+    return {
+        'status': 'success',
+        'claimed': len(events),
+        'payments': len(by_payment),
+        'skipped_existing': len(already_receipted),
+        'failed': failed,
+    }
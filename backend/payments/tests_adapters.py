@@ -17,3 +17,28 @@ def test_verify_webhook_sandbox():
     a = get_adapter('sandbox')
     assert a.verify_webhook(payload={}, headers={'X-SANDBOX-SIGN': 'ok'})
     assert not a.verify_webhook(payload={}, headers={'X-SANDBOX-SIGN': 'bad'})
+
+
+def test_get_adapter_returns_shared_instance_per_provider():
+    from .adapters import registry, StripeAdapter, HyperPayAdapter
+    assert get_adapter('stripe') is get_adapter('visa_mastercard')
+    assert isinstance(get_adapter('stripe'), StripeAdapter)
+    assert get_adapter('tap') is get_adapter('paytabs')
+    assert isinstance(get_adapter('hyperpay'), HyperPayAdapter)
+    assert type(get_adapter('unknown-provider')) is SandboxAdapter
+    registry.reset()
+    assert get_adapter('stripe') is get_adapter('stripe')
+
+
+def test_stripe_client_does_not_touch_sdk_globals(settings):
+    import stripe
+    from .adapters import StripeAdapter
+    settings.USE_STRIPE_MOCK = True
+    settings.STRIPE_MOCK_URL = 'http://127.0.0.1:1'
+    before = (stripe.api_key, stripe.api_base)
+    a = StripeAdapter()
+    client = a._get_stripe_client()
+    assert a._get_stripe_client() is client
+    assert (stripe.api_key, stripe.api_base) == before
+    settings.STRIPE_MOCK_URL = 'http://127.0.0.1:2'
+    assert a._get_stripe_client() is not client
@@ -0,0 +1,166 @@
+"""Async payment intent path: concurrency against a slow provider and the ASGI views."""
+import asyncio
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.test import RequestFactory
+
+from payments.adapters import StripeAdapter
+from payments.async_views import AsyncCreatePaymentIntentView, AsyncPaymentWebhookView
+from payments.models import WebhookEvent
+
+PROVIDER_LATENCY = 0.25
+
+
+class SlowStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops SYNs when 40 clients connect at once
+    request_queue_size = 128
+
+
+class SlowStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        time.sleep(PROVIDER_LATENCY)
+        with self.server.lock:
+            self.server.requests += 1
+            n = self.server.requests
+        body = json.dumps({
+            'id': f'pi_{n}', 'object': 'payment_intent', 'client_secret': f'pi_{n}_secret',
+            'amount': 1000, 'currency': 'sar',
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def slow_stripe(settings):
+    server = SlowStripeServer(('127.0.0.1', 0), SlowStripeHandler)
+    server.lock = threading.Lock()
+    server.requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    settings.USE_STRIPE_MOCK = True
+    settings.STRIPE_MOCK_URL = f'http://127.0.0.1:{server.server_address[1]}'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_async_intents_overlap_on_slow_provider(slow_stripe):
+    adapter = StripeAdapter()
+    count = 40
+
+    async def run():
+        started = time.monotonic()
+        try:
+            intents = await asyncio.gather(*[
+                adapter.acreate_payment_intent(amount=10, currency='SAR') for _ in range(count)
+            ])
+            return intents, time.monotonic() - started
+        finally:
+            await adapter.aclose()
+
+    intents, elapsed = asyncio.run(run())
+
+    assert all(i['id'].startswith('pi_') for i in intents)
+    assert slow_stripe.requests == count
+    # an 8-thread sync pool would need count / 8 * latency = 1.25s
+    assert elapsed < 1.0
+
+
+def test_async_intent_falls_back_to_sandbox_when_stripe_unreachable(settings):
+    settings.USE_STRIPE_MOCK = True
+    settings.STRIPE_MOCK_URL = 'http://127.0.0.1:9'
+    settings.PAYMENT_HTTP_MAX_RETRIES = 0
+    adapter = StripeAdapter()
+
+    async def run():
+        try:
+            return await adapter.acreate_payment_intent(amount=5, currency='SAR')
+        finally:
+            await adapter.aclose()
+
+    intent = asyncio.run(run())
+    assert intent['id'].startswith('sandbox_')
+
+
+def test_async_views_are_coroutines():
+    assert iscoroutinefunction(AsyncCreatePaymentIntentView.as_view())
+    assert iscoroutinefunction(AsyncPaymentWebhookView.as_view())
+    assert AsyncPaymentWebhookView.as_view().csrf_exempt
+
+
+@pytest.mark.django_db
+def test_create_intent_async_view_requires_auth():
+    request = RequestFactory().post('/api/payments/create-intent-async/', data=json.dumps({'amount': 10}),
+                                    content_type='application/json')
+    resp = async_to_sync(AsyncCreatePaymentIntentView.as_view())(request)
+    assert resp.status_code == 401
+
+
+@pytest.mark.django_db
+def test_create_intent_async_view_ignores_the_session(django_user_model):
+    user = django_user_model.objects.create_user(username='session_payer', password='pw')
+    # a cross-site form post: the browser's session user, no CSRF token, no bearer token
+    request = RequestFactory().post('/api/payments/create-intent-async/',
+                                    data=json.dumps({'amount': 10, 'provider': 'sandbox'}),
+                                    content_type='application/json')
+    request.user = user
+    resp = async_to_sync(AsyncCreatePaymentIntentView.as_view())(request)
+    assert resp.status_code == 401
+
+
+@pytest.mark.django_db
+def test_create_intent_async_view_with_jwt(django_user_model):
+    from rest_framework_simplejwt.tokens import RefreshToken
+    user = django_user_model.objects.create_user(username='async_payer', password='pw', email='ap@example.com')
+    token = str(RefreshToken.for_user(user).access_token)
+    request = RequestFactory().post('/api/payments/create-intent-async/',
+                                    data=json.dumps({'amount': 10, 'provider': 'sandbox'}),
+                                    content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+    resp = async_to_sync(AsyncCreatePaymentIntentView.as_view())(request)
+    assert resp.status_code == 201
+    assert json.loads(resp.content)['id'].startswith('sandbox_')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_webhook_async_view_records_event_once(monkeypatch):
+    monkeypatch.setenv('PAYTABS_SECRET', 'async-secret')
+    body = json.dumps({'payment_id': 'pay_async_1', 'amount': '12.50', 'currency': 'SAR'}).encode('utf-8')
+    signature = hmac.new(b'async-secret', body, hashlib.sha256).hexdigest()
+
+    def post():
+        request = RequestFactory().post('/api/payments/webhook-async/', data=body, content_type='application/json',
+                                        HTTP_X_PAYMENT_PROVIDER='paytabs', HTTP_X_PAYMENT_SIGNATURE=signature)
+        return async_to_sync(AsyncPaymentWebhookView.as_view())(request)
+
+    assert post().status_code == 200
+    assert post().status_code == 200
+    assert WebhookEvent.objects.filter(payment_id='pay_async_1').count() == 1
+
+
+@pytest.mark.django_db
+def test_webhook_async_view_rejects_bad_signature(monkeypatch):
+    monkeypatch.setenv('PAYTABS_SECRET', 'async-secret')
+    request = RequestFactory().post('/api/payments/webhook-async/', data=json.dumps({'payment_id': 'x'}),
+                                    content_type='application/json',
+                                    HTTP_X_PAYMENT_PROVIDER='paytabs', HTTP_X_PAYMENT_SIGNATURE='bad')
+    resp = async_to_sync(AsyncPaymentWebhookView.as_view())(request)
+    assert resp.status_code == 403
+    assert not WebhookEvent.objects.exists()
@@ -0,0 +1,65 @@
+"""Load test for StripeAdapter against a local in-process stripe-mock stand-in."""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from payments.adapters import StripeAdapter
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        with self.server.lock:
+            self.server.requests += 1
+            n = self.server.requests
+        body = json.dumps({
+            'id': f'pi_{n}', 'object': 'payment_intent', 'client_secret': f'pi_{n}_secret',
+            'amount': 1000, 'currency': 'sar',
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_stripe():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeStripeHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_intents_reuse_pooled_connections(fake_stripe, settings):
+    settings.USE_STRIPE_MOCK = True
+    settings.STRIPE_MOCK_URL = f'http://127.0.0.1:{fake_stripe.server_address[1]}'
+    settings.PAYMENT_HTTP_POOL_SIZE = 8
+    adapter = StripeAdapter()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        intents = list(pool.map(lambda i: adapter.create_payment_intent(amount=10, currency='SAR'), range(200)))
+
+    assert all(i['id'].startswith('pi_') for i in intents)
+    assert fake_stripe.requests == 200
+    # keep-alive pool: a handful of sockets, not one per request
+    assert fake_stripe.connections <= 8
@@ -0,0 +1,109 @@
+import hashlib
+import hmac
+import json
+import pytest
+from rest_framework.test import APIRequestFactory
+from payments.models import WebhookEvent
+from payments.views import PaymentWebhookView
+from payments.tasks import process_webhook_inbox
+
+
+def _post_paytabs(payload, secret='s3cret'):
+    body = json.dumps(payload).encode('utf-8')
+    sig = hmac.new(secret.encode('utf-8'), msg=body, digestmod=hashlib.sha256).hexdigest()
+    request = APIRequestFactory().post('/api/payments/webhook/', body, content_type='application/json',
+                                       HTTP_X_PAYMENT_PROVIDER='paytabs', HTTP_X_PAYMENT_SIGNATURE=sig)
+    return PaymentWebhookView.as_view()(request)
+
+
+@pytest.mark.django_db
+def test_webhook_redeliveries_are_stored_once_and_not_enqueued(monkeypatch):
+    monkeypatch.setenv('PAYTABS_SECRET', 's3cret')
+    enqueued = []
+    monkeypatch.setattr('receipts.tasks.generate_receipt_for_payment.delay', lambda **kw: enqueued.append(kw))
+
+    payload = {'event_id': 'evt_1', 'payment_id': 'pay_1', 'amount': '25.00', 'currency': 'SAR'}
+    for _ in range(3):
+        resp = _post_paytabs(payload)
+        assert resp.status_code == 200
+
+    assert WebhookEvent.objects.filter(provider='paytabs', event_id='evt_1').count() == 1
+    assert enqueued == []
+
+
+@pytest.mark.django_db
+def test_webhook_without_event_id_dedupes_on_body(monkeypatch):
+    monkeypatch.setenv('PAYTABS_SECRET', 's3cret')
+    _post_paytabs({'transaction_id': 'tx_9', 'amount': 5})
+    _post_paytabs({'transaction_id': 'tx_9', 'amount': 5})
+    assert WebhookEvent.objects.count() == 1
+    assert WebhookEvent.objects.get().event_id.startswith('sha256:')
+
+
+@pytest.mark.django_db
+def test_invalid_signature_is_rejected_without_insert(monkeypatch):
+    monkeypatch.setenv('PAYTABS_SECRET', 's3cret')
+    resp = _post_paytabs({'event_id': 'evt_bad', 'payment_id': 'p'}, secret='wrong')
+    assert resp.status_code == 403
+    assert not WebhookEvent.objects.exists()
+
+
+@pytest.mark.django_db
+def test_drain_generates_one_receipt_per_payment(monkeypatch):
+    calls = []
+    monkeypatch.setattr('receipts.tasks.generate_receipt_for_payment', lambda **kw: calls.append(kw))
+    monkeypatch.setattr('payments.tasks.process_webhook_inbox.delay', lambda **kw: None)
+    WebhookEvent.record('stripe', 'evt_a', 'pi_1', amount=10, currency='sar')
+    WebhookEvent.record('stripe', 'evt_b', 'pi_1', amount=10, currency='sar')
+    WebhookEvent.record('paytabs', 'evt_c', 'pay_2', amount='7.50')
+
+    result = process_webhook_inbox(batch_size=10)
+
+    assert result['claimed'] == 3
+    assert sorted(c['payment_id'] for c in calls) == ['pay_2', 'pi_1']
+    assert WebhookEvent.objects.filter(status='processed').count() == 3
+    assert process_webhook_inbox(batch_size=10)['claimed'] == 0
+
+
+@pytest.mark.django_db
+def test_drain_marks_failures_for_retry(monkeypatch):
+    def boom(**kw):
+        raise RuntimeError('s3 down')
+
+    monkeypatch.setattr('receipts.tasks.generate_receipt_for_payment', boom)
+    WebhookEvent.record('paytabs', 'evt_f', 'pay_f', amount=1)
+    result = process_webhook_inbox(batch_size=10)
+    event = WebhookEvent.objects.get(event_id='evt_f')
+    assert result['failed'] == 1
+    assert event.status == 'failed' and event.attempts == 1 and 's3 down' in event.last_error
+
+
+@pytest.mark.django_db
+def test_legacy_events_for_one_payment_stay_distinct(monkeypatch):
+    monkeypatch.setenv('PAYTABS_SECRET', 's3cret')
+    _post_paytabs({'id': 'tx_7', 'status': 'pending', 'amount': 5})
+    _post_paytabs({'id': 'tx_7', 'status': 'paid', 'amount': 5})
+    assert WebhookEvent.objects.filter(payment_id='tx_7').count() == 2
+
+
+@pytest.mark.django_db
+def test_drain_reclaims_rows_left_processing_by_a_dead_worker(monkeypatch):
+    from datetime import timedelta
+    from django.utils import timezone
+    from payments.tasks import WEBHOOK_CLAIM_TIMEOUT_SECONDS
+
+    calls = []
+    monkeypatch.setattr('receipts.tasks.generate_receipt_for_payment', lambda **kw: calls.append(kw))
+    WebhookEvent.record('paytabs', 'evt_s', 'pay_s', amount=1)
+    WebhookEvent.record('paytabs', 'evt_r', 'pay_r', amount=1)
+    WebhookEvent.objects.update(status='processing', attempts=1)
+    WebhookEvent.objects.filter(event_id='evt_s').update(
+        claimed_at=timezone.now() - timedelta(seconds=WEBHOOK_CLAIM_TIMEOUT_SECONDS + 1))
+    WebhookEvent.objects.filter(event_id='evt_r').update(claimed_at=timezone.now())
+
+    result = process_webhook_inbox(batch_size=10)
+
+    assert result['claimed'] == 1
+    assert [c['payment_id'] for c in calls] == ['pay_s']
+    assert WebhookEvent.objects.get(event_id='evt_s').status == 'processed'
+    assert WebhookEvent.objects.get(event_id='evt_r').status == 'processing'
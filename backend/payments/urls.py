@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import CreatePaymentIntentView, PaymentWebhookView, TestWebhookView
+from .async_views import AsyncCreatePaymentIntentView, AsyncPaymentWebhookView
 from .api import PaymentViewSet, ReceiptViewSet
 
 router = DefaultRouter()
@@ -11,5 +12,7 @@ urlpatterns = [
     path('', include(router.urls)),
     path('create-intent/', CreatePaymentIntentView.as_view(), name='create_intent'),
     path('webhook/', PaymentWebhookView.as_view(), name='payment_webhook'),
+    path('create-intent-async/', AsyncCreatePaymentIntentView.as_view(), name='create_intent_async'),
+    path('webhook-async/', AsyncPaymentWebhookView.as_view(), name='payment_webhook_async'),
     path('test-webhook/', TestWebhookView.as_view(), name='test_webhook'),
 ]
@@ -36,6 +36,20 @@ def get_provider_secret(provider: str) -> str:
     return ''
 
 
+def webhook_event_id(data, payload_bytes: bytes) -> str:
+    """Idempotency key for a webhook delivery.
+
+    Uses the provider's event id when the payload carries one; otherwise a hash of the
+    raw body, so byte-identical redeliveries still collapse to one inbox row. A bare
+    `id` is not used: the legacy providers put the payment / transaction id there, and
+    distinct events for one payment (pending, paid, refunded) must stay distinct.
+    """
+    event_id = data.get('event_id') if hasattr(data, 'get') else None
+    if event_id:
+        return str(event_id)
+    return 'sha256:' + hashlib.sha256(payload_bytes).hexdigest()
+
+
 # PDF generation for receipts (WeasyPrint)
 from django.conf import settings
 from django.template.loader import render_to_string
@@ -1,5 +1,7 @@
 from rest_framework import views, response, permissions
 from .adapters import get_adapter
+from .models import WebhookEvent
+from .utils import webhook_event_id
 
 
 class CreatePaymentIntentView(views.APIView):
@@ -18,41 +20,6 @@ class CreatePaymentIntentView(views.APIView):
         return response.Response(intent, status=201)
 
 
-class PaymentWebhookView(views.APIView):
-    permission_classes = []
-
-    def post(self, request):
-        # Handle webhook payload from payment provider
-        provider = request.headers.get('X-PAYMENT-PROVIDER', 'paytabs').lower()
-        signature = request.headers.get('X-PAYMENT-SIGNATURE', '')
-        from .utils import get_provider_secret, verify_paytabs_signature, verify_tap_signature, verify_hyperpay_signature
-        secret = get_provider_secret(provider)
-        body = request.body or b''
-
-        verified = False
-        if provider == 'paytabs':
-            verified = verify_paytabs_signature(body, signature, secret)
-        elif provider == 'tap':
-            verified = verify_tap_signature(body, signature, secret)
-        elif provider == 'hyperpay':
-            verified = verify_hyperpay_signature(body, signature, secret)
-
-        if not verified:
-            return response.Response({'status': 'forbidden', 'detail': 'invalid signature'}, status=403)
-
-        # parse minimal payload - production: validate more carefully
-        data = request.data
-        payment_id = data.get('payment_id') or data.get('transaction_id') or data.get('id')
-        amount = data.get('amount')
-        currency = data.get('currency')
-
-        # Enqueue receipt generation task
-        from receipts.tasks import generate_receipt_for_payment
-        generate_receipt_for_payment.delay(payment_id=payment_id, amount=amount, currency=currency)
-
-        return response.Response({'status': 'ok'})
-
-
 class TestWebhookView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -75,65 +42,83 @@ class TestWebhookView(views.APIView):
         return response.Response({'status': 'ok', 'payment_id': payment_id})
 
 
+def parse_verified_webhook(provider, body, headers, data):
+    """Verify a provider webhook and extract the inbox fields.
+
+    Returns None when the signature is invalid, an empty dict when the event is
+    valid but carries no payment id, and otherwise the kwargs for
+    `WebhookEvent.record`. Verification is local (HMAC), so this is safe to call
+    from both the sync and the async webhook views.
+    """
+    # special case: stripe uses its own signature header and verification
+    if provider in ('stripe', 'stripe_api'):
+        adapter = get_adapter('stripe')
+        event = adapter.verify_webhook(body, headers)
+        if not event:
+            return None
+        # Example: handle payment_intent.succeeded
+        ev_type = getattr(event, 'get', None) and event.get('type') or None
+        data_obj = None
+        if ev_type and 'data' in event:
+            data_obj = event['data'].get('object')
+        if data_obj is None:
+            # fallback to basic body parsing
+            payment_id = data.get('payment_id') or data.get('id')
+            amount = data.get('amount')
+            currency = data.get('currency')
+        else:
+            payment_id = data_obj.get('id') or (data_obj.get('metadata') or {}).get('payment_id')
+            amount = (data_obj.get('amount') or 0) / 100.0 if data_obj.get('amount') else None
+            currency = data_obj.get('currency')
+
+        if not payment_id:
+            return {}
+        return {
+            'provider': 'stripe',
+            'event_id': event.get('id') or webhook_event_id(data, body),
+            'payment_id': payment_id, 'amount': amount, 'currency': currency,
+            'payload': data,
+        }
+
+    # legacy providers
+    signature = headers.get('X-PAYMENT-SIGNATURE', '')
+    from .utils import get_provider_secret, verify_paytabs_signature, verify_tap_signature, verify_hyperpay_signature
+    secret = get_provider_secret(provider)
+
+    verified = False
+    if provider == 'paytabs':
+        verified = verify_paytabs_signature(body, signature, secret)
+    elif provider == 'tap':
+        verified = verify_tap_signature(body, signature, secret)
+    elif provider == 'hyperpay':
+        verified = verify_hyperpay_signature(body, signature, secret)
+
+    if not verified:
+        return None
+
+    # parse minimal payload - production: validate more carefully
+    payment_id = data.get('payment_id') or data.get('transaction_id') or data.get('id')
+    if not payment_id:
+        return {}
+    return {
+        'provider': provider,
+        'event_id': webhook_event_id(data, body),
+        'payment_id': payment_id, 'amount': data.get('amount'), 'currency': data.get('currency'),
+        'payload': data,
+    }
+
+
 class PaymentWebhookView(views.APIView):
     permission_classes = []
 
     def post(self, request):
-        # Unified webhook handler (supports paytabs/tap/hyperpay and stripe)
+        # Unified webhook handler (supports paytabs/tap/hyperpay and stripe).
+        # Verified events are written to the WebhookEvent inbox (duplicates ignored) and
+        # processed in batches by payments.tasks.process_webhook_inbox.
         provider = request.headers.get('X-PAYMENT-PROVIDER', 'paytabs').lower()
-        body = request.body or b''
-
-        # special case: stripe uses its own signature header and verification
-        if provider in ('stripe', 'stripe_api'):
-            adapter = get_adapter('stripe')
-            event = adapter.verify_webhook(body, request.headers)
-            if not event:
-                return response.Response({'status': 'forbidden', 'detail': 'invalid signature'}, status=403)
-            # Example: handle payment_intent.succeeded
-            ev_type = getattr(event, 'get', None) and event.get('type') or None
-            data_obj = None
-            if ev_type and 'data' in event:
-                data_obj = event['data'].get('object')
-            if data_obj is None:
-                # fallback to basic body parsing
-                data = request.data
-                payment_id = data.get('payment_id') or data.get('id')
-                amount = data.get('amount')
-                currency = data.get('currency')
-            else:
-                payment_id = data_obj.get('id') or (data_obj.get('metadata') or {}).get('payment_id')
-                amount = (data_obj.get('amount') or 0) / 100.0 if data_obj.get('amount') else None
-                currency = data_obj.get('currency')
-
-            from receipts.tasks import generate_receipt_for_payment
-            if payment_id:
-                generate_receipt_for_payment.delay(payment_id=payment_id, amount=amount, currency=currency)
-            return response.Response({'status': 'ok'})
-
-        # legacy providers
-        signature = request.headers.get('X-PAYMENT-SIGNATURE', '')
-        from .utils import get_provider_secret, verify_paytabs_signature, verify_tap_signature, verify_hyperpay_signature
-        secret = get_provider_secret(provider)
-
-        verified = False
-        if provider == 'paytabs':
-            verified = verify_paytabs_signature(body, signature, secret)
-        elif provider == 'tap':
-            verified = verify_tap_signature(body, signature, secret)
-        elif provider == 'hyperpay':
-            verified = verify_hyperpay_signature(body, signature, secret)
-
-        if not verified:
+        event = parse_verified_webhook(provider, request.body or b'', request.headers, request.data)
+        if event is None:
             return response.Response({'status': 'forbidden', 'detail': 'invalid signature'}, status=403)
-
-        # parse minimal payload - production: validate more carefully
-        data = request.data
-        payment_id = data.get('payment_id') or data.get('transaction_id') or data.get('id')
-        amount = data.get('amount')
-        currency = data.get('currency')
-
-        # Enqueue receipt generation task
-        from receipts.tasks import generate_receipt_for_payment
-        generate_receipt_for_payment.delay(payment_id=payment_id, amount=amount, currency=currency)
-
+        if event:
+            WebhookEvent.record(**event)
         return response.Response({'status': 'ok'})
@@ -0,0 +1,97 @@
+"""Content-addressed storage for receipt artefacts (QR images and PDFs).
+
+Each artefact is stored under a key derived from a hash of its inputs, so
+producing the same artefact twice maps to the same object. Before rendering or
+uploading, callers check whether that object already exists and skip the work
+if it does, which keeps task retries cheap and idempotent.
+"""
+import hashlib
+import io
+import os
+from functools import lru_cache
+
+from django.conf import settings
+
+
+def artifact_digest(*parts):
+    """Return a stable sha256 hex digest over the given str/bytes parts."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        h.update(part)
+        # separator so ('ab', 'c') and ('a', 'bc') hash differently
+        h.update(b'\x00')
+    return h.hexdigest()
+
+
+def qr_payload_for(receipt):
+    return f"invoice:{receipt.invoice_number}"
+
+
+@lru_cache(maxsize=512)
+def qr_png(payload):
+    """PNG bytes for a QR code encoding `payload`, memoised per process."""
+    import qrcode
+    buf = io.BytesIO()
+    qrcode.make(payload).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def artifact_key(kind, digest, ext):
+    return f"receipts/{kind}/{digest}.{ext}"
+
+
+class ArtifactStore:
+    """Put artefacts to S3 when a client and bucket are available, else under MEDIA_ROOT.
+
+    `s3` may be None; after an S3 error the store falls back to local files for the
+    rest of its lifetime, matching the previous behaviour of the receipt task.
+    """
+
+    def __init__(self, s3=None):
+        self.s3 = s3 if getattr(settings, 'AWS_STORAGE_BUCKET_NAME', None) else None
+
+    @property
+    def uses_s3(self):
+        return self.s3 is not None
+
+    def _local_path(self, key):
+        return os.path.join(settings.MEDIA_ROOT, *key.split('/'))
+
+    def s3_url(self, key):
+        return f"{settings.AWS_S3_ENDPOINT_URL}/{settings.AWS_STORAGE_BUCKET_NAME}/{key}"
+
+    def exists(self, key):
+        if self.s3 is not None:
+            try:
+                self.s3.head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key)
+                return True
+            except Exception:
+                return False
+        return os.path.exists(self._local_path(key))
+
+    def put(self, key, body_factory, content_type):
+        """Store the artefact at `key` unless it already exists.
+
+        `body_factory` is only called when the object is missing, so expensive
+        rendering is skipped on a hit. Returns (url, stored_in_s3).
+        """
+        if self.s3 is not None:
+            try:
+                if not self.exists(key):
+                    self.s3.put_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key,
+                                       Body=body_factory(), ContentType=content_type)
+                return self.s3_url(key), True
+            except Exception:
+                self.s3 = None
+
+        path = self._local_path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a temp file first so a crash never leaves a partial artefact behind
+            tmp_path = f"{path}.tmp{os.getpid()}"
+            with open(tmp_path, 'wb') as f:
+                f.write(body_factory())
+            os.replace(tmp_path, path)
+        return f"file://{path}", False
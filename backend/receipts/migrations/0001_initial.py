@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Receipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_id', models.CharField(max_length=255)),
+                ('tenant_id', models.CharField(max_length=255)),
+                ('invoice_number', models.CharField(max_length=255)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('currency', models.CharField(default='SAR', max_length=10)),
+                ('vat_amount', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('s3_key', models.CharField(blank=True, max_length=500, null=True)),
+                ('s3_url', models.URLField(blank=True, null=True)),
+                ('qr_code_url', models.URLField(blank=True, null=True)),
+                ('locale', models.CharField(default='en', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
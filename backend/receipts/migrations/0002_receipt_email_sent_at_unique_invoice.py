@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:23
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def drop_duplicate_receipts(apps, schema_editor):
+    # retried generate_receipt_for_payment runs could store the same receipt twice;
+    # keep the first row of each (payment_id, invoice_number) so the constraint applies
+    Receipt = apps.get_model('receipts', 'Receipt')
+    keep = (Receipt.objects.values('payment_id', 'invoice_number')
+            .annotate(first=Min('pk')).values_list('first', flat=True))
+    Receipt.objects.exclude(pk__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receipt',
+            name='email_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(drop_duplicate_receipts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='receipt',
+            constraint=models.UniqueConstraint(fields=('payment_id', 'invoice_number'), name='receipt_unique_payment_invoice'),
+        ),
+    ]
@@ -12,19 +12,16 @@ class Receipt(models.Model):
     s3_url = models.URLField(blank=True, null=True)
     qr_code_url = models.URLField(blank=True, null=True)
     locale = models.CharField(max_length=10, default='en')
+    # set when the receipt email went out, so task retries don't send it again
+    email_sent_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def get_presigned_url(self, expires_in=3600):
-        # helper to generate presigned URL for s3_key if available
-        if self.s3_key and hasattr(self, 's3_key'):
+        # helper to generate presigned URL for s3_key if available; reuses a cached URL until near expiry
+        if self.s3_key:
             try:
-                import boto3
-                from django.conf import settings
-                s3 = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                  aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                                  endpoint_url=settings.AWS_S3_ENDPOINT_URL,
-                                  region_name=settings.AWS_S3_REGION_NAME)
-                return s3.generate_presigned_url('get_object', Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': self.s3_key}, ExpiresIn=expires_in)
+                from .utils import get_presigned_url
+                return get_presigned_url(self.s3_key, expires_in=expires_in)
             except Exception:
                 return None
         # fallback: return stored s3_url or None
@@ -32,6 +29,9 @@ class Receipt(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['payment_id', 'invoice_number'], name='receipt_unique_payment_invoice'),
+        ]
 
     def __str__(self):
         return self.invoice_number
@@ -1,11 +1,10 @@
 from celery import shared_task
 from django.conf import settings
 from django.core.mail import send_mail, EmailMessage
+from django.utils import timezone
 from .models import Receipt
-from .utils import render_receipt_pdf
-import boto3
-import qrcode
-import io
+from .utils import render_receipt_html, render_receipt_pdf, cache_presigned_url, get_s3_client
+from .artifacts import ArtifactStore, artifact_digest, artifact_key, qr_payload_for, qr_png
 import os
 import logging
 
@@ -39,91 +38,57 @@ def generate_receipt_for_payment(self, payment_id=None, amount=None, currency='S
         tenant_id = getattr(tenant, 'slug', str(getattr(tenant, 'id', 'default')))
 
     invoice_number = f'INV-{payment_id}'
-    receipt = Receipt.objects.create(payment_id=payment_id, tenant_id=tenant_id, invoice_number=invoice_number, amount=amount or (getattr(payment, 'amount', 0)), currency=currency)
-
-    # generate QR code (simple text containing invoice URL)
-    qr = qrcode.make(f"invoice:{receipt.invoice_number}")
-    buf = io.BytesIO()
-    qr.save(buf, format='PNG')
-    buf.seek(0)
-
-    qr_url = None
-    pdf_url = None
+    # reuse the row from an earlier attempt so retries don't create duplicate receipts;
+    # the unique constraint makes concurrent attempts settle on one row
+    receipt, created = Receipt.objects.get_or_create(
+        payment_id=payment_id, invoice_number=invoice_number,
+        defaults={'tenant_id': tenant_id, 'amount': amount or (getattr(payment, 'amount', 0)), 'currency': currency})
+    if created:
+        # reload so amounts render exactly as they will on a retry (Decimal from the DB, not the raw task arg)
+        receipt.refresh_from_db()
 
     # try upload to S3; if fails, write to local MEDIA_ROOT
     s3 = None
     try:
-        s3 = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                          endpoint_url=settings.AWS_S3_ENDPOINT_URL,
-                          region_name=settings.AWS_S3_REGION_NAME)
+        s3 = get_s3_client()
     except Exception:
         s3 = None
+    store = ArtifactStore(s3)
 
-    # QR
-    if s3 and settings.AWS_STORAGE_BUCKET_NAME:
-        try:
-            qr_key = f"receipts/qr_{receipt.invoice_number}.png"
-            s3.put_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=qr_key, Body=buf, ContentType='image/png')
-            qr_url = f"{settings.AWS_S3_ENDPOINT_URL}/{settings.AWS_STORAGE_BUCKET_NAME}/{qr_key}"
-            receipt.qr_code_url = qr_url
-            receipt.save(update_fields=['qr_code_url'])
-            receipt_qr_key = qr_key
-        except Exception:
-            s3 = None
-            receipt_qr_key = None
-
-    if not qr_url:
-        # write locally
-        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'receipts'), exist_ok=True)
-        qr_path = os.path.join(settings.MEDIA_ROOT, 'receipts', f"qr_{receipt.invoice_number}.png")
-        with open(qr_path, 'wb') as f:
-            f.write(buf.getvalue())
-        qr_url = f"file://{qr_path}"
+    # QR: keyed by its payload, rendered and uploaded only if not already stored
+    qr_payload = qr_payload_for(receipt)
+    qr_key = artifact_key('qr', artifact_digest('qr', qr_payload), 'png')
+    qr_url, _ = store.put(qr_key, lambda: qr_png(qr_payload), 'image/png')
+    if receipt.qr_code_url != qr_url:
         receipt.qr_code_url = qr_url
         receipt.save(update_fields=['qr_code_url'])
-        receipt_qr_key = None
 
-    # render PDF
-    pdf = render_receipt_pdf(receipt, locale=locale)
+    # PDF: keyed by the rendered HTML, so WeasyPrint only runs when the content changed
+    html = render_receipt_html(receipt, locale=locale)
+    pdf_key = artifact_key('pdf', artifact_digest('pdf', locale, html), 'pdf')
+    pdf_url, in_s3 = store.put(pdf_key, lambda: render_receipt_pdf(receipt, locale=locale, html=html), 'application/pdf')
 
-    # upload PDF or write local
     receipt_pdf_key = None
-    if s3 and settings.AWS_STORAGE_BUCKET_NAME:
+    if in_s3:
+        receipt_pdf_key = pdf_key
+        # generate presigned url
         try:
-            pdf_key = f"receipts/{receipt.invoice_number}.pdf"
-            s3.put_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=pdf_key, Body=pdf, ContentType='application/pdf')
-            receipt_pdf_key = pdf_key
-            # generate presigned url
-            try:
-                pdf_url = s3.generate_presigned_url('get_object', Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': pdf_key}, ExpiresIn=3600)
-            except Exception:
-                pdf_url = f"{settings.AWS_S3_ENDPOINT_URL}/{settings.AWS_STORAGE_BUCKET_NAME}/{pdf_key}"
+            pdf_url = store.s3.generate_presigned_url('get_object', Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': pdf_key}, ExpiresIn=3600)
+            # seed the presign cache so the email link below reuses this URL
+            cache_presigned_url(pdf_key, pdf_url, expires_in=3600)
         except Exception:
-            pdf_url = None
-
-    if not pdf_url:
-        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'receipts'), exist_ok=True)
-        pdf_path = os.path.join(settings.MEDIA_ROOT, 'receipts', f"{receipt.invoice_number}.pdf")
-        with open(pdf_path, 'wb') as f:
-            f.write(pdf)
-        pdf_url = f"file://{pdf_path}"
+            pass
 
     # update receipt with s3 keys and url
-    if receipt_pdf_key:
-        receipt.s3_key = receipt_pdf_key
-        receipt.s3_url = pdf_url
-    else:
-        receipt.s3_key = None
-        receipt.s3_url = pdf_url
-
-    if receipt_qr_key:
-        # store QR as object key for reference if needed
-        pass
-
-    receipt.save()
-
-    # send notification email (SendGrid preferred)
+    receipt.s3_key = receipt_pdf_key
+    receipt.s3_url = pdf_url
+    receipt.save(update_fields=['s3_key', 's3_url'])
+
+    # send notification email (SendGrid preferred), once per receipt: a retry or a
+    # second run of the task finds it already claimed and skips it
+    claimed = Receipt.objects.filter(pk=receipt.pk, email_sent_at__isnull=True).update(email_sent_at=timezone.now())
+    if not claimed:
+        return {'receipt_id': receipt.id, 'pdf_url': pdf_url}
     try:
         if getattr(settings, 'SENDGRID_API_KEY', None):
             # use SendGrid API to send a message with link
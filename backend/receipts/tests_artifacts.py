@@ -0,0 +1,108 @@
+import pytest
+from receipts.artifacts import artifact_digest, artifact_key, qr_png
+from receipts.tasks import generate_receipt_for_payment
+from receipts.models import Receipt
+from receipts.utils import reset_s3_client
+
+
+class DummyS3:
+    def __init__(self):
+        self.storage = {}
+        self.puts = []
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.storage:
+            raise Exception('404')
+        return {}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.puts.append(Key)
+        self.storage[Key] = Body
+        return True
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        return f"https://s3.example.com/{Params['Key']}?exp={ExpiresIn}"
+
+
+def test_artifact_digest_is_stable_and_separates_parts():
+    assert artifact_digest('qr', 'abc') == artifact_digest('qr', b'abc')
+    assert artifact_digest('ab', 'c') != artifact_digest('a', 'bc')
+    assert artifact_key('qr', 'deadbeef', 'png') == 'receipts/qr/deadbeef.png'
+
+
+def test_qr_png_is_memoised():
+    assert qr_png('invoice:INV-1') is qr_png('invoice:INV-1')
+
+
+@pytest.mark.django_db
+def test_retry_reuses_receipt_and_skips_existing_uploads(monkeypatch, settings):
+    dummy = DummyS3()
+    monkeypatch.setattr('boto3.client', lambda *args, **kwargs: dummy)
+    reset_s3_client()
+    rendered = []
+
+    def fake_render(receipt, locale='en', html=None):
+        rendered.append(receipt.id)
+        return b'PDF'
+
+    monkeypatch.setattr('receipts.tasks.render_receipt_pdf', fake_render)
+    settings.AWS_STORAGE_BUCKET_NAME = 'test-bucket'
+    settings.AWS_S3_ENDPOINT_URL = 'https://s3.example.com'
+
+    first = generate_receipt_for_payment(payment_id='p_retry', amount=10, currency='SAR')
+    assert len(dummy.puts) == 2
+    second = generate_receipt_for_payment(payment_id='p_retry', amount=10, currency='SAR')
+
+    assert first['receipt_id'] == second['receipt_id']
+    assert Receipt.objects.filter(payment_id='p_retry').count() == 1
+    assert len(dummy.puts) == 2
+    assert len(rendered) == 1
+    r = Receipt.objects.get(id=first['receipt_id'])
+    assert r.s3_key.startswith('receipts/pdf/')
+
+
+@pytest.mark.django_db
+def test_local_fallback_is_idempotent(monkeypatch, settings, tmp_path):
+    def raise_client(*args, **kwargs):
+        raise Exception('S3 not available')
+
+    monkeypatch.setattr('boto3.client', raise_client)
+    reset_s3_client()
+    settings.MEDIA_ROOT = str(tmp_path)
+    rendered = []
+
+    def fake_render(receipt, locale='en', html=None):
+        rendered.append(receipt.id)
+        return b'PDF'
+
+    monkeypatch.setattr('receipts.tasks.render_receipt_pdf', fake_render)
+
+    first = generate_receipt_for_payment(payment_id='p_local', amount=5, currency='SAR')
+    second = generate_receipt_for_payment(payment_id='p_local', amount=5, currency='SAR')
+    assert first == second
+    assert len(rendered) == 1
+    assert first['pdf_url'].startswith(f'file://{tmp_path}')
+
+
+@pytest.mark.django_db
+def test_retries_share_the_s3_client_and_email_once(monkeypatch, settings):
+    built = []
+
+    def build(*args, **kwargs):
+        built.append(args)
+        return DummyS3()
+
+    monkeypatch.setattr('boto3.client', build)
+    reset_s3_client()
+    monkeypatch.setattr('receipts.tasks.render_receipt_pdf', lambda receipt, locale='en', html=None: b'PDF')
+    sent = []
+    monkeypatch.setattr('receipts.tasks.send_mail', lambda **kwargs: sent.append(kwargs['subject']))
+    settings.AWS_STORAGE_BUCKET_NAME = 'test-bucket'
+    settings.SENDGRID_API_KEY = None
+
+    first = generate_receipt_for_payment(payment_id='p_once', amount=10, currency='SAR')
+    generate_receipt_for_payment(payment_id='p_once', amount=10, currency='SAR')
+
+    assert len(built) == 1
+    assert sent == ['Your receipt INV-p_once']
+    assert Receipt.objects.get(id=first['receipt_id']).email_sent_at is not None
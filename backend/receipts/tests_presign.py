@@ -12,3 +12,81 @@ def test_presign_requires_filename():
     client.force_authenticate(user=user)
     resp = client.post(reverse('receipts-presign-upload'))
     assert resp.status_code == 400
+
+
+class CountingS3:
+    def __init__(self):
+        self.signed = 0
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        self.signed += 1
+        return f"https://s3.example.com/{Params['Key']}?sig={self.signed}"
+
+
+@pytest.fixture
+def counting_s3(monkeypatch, settings):
+    from django.core.cache import cache
+    from receipts.utils import reset_s3_client
+    built = []
+    s3 = CountingS3()
+
+    def fake_client(*args, **kwargs):
+        built.append(kwargs)
+        return s3
+
+    monkeypatch.setattr('boto3.client', fake_client)
+    settings.AWS_STORAGE_BUCKET_NAME = 'test-bucket'
+    reset_s3_client()
+    cache.clear()
+    s3.built = built
+    yield s3
+    reset_s3_client()
+    cache.clear()
+
+
+def test_presigned_url_is_reused_until_expiry(counting_s3):
+    from receipts.utils import get_presigned_url
+    first = get_presigned_url('receipts/INV-1.pdf')
+    second = get_presigned_url('receipts/INV-1.pdf')
+    assert first == second
+    assert counting_s3.signed == 1
+    assert len(counting_s3.built) == 1
+
+
+def test_short_lived_urls_are_not_cached(counting_s3, settings):
+    from receipts.utils import get_presigned_url
+    settings.RECEIPT_PRESIGN_REFRESH_MARGIN = 300
+    get_presigned_url('receipts/INV-1.pdf', expires_in=60)
+    get_presigned_url('receipts/INV-1.pdf', expires_in=60)
+    assert counting_s3.signed == 2
+
+
+def test_bulk_presign_uses_one_client_and_skips_cached(counting_s3):
+    from receipts.utils import get_presigned_url, get_presigned_urls
+    get_presigned_url('receipts/INV-0.pdf')
+    keys = [f'receipts/INV-{i}.pdf' for i in range(100)]
+    urls = get_presigned_urls(keys + [None, ''])
+    assert set(urls) == set(keys)
+    assert counting_s3.signed == 100
+    assert len(counting_s3.built) == 1
+
+
+@pytest.mark.django_db
+def test_receipt_get_presigned_url_uses_cache(counting_s3):
+    from receipts.models import Receipt
+    r = Receipt.objects.create(payment_id='p1', tenant_id='t', invoice_number='INV-p1', amount=10, s3_key='receipts/INV-p1.pdf')
+    assert r.get_presigned_url() == r.get_presigned_url()
+    assert counting_s3.signed == 1
+
+
+@pytest.mark.django_db
+def test_receipt_urls_for_payments_picks_latest_receipt(counting_s3):
+    from receipts.models import Receipt
+    from receipts.utils import get_receipt_urls_for_payments
+    Receipt.objects.create(payment_id='p1', tenant_id='t', invoice_number='INV-p1', amount=10, s3_key='receipts/old.pdf')
+    Receipt.objects.create(payment_id='p1', tenant_id='t', invoice_number='INV-p1-2', amount=10, s3_key='receipts/new.pdf')
+    Receipt.objects.create(payment_id='p2', tenant_id='t', invoice_number='INV-p2', amount=10, s3_url='file:///tmp/INV-p2.pdf')
+    urls = get_receipt_urls_for_payments(['p1', 'p2', 'p3'])
+    assert urls['p1'].startswith('https://s3.example.com/receipts/new.pdf')
+    assert urls['p2'] == 'file:///tmp/INV-p2.pdf'
+    assert 'p3' not in urls
@@ -1,6 +1,7 @@
 import pytest
 from receipts.tasks import generate_receipt_for_payment
 from receipts.models import Receipt
+from receipts.utils import reset_s3_client
 
 
 class DummyS3:
@@ -19,6 +20,7 @@ class DummyS3:
 def test_generate_receipt_uploads_to_s3_and_sends_email(monkeypatch, settings):
     dummy = DummyS3()
     monkeypatch.setattr('boto3.client', lambda *args, **kwargs: dummy)
+    reset_s3_client()
 
     sent = {'sent': False}
 
@@ -2,6 +2,7 @@ import pytest
 from django.contrib.auth import get_user_model
 from receipts.tasks import generate_receipt_for_payment
 from receipts.models import Receipt
+from receipts.utils import reset_s3_client
 from unittest import mock
 
 @pytest.mark.django_db
@@ -14,6 +15,7 @@ def test_generate_receipt_for_payment_creates_receipt(monkeypatch):
             return f"https://s3.example.com/{Params['Key']}"
 
     monkeypatch.setattr('boto3.client', lambda *args, **kwargs: DummyS3())
+    reset_s3_client()
 
     res = generate_receipt_for_payment(payment_id='pay_1', amount=100, currency='SAR')
     assert 'receipt_id' in res
@@ -2,6 +2,7 @@ import pytest
 import boto3
 from receipts.tasks import generate_receipt_for_payment
 from receipts.models import Receipt
+from receipts.utils import reset_s3_client
 
 
 @pytest.mark.django_db
@@ -11,6 +12,7 @@ def test_generate_receipt_fallback_to_local(monkeypatch, settings, tmp_path):
         raise Exception('S3 not available')
 
     monkeypatch.setattr('boto3.client', raise_client)
+    reset_s3_client()
 
     # ensure MEDIA_ROOT exists and is temporary
     settings.MEDIA_ROOT = str(tmp_path)
@@ -1,10 +1,21 @@
+import hashlib
+import threading
+
 from django.template.loader import render_to_string
 from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
 
-def render_receipt_pdf(receipt, locale='en'):
+def render_receipt_html(receipt, locale='en'):
     template = 'receipts/receipt_en.html' if locale == 'en' else 'receipts/receipt_ar.html'
-    html = render_to_string(template, {'receipt': receipt})
+    return render_to_string(template, {'receipt': receipt})
+
+
+def render_receipt_pdf(receipt, locale='en', html=None):
+    if html is None:
+        html = render_receipt_html(receipt, locale=locale)
 
     try:
         # Import WeasyPrint lazily to avoid hard dependency at import time
@@ -16,3 +27,134 @@ def render_receipt_pdf(receipt, locale='en'):
         # Fallback to HTML bytes when weasyprint or system deps aren't available
         return html.encode('utf-8')
 
+
+# S3 client and presigned URL cache
+#
+# boto3 clients are thread-safe and expensive to build, so one client is kept per
+# process and rebuilt only when the AWS settings change. Presigned GET URLs are
+# cached by s3_key and reused until shortly before they expire.
+
+PRESIGN_CACHE_PREFIX = 'receipts:presign'
+
+_s3_client = None
+_s3_client_config = None
+_s3_client_lock = threading.Lock()
+
+
+def _s3_config():
+    return (
+        settings.AWS_ACCESS_KEY_ID,
+        settings.AWS_SECRET_ACCESS_KEY,
+        settings.AWS_S3_ENDPOINT_URL,
+        settings.AWS_S3_REGION_NAME,
+    )
+
+
+def get_s3_client():
+    """Return the process-wide boto3 S3 client, creating it on first use."""
+    global _s3_client, _s3_client_config
+    config = _s3_config()
+    with _s3_client_lock:
+        if _s3_client is None or _s3_client_config != config:
+            import boto3
+            access_key, secret_key, endpoint_url, region_name = config
+            _s3_client = boto3.client('s3', aws_access_key_id=access_key,
+                                      aws_secret_access_key=secret_key,
+                                      endpoint_url=endpoint_url,
+                                      region_name=region_name)
+            _s3_client_config = config
+        return _s3_client
+
+
+def reset_s3_client():
+    global _s3_client, _s3_client_config
+    with _s3_client_lock:
+        _s3_client = None
+        _s3_client_config = None
+
+
+@receiver(setting_changed)
+def _reset_s3_client_on_settings_change(sender, setting, **kwargs):
+    if setting.startswith('AWS_'):
+        reset_s3_client()
+
+
+def _presign_cache_key(s3_key, expires_in):
+    digest = hashlib.sha1(s3_key.encode('utf-8')).hexdigest()
+    return f'{PRESIGN_CACHE_PREFIX}:{expires_in}:{digest}'
+
+
+def _presign_cache_timeout(expires_in):
+    # stop handing out a URL this many seconds before S3 would reject it
+    margin = getattr(settings, 'RECEIPT_PRESIGN_REFRESH_MARGIN', 300)
+    return max(int(expires_in) - margin, 0)
+
+
+def cache_presigned_url(s3_key, url, expires_in=3600):
+    """Store a URL that was just presigned elsewhere so later lookups reuse it."""
+    timeout = _presign_cache_timeout(expires_in)
+    if s3_key and url and timeout:
+        cache.set(_presign_cache_key(s3_key, expires_in), url, timeout)
+
+
+def get_presigned_url(s3_key, expires_in=3600):
+    """Return a presigned GET URL for `s3_key`, reusing a cached one when still valid."""
+    return get_presigned_urls([s3_key], expires_in=expires_in).get(s3_key)
+
+
+def get_presigned_urls(s3_keys, expires_in=3600):
+    """Presign many keys at once.
+
+    Returns a dict mapping each key to its URL. Cached URLs are fetched in a single
+    cache round-trip and the misses are signed with one shared client. Keys that
+    cannot be signed are left out of the result.
+    """
+    keys = [k for k in dict.fromkeys(s3_keys) if k]
+    if not keys:
+        return {}
+
+    cache_keys = {_presign_cache_key(k, expires_in): k for k in keys}
+    cached = cache.get_many(list(cache_keys))
+    urls = {cache_keys[ck]: url for ck, url in cached.items()}
+
+    missing = [k for k in keys if k not in urls]
+    if not missing:
+        return urls
+
+    try:
+        s3 = get_s3_client()
+    except Exception:
+        return urls
+
+    signed = {}
+    for key in missing:
+        try:
+            signed[key] = s3.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': key},
+                ExpiresIn=expires_in,
+            )
+        except Exception:
+            continue
+
+    timeout = _presign_cache_timeout(expires_in)
+    if signed and timeout:
+        cache.set_many({_presign_cache_key(k, expires_in): url for k, url in signed.items()}, timeout)
+    urls.update(signed)
+    return urls
+
+
+def get_receipt_urls_for_payments(payment_ids, expires_in=3600):
+    """Map payment_id -> download URL of its latest receipt, for list pages.
+
+    Uses one query for the receipts and one bulk presign for their keys.
+    """
+    from .models import Receipt
+
+    latest = {}
+    for receipt in Receipt.objects.filter(payment_id__in=set(payment_ids)).only('payment_id', 's3_key', 's3_url'):
+        # Receipt ordering is newest first, so keep the first row seen per payment
+        latest.setdefault(receipt.payment_id, receipt)
+
+    presigned = get_presigned_urls([r.s3_key for r in latest.values()], expires_in=expires_in)
+    return {pid: presigned.get(r.s3_key) or r.s3_url for pid, r in latest.items()}
@@ -18,15 +18,10 @@ class ReceiptViewSet(viewsets.ReadOnlyModelViewSet):
         except Receipt.DoesNotExist:
             return response.Response({'error': 'not found'}, status=404)
         if receipt.s3_url:
-            import boto3
-            from django.conf import settings
-            s3 = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                              aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                              endpoint_url=settings.AWS_S3_ENDPOINT_URL,
-                              region_name=settings.AWS_S3_REGION_NAME)
-            # assume s3_url contains key stored as path after bucket
-            key = receipt.s3_url.split('/')[-1]
-            url = s3.generate_presigned_url('get_object', Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': key}, ExpiresIn=3600)
+            from .utils import get_presigned_url
+            # prefer the stored key; older rows only have s3_url with the key as its last path segment
+            key = receipt.s3_key or receipt.s3_url.split('/')[-1]
+            url = get_presigned_url(key, expires_in=3600)
             return response.Response({'url': url})
         return response.Response({'error': 'no file'}, status=400)
 
@@ -36,12 +31,9 @@ class ReceiptViewSet(viewsets.ReadOnlyModelViewSet):
         content_type = request.data.get('content_type', 'application/pdf')
         if not filename:
             return response.Response({'error': 'filename required'}, status=400)
-        import boto3
         from django.conf import settings
-        s3 = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                          endpoint_url=settings.AWS_S3_ENDPOINT_URL,
-                          region_name=settings.AWS_S3_REGION_NAME)
+        from .utils import get_s3_client
+        s3 = get_s3_client()
         key = f"receipts/{filename}"
         url = s3.generate_presigned_url('put_object', Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': key, 'ContentType': content_type}, ExpiresIn=3600)
         return response.Response({'url': url, 'key': key})
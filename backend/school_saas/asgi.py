@@ -1,17 +1,17 @@
 import os
 import django
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'school_saas.settings')
 django.setup()
 
 import notifications.routing  # noqa: E402
+from notifications.middleware import JWTAuthMiddlewareStack  # noqa: E402
 
 application = ProtocolTypeRouter({
     'http': get_asgi_application(),
-    'websocket': AuthMiddlewareStack(
+    'websocket': JWTAuthMiddlewareStack(
         URLRouter(
             notifications.routing.websocket_urlpatterns
         )
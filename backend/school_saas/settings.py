@@ -91,6 +91,46 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': crontab(hour=10, minute=0),  # Run daily at 10 AM
         'options': {'expires': 3600}
     },
+    'accrue-pending-loyalty-nightly': {
+        'task': 'crm.tasks.accrue_pending_loyalty',
+        'schedule': crontab(hour=2, minute=0),  # Run nightly at 2 AM for batch accrual tenants
+        'options': {'expires': 3600}
+    },
+    'refresh-customer-segments-nightly': {
+        'task': 'crm.tasks.refresh_customer_segments',
+        'schedule': crontab(hour=2, minute=30),  # Run nightly at 2:30 AM, after loyalty accrual
+        'options': {'expires': 3600}
+    },
+    'drain-payment-webhook-inbox': {
+        'task': 'payments.tasks.process_webhook_inbox',
+        'schedule': 10.0,  # Every 10 seconds; the task re-enqueues itself while backlog remains
+        'options': {'expires': 10}
+    },
+    'flush-email-queue': {
+        'task': 'notifications.tasks.flush_email_queue',
+        'schedule': 30.0,  # Every 30 seconds; picks up retries, sends are normally flushed right after queueing
+        'options': {'expires': 30}
+    },
+    'dispatch-pending-deliveries': {
+        'task': 'delivery.tasks.dispatch_pending_deliveries',
+        'schedule': 15.0,  # Every 15 seconds; fans out one tick per DELIVERY_AUTO_DISPATCH_TENANTS tenant
+        'options': {'expires': 15}
+    },
+    'estimate-delivery-etas': {
+        'task': 'delivery.tasks.estimate_delivery_etas',
+        'schedule': 60.0,  # Every minute; emails customers only when the ETA moved materially
+        'options': {'expires': 60}
+    },
+    'rebuild-delivery-speed-profiles-nightly': {
+        'task': 'delivery.tasks.rebuild_speed_profiles',
+        'schedule': crontab(hour=3, minute=15),  # Run nightly at 3:15 AM
+        'options': {'expires': 3600}
+    },
+    'compact-notifications-nightly': {
+        'task': 'notifications.tasks.compact_notifications',
+        'schedule': crontab(hour=3, minute=45),  # Run nightly at 3:45 AM; dedupes, then archives old read rows
+        'options': {'expires': 3600}
+    },
 }
 
 MIDDLEWARE = [
@@ -168,11 +208,35 @@ CHANNEL_LAYERS = {
         },
     },
 }
+# notifications.consumers.NotificationsConsumer heartbeat, per-socket send queue and presence
+WS_HEARTBEAT_SECONDS = 30
+WS_HEARTBEAT_TIMEOUT_SECONDS = 75
+WS_SEND_QUEUE_SIZE = 100
+PRESENCE_TTL_SECONDS = 90
 
 # Celery
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', os.getenv('REDIS_URL'))
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', os.getenv('REDIS_URL'))
 
+# Cache
+# Token revocation (accounts.tokens) and the delivery dispatch lock must be seen
+# by every process, so production needs REDIS_URL; without it each process has
+# its own local memory cache (see the accounts.W001 check).
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+            'KEY_PREFIX': 'smartsaas',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Static & Media
 STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
@@ -200,7 +264,14 @@ else:
     AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME')
 
 # Email (SendGrid sample)
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# send_mail() only queues; notifications.tasks.flush_email_queue delivers through
+# EMAIL_DELIVERY_BACKEND over a pooled connection (see notifications.mail)
+EMAIL_BACKEND = 'notifications.mail.QueuedEmailBackend'
+EMAIL_DELIVERY_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_QUEUE_BATCH_SIZE = 200
+EMAIL_QUEUE_FLUSH_DELAY_SECONDS = 5
+EMAIL_RATE_LIMIT_PER_SECOND = int(os.getenv('EMAIL_RATE_LIMIT_PER_SECOND', '50'))
+EMAIL_MAX_ATTEMPTS = 5
 EMAIL_HOST = 'smtp.sendgrid.net'
 EMAIL_PORT = 587
 EMAIL_HOST_USER = 'apikey'
@@ -210,6 +281,35 @@ DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'admin@example.com')
 # Web Push (VAPID)
 VAPID_PUBLIC_KEY = os.getenv('VAPID_PUBLIC_KEY')
 VAPID_PRIVATE_KEY = os.getenv('VAPID_PRIVATE_KEY')
+VAPID_SUBJECT = os.getenv('VAPID_SUBJECT', f'mailto:{DEFAULT_FROM_EMAIL}')
+# concurrent pushes per worker process (threads sharing one pooled HTTP session)
+WEB_PUSH_MAX_WORKERS = int(os.getenv('WEB_PUSH_MAX_WORKERS', '32'))
+WEB_PUSH_TTL_SECONDS = 24 * 60 * 60
+WEB_PUSH_TIMEOUT_SECONDS = 10
+
+# Notification retention (notifications.retention): read notifications older than this are
+# archived as gzipped JSON Lines under NOTIFICATION_ARCHIVE_PREFIX in NOTIFICATION_ARCHIVE_STORAGE
+NOTIFICATION_RETENTION_DAYS = int(os.getenv('NOTIFICATION_RETENTION_DAYS', '90'))
+NOTIFICATION_ARCHIVE_PREFIX = 'notifications/archive'
+# archives hold titles, bodies and data of other people's notifications: private objects, never
+# the media storage (public-read in production)
+if AWS_STORAGE_BUCKET_NAME:
+    NOTIFICATION_ARCHIVE_STORAGE = {
+        'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage',
+        'OPTIONS': {
+            'bucket_name': os.getenv('NOTIFICATION_ARCHIVE_BUCKET', AWS_STORAGE_BUCKET_NAME),
+            'default_acl': 'private',
+            'querystring_auth': True,
+            'custom_domain': None,
+        },
+    }
+else:
+    NOTIFICATION_ARCHIVE_STORAGE = {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {'location': BASE_DIR / 'private'},
+    }
+NOTIFICATION_RETENTION_BATCH_SIZE = 2000
+NOTIFICATION_RETENTION_MAX_BATCHES = 500
 
 # Stripe (use stripe-mock for test/dev; set STRIPE_API_KEY and STRIPE_WEBHOOK_SECRET in .env for production)
 USE_STRIPE_MOCK = os.getenv('USE_STRIPE_MOCK', 'False') == 'True'
@@ -227,7 +327,8 @@ else:
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # request.user from token claims, see accounts.principal
+        'accounts.principal.ClaimsJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -240,7 +341,13 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'AUTH_HEADER_TYPES': ('Bearer',),
+    # access tokens carry role / tenant claims for accounts.permissions.RolesAllowed
+    'TOKEN_OBTAIN_SERIALIZER': 'accounts.tokens.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'accounts.tokens.ClaimsTokenRefreshSerializer',
 }
+# per-process user / tenant cache behind token principals (accounts.principal)
+AUTH_PRINCIPAL_CACHE_SECONDS = 60
+AUTH_PRINCIPAL_CACHE_SIZE = 10000
 
 
 # Internationalization
@@ -29,8 +29,7 @@ class LowStockTaskTest(TestCase):
             role='manager'
         )
 
-    @patch('inventory.tasks.send_mail')
-    def test_low_stock_notification(self, mock_send_mail):
+    def test_low_stock_notification(self):
         """Test low stock products trigger notifications."""
         from inventory.tasks import check_low_stock_and_notify
         
@@ -1,12 +1,13 @@
 """
 Comprehensive tests for CRM features including loyalty accrual and purchase history.
 """
-from django.test import TestCase
+import io
+from django.test import TestCase, TransactionTestCase
 from rest_framework.test import APIClient
 from decimal import Decimal
 from tenants.models import Tenant
 from accounts.models import User
-from crm.models import Customer, LoyaltyPoint, LoyaltyTransaction, PurchaseHistory
+from crm.models import Customer, CustomerMetrics, LoyaltyPoint, LoyaltyTransaction, PurchaseHistory
 from pos.models import Order
 from inventory.models import Product
 
@@ -366,3 +367,575 @@ class TenantIsolationTest(TestCase):
         
         self.assertEqual(len(data['results']), 1)
         self.assertEqual(data['results'][0]['amount'], '100.00')
+
+
+class LoyaltyConcurrencyTest(TestCase):
+    """Loyalty balances stay correct when updates race."""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(slug='test', name='Test Tenant')
+        self.customer = Customer.objects.create(tenant=self.tenant, first_name='Race')
+        self.loyalty = self.customer.get_or_create_loyalty()
+        self.loyalty.add_points(500, reason='Initial')
+
+    def test_stale_instances_cannot_overdraw(self):
+        """100 redemptions issued from instances loaded before any of them ran."""
+        stale = [LoyaltyPoint.objects.get(pk=self.loyalty.pk) for _ in range(100)]
+        results = [lp.redeem_points(10, reason='Race') for lp in stale]
+
+        self.assertEqual(sum(1 for r in results if r is not None), 50)
+        self.loyalty.refresh_from_db()
+        self.assertEqual(self.loyalty.points, 0)
+        self.assertEqual(LoyaltyTransaction.objects.filter(customer=self.customer, transaction_type='redeem').count(), 50)
+
+    def test_stale_instances_do_not_lose_earned_points(self):
+        a = LoyaltyPoint.objects.get(pk=self.loyalty.pk)
+        b = LoyaltyPoint.objects.get(pk=self.loyalty.pk)
+        a.add_points(10)
+        b.add_points(20)
+        self.loyalty.refresh_from_db()
+        self.assertEqual(self.loyalty.points, 530)
+
+
+class LoyaltyParallelRedemptionTest(TransactionTestCase):
+    """100 redemptions from parallel threads, each on its own connection.
+
+    SQLite serialises writers at the database level and raises "database is
+    locked" instead of waiting, so this only runs against PostgreSQL.
+    """
+
+    def setUp(self):
+        from django.db import connection
+        if connection.vendor != 'postgresql':
+            self.skipTest('parallel redemption test needs PostgreSQL')
+        self.tenant = Tenant.objects.create(slug='test', name='Test Tenant')
+        self.customer = Customer.objects.create(tenant=self.tenant, first_name='Parallel')
+        self.loyalty = self.customer.get_or_create_loyalty()
+        self.loyalty.add_points(500, reason='Initial')
+
+    def test_parallel_redemptions(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from django.db import connection
+        from crm.loyalty import redeem
+
+        def run(_):
+            try:
+                return redeem(self.customer.id, 10, reason='Parallel')
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            results = list(pool.map(run, range(100)))
+
+        self.assertEqual(sum(1 for r in results if r is not None), 50)
+        self.loyalty.refresh_from_db()
+        self.assertEqual(self.loyalty.points, 0)
+
+
+class LoyaltyBatchAccrualTest(TestCase):
+    """Bulk ledger writes and the nightly batch accrual mode."""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(slug='bulk', name='Bulk Tenant')
+        self.customers = [
+            Customer.objects.create(tenant=self.tenant, first_name=f'C{i}') for i in range(5)
+        ]
+
+    def test_accrue_bulk_uses_constant_queries(self):
+        from crm.loyalty import accrue_bulk
+        entries = [(c.id, 10, 'Bulk', None) for c in self.customers for _ in range(3)]
+        # existing rows lookup, loyalty row insert, one UPDATE, one ledger insert (+ savepoint)
+        with self.assertNumQueries(6):
+            written = accrue_bulk(entries)
+        self.assertEqual(written, 15)
+        self.assertEqual(
+            sorted(LoyaltyPoint.objects.filter(customer__in=self.customers).values_list('points', flat=True)),
+            [30] * 5,
+        )
+        self.assertEqual(LoyaltyTransaction.objects.filter(customer__in=self.customers).count(), 15)
+
+    def test_batch_tenant_defers_accrual_until_nightly_run(self):
+        from django.test import override_settings
+        from crm.tasks import accrue_pending_loyalty
+
+        with override_settings(LOYALTY_BATCH_ACCRUAL_TENANTS=['bulk']):
+            for customer in self.customers:
+                order = Order.objects.create(tenant=self.tenant, customer=customer,
+                                             total=Decimal('40.00'), status='paid')
+                purchase = PurchaseHistory.create_from_order(order)
+                self.assertIsNone(purchase.loyalty_accrued_at)
+
+        self.assertFalse(LoyaltyTransaction.objects.filter(customer__in=self.customers).exists())
+
+        result = accrue_pending_loyalty.run(batch_size=2)
+        self.assertEqual(result['accrued'], 5)
+        self.assertEqual(
+            sorted(LoyaltyPoint.objects.filter(customer__in=self.customers).values_list('points', flat=True)),
+            [40] * 5,
+        )
+        self.assertFalse(PurchaseHistory.objects.filter(loyalty_accrued_at__isnull=True).exists())
+
+        # a second run finds nothing left to credit
+        self.assertEqual(accrue_pending_loyalty.run()['accrued'], 0)
+        self.assertEqual(LoyaltyTransaction.objects.filter(customer__in=self.customers).count(), 5)
+
+    def test_immediate_accrual_marks_purchase_accrued(self):
+        order = Order.objects.create(tenant=self.tenant, customer=self.customers[0],
+                                     total=Decimal('12.00'), status='paid')
+        purchase = PurchaseHistory.create_from_order(order)
+        self.assertIsNotNone(purchase.loyalty_accrued_at)
+        self.assertEqual(self.customers[0].loyalty.points, 12)
+
+
+class CustomerMetricsTest(TestCase):
+    """Precomputed lifetime metrics and the CustomerViewSet sort/filter on them."""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(slug='metrics', name='Metrics Tenant')
+        self.owner = User.objects.create_user(
+            username='metrics_owner', email='mo@test.com', password='pass123',
+            tenant=self.tenant, role='owner'
+        )
+        self.big = Customer.objects.create(tenant=self.tenant, first_name='Big')
+        self.small = Customer.objects.create(tenant=self.tenant, first_name='Small')
+        self.idle = Customer.objects.create(tenant=self.tenant, first_name='Idle')
+
+    def _pay(self, customer, total):
+        order = Order.objects.create(tenant=self.tenant, customer=customer, total=Decimal(total), status='paid')
+        return PurchaseHistory.create_from_order(order)
+
+    def _list(self, **params):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from crm.api import CustomerViewSet
+        request = APIRequestFactory().get('/api/crm/customers/', params)
+        force_authenticate(request, user=self.owner)
+        return CustomerViewSet.as_view({'get': 'list'})(request)
+
+    def test_paid_orders_update_metrics_incrementally(self):
+        self._pay(self.big, '100.00')
+        self._pay(self.big, '300.00')
+
+        metrics = CustomerMetrics.objects.get(customer=self.big)
+        self.assertEqual(metrics.lifetime_value, Decimal('400.00'))
+        self.assertEqual(metrics.order_count, 2)
+        self.assertEqual(metrics.average_basket, Decimal('200.00'))
+        self.assertEqual(metrics.tenant, self.tenant)
+        self.assertLessEqual(metrics.first_purchase_at, metrics.last_purchase_at)
+        self.assertEqual(metrics.rfm_score, '522')
+        self.assertEqual(metrics.rfm_segment, 'promising')
+
+    def test_recompute_matches_incremental_and_covers_idle_customers(self):
+        from django.core.management import call_command
+        self._pay(self.big, '100.00')
+        self._pay(self.big, '300.00')
+        self._pay(self.small, '10.00')
+        incremental = {
+            m.customer_id: (m.lifetime_value, m.order_count, m.average_basket, m.rfm_segment)
+            for m in CustomerMetrics.objects.all()
+        }
+        CustomerMetrics.objects.all().delete()
+
+        call_command('recompute_customer_metrics', '--tenant', 'metrics', '--batch-size', '2', stdout=io.StringIO())
+
+        rebuilt = {
+            m.customer_id: (m.lifetime_value, m.order_count, m.average_basket, m.rfm_segment)
+            for m in CustomerMetrics.objects.all()
+        }
+        self.assertEqual(rebuilt[self.big.id], incremental[self.big.id])
+        self.assertEqual(rebuilt[self.small.id], incremental[self.small.id])
+        self.assertEqual(rebuilt[self.idle.id], (Decimal('0'), 0, Decimal('0'), ''))
+
+    def test_recompute_query_count_is_per_batch(self):
+        from crm.metrics import recompute_customer_metrics
+        for i in range(20):
+            self._pay(Customer.objects.create(tenant=self.tenant, first_name=f'C{i}'), '5.00')
+        # per batch: customer ids, purchase aggregates, upsert; plus the final empty fetch
+        with self.assertNumQueries(4):
+            written = recompute_customer_metrics(tenant=self.tenant, batch_size=100)
+        self.assertEqual(written, 23)
+
+    def test_segments_age_with_recency(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from crm.metrics import refresh_segments
+        self._pay(self.big, '100.00')
+        self.assertEqual(CustomerMetrics.objects.get(customer=self.big).rfm_segment, 'new')
+
+        self.assertEqual(refresh_segments(now=timezone.now() + timedelta(days=365)), 1)
+        self.assertEqual(CustomerMetrics.objects.get(customer=self.big).rfm_segment, 'hibernating')
+
+    def test_list_sorts_by_lifetime_value(self):
+        self._pay(self.big, '500.00')
+        self._pay(self.small, '20.00')
+
+        resp = self._list(ordering='-lifetime_value')
+        self.assertEqual(resp.status_code, 200)
+        names = [row['first_name'] for row in resp.data['results']]
+        self.assertEqual(names, ['Big', 'Small', 'Idle'])
+        self.assertEqual(resp.data['results'][0]['metrics']['order_count'], 1)
+        # created with a zeroed row, so idle customers sort like everyone else
+        self.assertEqual(resp.data['results'][2]['metrics']['order_count'], 0)
+
+        resp = self._list(ordering='lifetime_value')
+        self.assertEqual([row['first_name'] for row in resp.data['results']], ['Idle', 'Small', 'Big'])
+
+        resp = self._list(ordering='last_purchase_at')
+        self.assertEqual([row['first_name'] for row in resp.data['results']][-1], 'Idle')
+
+    def test_customers_without_metrics_stay_in_sorted_lists(self):
+        other = Tenant.objects.create(slug='metrics-other', name='Other Metrics Tenant')
+        # bulk_create skips Customer.save, so these have no metrics row
+        Customer.objects.bulk_create([Customer(tenant=self.tenant, first_name='Imported'),
+                                      Customer(tenant=other, first_name='Elsewhere')])
+        self._pay(self.big, '500.00')
+
+        for ordering in ('-lifetime_value', 'lifetime_value', 'average_basket'):
+            resp = self._list(ordering=ordering)
+            names = [row['first_name'] for row in resp.data['results']]
+            self.assertEqual(len(names), 4, ordering)
+            self.assertEqual(names[-1], 'Imported', ordering)
+        self.assertIsNone(resp.data['results'][-1]['metrics'])
+
+    def test_list_filters_on_metrics(self):
+        self._pay(self.big, '500.00')
+        self._pay(self.small, '20.00')
+
+        resp = self._list(min_ltv='100')
+        self.assertEqual([row['first_name'] for row in resp.data['results']], ['Big'])
+
+        resp = self._list(segment='new', min_orders='1')
+        self.assertEqual({row['first_name'] for row in resp.data['results']}, {'Big', 'Small'})
+
+        resp = self._list(min_ltv='lots')
+        self.assertEqual(resp.status_code, 400)
+
+
+class CRMListQueryCountTest(TestCase):
+    """Every CRM list endpoint runs a fixed number of queries regardless of page size."""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(slug='qc', name='Query Count Tenant')
+        self.owner = User.objects.create_user(
+            username='qc_owner', email='qc@test.com', password='pass123',
+            tenant=self.tenant, role='owner'
+        )
+        self.customer = self._add_rows(3)
+
+    def _add_rows(self, count):
+        from crm.models import Supplier
+        customer = None
+        for i in range(count):
+            customer = Customer.objects.create(tenant=self.tenant, first_name=f'Q{i}', email=f'q{i}@test.com')
+            order = Order.objects.create(tenant=self.tenant, customer=customer, total=Decimal('10.00'), status='paid')
+            PurchaseHistory.create_from_order(order)
+            Supplier.objects.create(tenant=self.tenant, name=f'Supplier {i}')
+        # spread purchases and ledger rows over one customer as well, for the detail actions
+        first = Customer.objects.filter(tenant=self.tenant).order_by('pk').first()
+        for i in range(count):
+            order = Order.objects.create(tenant=self.tenant, customer=first, total=Decimal('5.00'), status='paid')
+            PurchaseHistory.create_from_order(order)
+        return first
+
+    def _queries(self, viewset, action='list', **kwargs):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=self.owner)
+        view = viewset.as_view({'get': action})
+        with CaptureQueriesContext(connection) as ctx:
+            resp = view(request, **kwargs)
+            resp.render()
+        self.assertEqual(resp.status_code, 200)
+        return len(ctx)
+
+    def _assert_constant(self, viewset, action='list', max_queries=3):
+        kwargs = {'pk': self.customer.pk} if action != 'list' else {}
+        small = self._queries(viewset, action, **kwargs)
+        self._add_rows(10)
+        large = self._queries(viewset, action, **kwargs)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, max_queries)
+
+    def test_customer_list(self):
+        from crm.api import CustomerViewSet
+        # count + page
+        self._assert_constant(CustomerViewSet, max_queries=2)
+
+    def test_customer_purchase_history_action(self):
+        from crm.api import CustomerViewSet
+        # customer lookup + purchases
+        self._assert_constant(CustomerViewSet, 'purchase_history', max_queries=2)
+
+    def test_customer_loyalty_transactions_action(self):
+        from crm.api import CustomerViewSet
+        self._assert_constant(CustomerViewSet, 'loyalty_transactions', max_queries=2)
+
+    def test_loyalty_list(self):
+        from crm.api import LoyaltyPointViewSet
+        self._assert_constant(LoyaltyPointViewSet, max_queries=2)
+
+    def test_loyalty_transaction_list(self):
+        from crm.api import LoyaltyTransactionViewSet
+        self._assert_constant(LoyaltyTransactionViewSet, max_queries=2)
+
+    def test_purchase_history_list(self):
+        from crm.api import PurchaseHistoryViewSet
+        self._assert_constant(PurchaseHistoryViewSet, max_queries=2)
+
+    def test_supplier_list(self):
+        from crm.api import SupplierViewSet
+        self._assert_constant(SupplierViewSet, max_queries=2)
+
+    def test_customer_list_reports_annotated_loyalty_points(self):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from crm.api import CustomerViewSet
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=self.owner)
+        resp = CustomerViewSet.as_view({'get': 'list'})(request)
+        points = {row['first_name']: row['loyalty_points'] for row in resp.data['results']}
+        self.assertEqual(points, {'Q0': 25, 'Q1': 10, 'Q2': 10})
+
+
+class CustomerExportTest(TestCase):
+    """Streaming CSV/JSONL export and the background export job."""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(slug='export', name='Export Tenant')
+        self.other = Tenant.objects.create(slug='other', name='Other Tenant')
+        self.owner = User.objects.create_user(
+            username='export_owner', email='eo@test.com', password='pass123',
+            tenant=self.tenant, role='owner'
+        )
+        Customer.objects.bulk_create([
+            Customer(tenant=self.tenant, first_name=f'E{i}', email=f'e{i}@test.com') for i in range(25)
+        ])
+        Customer.objects.create(tenant=self.other, first_name='Hidden')
+        self.buyer = Customer.objects.filter(tenant=self.tenant).order_by('pk').first()
+        order = Order.objects.create(tenant=self.tenant, customer=self.buyer, total=Decimal('80.00'), status='paid')
+        PurchaseHistory.create_from_order(order)
+
+    def _export(self, **params):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from crm.api import CustomerViewSet
+        request = APIRequestFactory().get('/api/crm/customers/export/', params)
+        force_authenticate(request, user=self.owner)
+        return CustomerViewSet.as_view({'get': 'export'})(request)
+
+    def test_csv_export_streams_tenant_customers(self):
+        import csv
+        resp = self._export()
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        self.assertEqual(resp['Content-Type'], 'text/csv')
+        self.assertIn('attachment; filename="customers-export-', resp['Content-Disposition'])
+
+        rows = list(csv.DictReader(b''.join(resp.streaming_content).decode('utf-8').splitlines()))
+        self.assertEqual(len(rows), 25)
+        buyer = next(r for r in rows if r['id'] == str(self.buyer.id))
+        self.assertEqual(buyer['loyalty_points'], '80')
+        self.assertEqual(buyer['lifetime_value'], '80.00')
+        self.assertEqual(buyer['order_count'], '1')
+        self.assertNotIn('Hidden', {r['first_name'] for r in rows})
+
+    def test_jsonl_export_filtered_by_segment(self):
+        import json
+        resp = self._export(export_format='jsonl', segment='new')
+        self.assertEqual(resp['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(resp.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['email'], self.buyer.email)
+
+    def test_export_is_lazy_and_uses_one_query(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self._export()
+        self.assertEqual(len(ctx), 0)
+        with CaptureQueriesContext(connection) as ctx:
+            consumed = sum(1 for _ in resp.streaming_content)
+        self.assertEqual(consumed, 26)
+        self.assertEqual(len(ctx), 1)
+
+    def test_unknown_format_rejected(self):
+        self.assertEqual(self._export(export_format='xlsx').status_code, 400)
+
+    def test_export_job_writes_file_and_notifies(self):
+        import tempfile
+        from unittest import mock
+        from django.test import override_settings
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from notifications.models import Notification
+        from crm.api import CustomerViewSet
+        from crm.tasks import export_customers
+
+        request = APIRequestFactory().post('/api/crm/customers/export_job/', {'export_format': 'jsonl'}, format='json')
+        force_authenticate(request, user=self.owner)
+        with tempfile.TemporaryDirectory() as media, \
+                override_settings(MEDIA_ROOT=media, AWS_STORAGE_BUCKET_NAME=None), \
+                mock.patch.object(export_customers, 'delay', side_effect=ConnectionError('no broker')):
+            resp = CustomerViewSet.as_view({'post': 'export_job'})(request)
+            self.assertEqual(resp.status_code, 201)
+            self.assertEqual(resp.data['rows'], 25)
+            path = resp.data['url'][len('file://'):]
+            with open(path, encoding='utf-8') as fh:
+                self.assertEqual(sum(1 for _ in fh), 25)
+
+        note = Notification.objects.get(recipient=self.owner)
+        self.assertEqual(note.data['key'], resp.data['key'])
+
+
+class CustomerDedupTest(TestCase):
+    """Blocking keys, incremental and full-scan duplicate detection, and bulk merge."""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(slug='dedup', name='Dedup Tenant')
+        self.owner = User.objects.create_user(
+            username='dedup_owner', email='do@test.com', password='pass123',
+            tenant=self.tenant, role='owner'
+        )
+        self.original = Customer.objects.create(
+            tenant=self.tenant, first_name='Sara', last_name='Ali',
+            email='Sara.Ali+shop@gmail.com', phone='+966 50 123 4567'
+        )
+
+    def test_normalisation(self):
+        from crm.dedup import normalise_email, normalise_name, normalise_phone
+        self.assertEqual(normalise_email(' Sara.Ali+promo@GoogleMail.com '), 'saraali@gmail.com')
+        self.assertEqual(normalise_email('not-an-email'), '')
+        self.assertEqual(normalise_phone('+966 50 123 4567'), normalise_phone('0501234567'))
+        self.assertEqual(normalise_phone('00966501234567'), '501234567')
+        self.assertEqual(normalise_phone('123'), '')
+        self.assertEqual(normalise_name('Ali,', 'Sára'), normalise_name('sara', 'ali'))
+
+    def test_keys_follow_partial_saves(self):
+        self.assertEqual(self.original.phone_key, '501234567')
+        self.original.phone = '0559876543'
+        self.original.save(update_fields=['phone'])
+        self.original.refresh_from_db()
+        self.assertEqual(self.original.phone_key, '559876543')
+
+    def test_new_customer_via_api_records_candidate(self):
+        from unittest import mock
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from crm.api import CustomerViewSet
+        from crm.models import DuplicateCandidate
+        from crm.tasks import check_customer_duplicates
+
+        request = APIRequestFactory().post('/api/crm/customers/', {
+            'first_name': 'sara', 'last_name': 'ali', 'phone': '0501234567'
+        }, format='json')
+        force_authenticate(request, user=self.owner)
+        with mock.patch.object(check_customer_duplicates, 'delay', side_effect=ConnectionError('no broker')):
+            resp = CustomerViewSet.as_view({'post': 'create'})(request)
+        self.assertEqual(resp.status_code, 201)
+
+        candidate = DuplicateCandidate.objects.get()
+        self.assertEqual(candidate.customer_id, resp.data['id'])
+        self.assertEqual(candidate.duplicate_of_id, self.original.id)
+        self.assertEqual(sorted(candidate.reasons), ['name', 'phone'])
+        self.assertAlmostEqual(candidate.score, 0.9)
+
+    def test_incremental_check_cost_does_not_grow_with_tenant(self):
+        from crm.dedup import check_new_customer
+
+        def cost():
+            newcomer = Customer.objects.create(tenant=self.tenant, first_name='Sara', last_name='Ali', phone='0501234567')
+            from django.db import connection
+            from django.test.utils import CaptureQueriesContext
+            with CaptureQueriesContext(connection) as ctx:
+                check_new_customer(newcomer.id)
+            newcomer.delete()
+            return len(ctx)
+
+        small = cost()
+        Customer.objects.bulk_create([
+            Customer(tenant=self.tenant, first_name=f'N{i}', phone=f'05{i:08d}', phone_key=f'5{i:08d}')
+            for i in range(300)
+        ])
+        self.assertEqual(cost(), small)
+
+    def test_scan_pairs_within_blocks_and_skips_oversized_ones(self):
+        from django.test import override_settings
+        from crm.dedup import scan_tenant
+        from crm.models import DuplicateCandidate
+        Customer.objects.create(tenant=self.tenant, first_name='S.', last_name='Ali', email='saraali@gmail.com')
+        Customer.objects.create(tenant=self.tenant, first_name='Omar', phone='0501234567')
+        # a shop placeholder number shared by many walk-in customers
+        for i in range(4):
+            Customer.objects.create(tenant=self.tenant, first_name=f'Walk{i}', phone='0000000000')
+
+        with override_settings(CRM_DEDUP_MAX_BLOCK=3):
+            found = scan_tenant(self.tenant, batch_size=2)
+
+        pairs = set(DuplicateCandidate.objects.values_list('duplicate_of_id', flat=True))
+        self.assertEqual(found, 2)
+        self.assertEqual(pairs, {self.original.id})
+        self.assertFalse(DuplicateCandidate.objects.filter(customer__first_name__startswith='Walk').exists())
+
+    def test_merge_moves_history_in_bulk(self):
+        from crm.dedup import merge_customers
+        self.original.get_or_create_loyalty().add_points(30)
+        dup = Customer.objects.create(tenant=self.tenant, first_name='Sara', last_name='Ali',
+                                      phone='0501234567', address='Riyadh')
+        Customer.objects.filter(pk=self.original.pk).update(address='')
+        for total in ('20.00', '50.00'):
+            order = Order.objects.create(tenant=self.tenant, customer=dup, total=Decimal(total), status='paid')
+            PurchaseHistory.create_from_order(order)
+        dup.get_or_create_loyalty().redeem_points(5)
+
+        merged = merge_customers(self.original, [dup])
+
+        self.assertEqual(merged, 1)
+        self.assertFalse(Customer.objects.filter(pk=dup.pk).exists())
+        self.original.refresh_from_db()
+        self.assertEqual(self.original.address, 'Riyadh')
+        self.assertEqual(self.original.loyalty.points, 30 + 70 - 5)
+        self.assertEqual(self.original.loyalty_transactions.count(), 4)
+        self.assertEqual(self.original.purchases.count(), 2)
+        self.assertEqual(Order.objects.filter(customer=self.original).count(), 2)
+        metrics = CustomerMetrics.objects.get(customer=self.original)
+        self.assertEqual((metrics.order_count, metrics.lifetime_value), (2, Decimal('70.00')))
+
+    def test_merge_keeps_candidate_history(self):
+        from crm.dedup import merge_customers, record_candidates
+        from crm.models import DuplicateCandidate
+        dup = Customer.objects.create(tenant=self.tenant, first_name='Sara', last_name='Ali', phone='0501234567')
+        record_candidates(dup)
+        self.assertEqual(DuplicateCandidate.objects.filter(status='pending').count(), 1)
+
+        merge_customers(self.original, [dup])
+
+        candidate = DuplicateCandidate.objects.get()
+        self.assertEqual(candidate.status, 'merged')
+        self.assertIsNotNone(candidate.merged_at)
+        self.assertEqual({candidate.customer_id, candidate.duplicate_of_id}, {self.original.pk, None})
+
+    def test_merge_rejects_other_tenant(self):
+        from crm.dedup import merge_customers
+        other = Tenant.objects.create(slug='elsewhere', name='Elsewhere')
+        stranger = Customer.objects.create(tenant=other, first_name='Sara', last_name='Ali')
+        with self.assertRaises(ValueError):
+            merge_customers(self.original, [stranger])
+        self.assertTrue(Customer.objects.filter(pk=stranger.pk).exists())
+
+    def test_merge_action(self):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from crm.api import CustomerViewSet
+        dup = Customer.objects.create(tenant=self.tenant, first_name='Sara', last_name='Ali', phone='0501234567')
+        request = APIRequestFactory().post('/', {'duplicate_ids': [dup.id]}, format='json')
+        force_authenticate(request, user=self.owner)
+        resp = CustomerViewSet.as_view({'post': 'merge'})(request, pk=self.original.pk)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['merged'], 1)
+        self.assertFalse(Customer.objects.filter(pk=dup.pk).exists())
+
+    def test_auto_merge_when_configured(self):
+        from django.test import override_settings
+        from crm.dedup import check_new_customer
+        dup = Customer.objects.create(tenant=self.tenant, first_name='Sara', last_name='Ali',
+                                      email='saraali@gmail.com', phone='0501234567')
+        with override_settings(CRM_DEDUP_AUTO_MERGE_SCORE=0.95):
+            survivor_id = check_new_customer(dup.id)
+        self.assertEqual(survivor_id, self.original.id)
+        self.assertFalse(Customer.objects.filter(pk=dup.pk).exists())
@@ -180,6 +180,7 @@ class DeliveryAPITest(TestCase):
 
     def test_mark_delivered_via_api(self):
         """Test marking delivery as delivered via API."""
+        self.delivery.mark_in_transit()
         self.client.force_authenticate(self.manager)
         resp = self.client.post(f'/api/delivery/deliveries/{self.delivery.id}/mark_delivered/')
         self.assertEqual(resp.status_code, 200)
@@ -338,3 +339,652 @@ class ShippingFeeRuleAPITest(TestCase):
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertEqual(len(data['results']), 1)
+
+
+class DeliveryStateMachineTest(TestCase):
+    """Legal transitions, event log, on-commit notifications and bulk transitions."""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(slug='sm', name='State Machine Tenant')
+        self.manager = User.objects.create_user('sm_manager', 'smm@test.com', 'pass')
+        self.manager.tenant = self.tenant
+        self.manager.role = 'manager'
+        self.manager.save()
+        self.delivery = Delivery.objects.create(tenant=self.tenant, order_reference='ORD-SM-1', tracking_number='TRK-SM-1')
+
+    def test_illegal_transition_raises_and_leaves_row_untouched(self):
+        from delivery.state import InvalidTransition
+        with self.assertRaises(InvalidTransition):
+            self.delivery.mark_delivered()
+        self.delivery.refresh_from_db()
+        self.assertEqual(self.delivery.status, 'pending')
+        self.assertFalse(self.delivery.events.exists())
+
+        self.delivery.mark_in_transit()
+        self.delivery.mark_delivered()
+        with self.assertRaises(InvalidTransition):
+            self.delivery.mark_failed()
+
+    def test_transition_checks_current_row_not_stale_instance(self):
+        from delivery.state import InvalidTransition
+        stale = Delivery.objects.get(pk=self.delivery.pk)
+        self.delivery.mark_in_transit()
+        self.delivery.mark_delivered()
+        with self.assertRaises(InvalidTransition):
+            stale.mark_picked_up()
+
+    def test_events_record_each_transition_with_timestamps(self):
+        personnel = DeliveryPersonnel.objects.create(tenant=self.tenant, name='Sam')
+        self.delivery.assign(personnel, actor=self.manager)
+        self.delivery.mark_picked_up()
+        self.delivery.mark_in_transit()
+        self.delivery.mark_delivered()
+
+        events = list(self.delivery.events.all())
+        self.assertEqual(
+            [(e.from_status, e.to_status) for e in events],
+            [('pending', 'assigned'), ('assigned', 'picked_up'), ('picked_up', 'in_transit'), ('in_transit', 'delivered')],
+        )
+        self.assertEqual(events[0].actor, self.manager)
+        self.assertEqual(events[0].tenant, self.tenant)
+        self.assertEqual([e.created_at for e in events], sorted(e.created_at for e in events))
+        self.delivery.refresh_from_db()
+        self.assertEqual(self.delivery.delivery_person, personnel)
+
+    def test_notification_enqueued_only_on_commit(self):
+        from unittest import mock
+        with mock.patch('delivery.tasks.notify_delivery_status_change.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                self.delivery.mark_picked_up()
+            delay.assert_not_called()
+            for callback in callbacks:
+                callback()
+        delay.assert_called_once_with(self.delivery.pk, 'pending', 'picked_up')
+
+    def test_bulk_transition_uses_single_update_and_bulk_insert(self):
+        from unittest import mock
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from delivery.models import DeliveryEvent
+        from delivery.state import bulk_transition
+        Delivery.objects.bulk_create([
+            Delivery(tenant=self.tenant, order_reference=f'ORD-W-{i}', tracking_number=f'TRK-W-{i}')
+            for i in range(200)
+        ])
+        done = Delivery.objects.create(tenant=self.tenant, order_reference='ORD-W-X', status='delivered')
+        qs = Delivery.objects.filter(tenant=self.tenant, order_reference__startswith='ORD-W-')
+
+        with mock.patch('delivery.tasks.notify_delivery_status_change.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                with CaptureQueriesContext(connection) as ctx:
+                    result = bulk_transition(qs, 'picked_up', actor=self.manager)
+
+        statements = [q['sql'].split()[0] for q in ctx.captured_queries]
+        # one locking select and one UPDATE; SQLite splits the bulk insert by its variable limit
+        self.assertEqual(statements.count('SELECT'), 1)
+        self.assertEqual(statements.count('UPDATE'), 1)
+        self.assertLessEqual(statements.count('INSERT'), 2)
+
+        self.assertEqual(len(result['updated']), 200)
+        self.assertEqual(result['skipped'], [done.pk])
+        self.assertEqual(qs.filter(status='picked_up').count(), 200)
+        self.assertEqual(DeliveryEvent.objects.filter(to_status='picked_up', from_status='pending').count(), 200)
+        self.assertEqual(delay.call_count, 200)
+
+    def test_bulk_transition_api_by_tracking_number(self):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from delivery.api import DeliveryViewSet
+        other_tenant = Tenant.objects.create(slug='sm-other', name='Other')
+        foreign = Delivery.objects.create(tenant=other_tenant, order_reference='ORD-F', tracking_number='TRK-F')
+        Delivery.objects.create(tenant=self.tenant, order_reference='ORD-SM-2', tracking_number='TRK-SM-2',
+                                status='delivered')
+
+        request = APIRequestFactory().post('/api/delivery/deliveries/bulk_transition/', {
+            'status': 'picked_up', 'tracking_numbers': ['TRK-SM-1', 'TRK-SM-2', 'TRK-F'],
+        }, format='json')
+        force_authenticate(request, user=self.manager)
+        resp = DeliveryViewSet.as_view({'post': 'bulk_transition'})(request)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['updated_ids'], [self.delivery.pk])
+        self.assertEqual(len(resp.data['skipped_ids']), 1)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.status, 'pending')
+
+    def test_illegal_transition_via_api_returns_400(self):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from delivery.api import DeliveryViewSet
+        request = APIRequestFactory().post(f'/api/delivery/deliveries/{self.delivery.pk}/mark_delivered/')
+        force_authenticate(request, user=self.manager)
+        resp = DeliveryViewSet.as_view({'post': 'mark_delivered'})(request, pk=self.delivery.pk)
+        self.assertEqual(resp.status_code, 400)
+        self.delivery.refresh_from_db()
+        self.assertEqual(self.delivery.status, 'pending')
+
+
+class ShippingFeeQuoteTest(TestCase):
+    """Fee quotes from the cached per-tenant band table."""
+
+    def setUp(self):
+        from decimal import Decimal
+        self.tenant = Tenant.objects.create(slug='fees', name='Fee Tenant',
+                                            business_latitude=Decimal('24.713600'),
+                                            business_longitude=Decimal('46.675300'))
+        ShippingFeeRule.objects.create(tenant=self.tenant, zone='Downtown', base_fee=10, per_km_fee=2,
+                                       min_distance=0, max_distance=10)
+        ShippingFeeRule.objects.create(tenant=self.tenant, zone='Downtown', base_fee=20, per_km_fee=1,
+                                       min_distance=10, max_distance=50)
+        ShippingFeeRule.objects.create(tenant=self.tenant, zone='default', base_fee=40, per_km_fee=0,
+                                       min_distance=0, max_distance=1000)
+
+    def _address(self, zone, lat, lng):
+        from decimal import Decimal
+        return Address(tenant=self.tenant, zone=zone, latitude=Decimal(lat), longitude=Decimal(lng))
+
+    def test_haversine_distance(self):
+        from delivery.fees import haversine_km
+        # Riyadh to Jeddah is roughly 845 km as the crow flies
+        self.assertAlmostEqual(haversine_km(24.7136, 46.6753, 21.5433, 39.1728), 845, delta=5)
+        self.assertEqual(haversine_km(24.7136, 46.6753, 24.7136, 46.6753), 0)
+
+    def test_bands_zones_and_fallback(self):
+        from decimal import Decimal
+        from delivery.fees import quote_fees
+        near = self._address('downtown', '24.713600', '46.720000')   # ~4.5 km east
+        far = self._address('Downtown', '24.713600', '46.900000')    # ~22.7 km east
+        elsewhere = self._address('Suburbs', '24.713600', '46.720000')
+        no_coords = Address(tenant=self.tenant, zone='Downtown')
+
+        quotes = quote_fees(self.tenant, [near, far, elsewhere, no_coords])
+
+        self.assertEqual(quotes[0]['fee'], Decimal('10') + 2 * quotes[0]['distance_km'])
+        self.assertEqual(quotes[1]['fee'], Decimal('20') + quotes[1]['distance_km'])
+        self.assertGreater(quotes[1]['distance_km'], 10)
+        self.assertEqual(quotes[2]['zone'], 'default')
+        self.assertEqual(quotes[2]['fee'], Decimal('40.00'))
+        self.assertIsNone(quotes[3]['fee'])
+        self.assertEqual(quotes[3]['error'], 'missing_coordinates')
+
+    def test_table_is_cached_and_invalidated_on_rule_change(self):
+        from delivery.fees import quote_fee
+        address = self._address('Downtown', '24.713600', '46.720000')
+        before = quote_fee(self.tenant, address)
+
+        from delivery.fees import quote_fees
+        with self.assertNumQueries(0):
+            addresses = [address] * 1000
+            self.assertEqual({q['fee'] for q in quote_fees(self.tenant, addresses)}, {before})
+
+        rule = ShippingFeeRule.objects.get(tenant=self.tenant, zone='Downtown', min_distance=0)
+        rule.base_fee = 15
+        with self.captureOnCommitCallbacks(execute=True):
+            rule.save()
+        self.assertEqual(quote_fee(self.tenant, address), before + 5)
+
+        # no Downtown band covers ~4.5 km any more, so the default zone applies
+        with self.captureOnCommitCallbacks(execute=True):
+            rule.delete()
+        self.assertEqual(quote_fee(self.tenant, address), 40)
+
+    def test_quote_api_for_saved_and_typed_addresses(self):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from delivery.api import ShippingFeeRuleViewSet
+        cashier = User.objects.create_user('fee_cashier', 'fc@test.com', 'pass')
+        cashier.tenant = self.tenant
+        cashier.role = 'cashier'
+        cashier.save()
+        saved = Address.objects.create(tenant=self.tenant, zone='Downtown', latitude='24.713600', longitude='46.720000')
+
+        request = APIRequestFactory().post('/api/delivery/shipping-fees/quote/', {
+            'address_ids': [saved.pk],
+            'addresses': [{'zone': 'Downtown', 'latitude': '24.713600', 'longitude': '46.900000'}],
+        }, format='json')
+        force_authenticate(request, user=cashier)
+        resp = ShippingFeeRuleViewSet.as_view({'post': 'quote'})(request)
+
+        self.assertEqual(resp.status_code, 200)
+        quotes = resp.data['quotes']
+        self.assertEqual(len(quotes), 2)
+        self.assertEqual(quotes[0]['address_id'], saved.pk)
+        self.assertIsNone(quotes[1]['address_id'])
+        self.assertIsNotNone(quotes[1]['fee'])
+
+
+class RouteOptimisationTest(TestCase):
+    """Nearest-neighbour + 2-opt routing and bulk driver assignment."""
+
+    def setUp(self):
+        from decimal import Decimal
+        self.tenant = Tenant.objects.create(slug='routes', name='Route Tenant',
+                                            business_latitude=Decimal('24.713600'),
+                                            business_longitude=Decimal('46.675300'))
+
+    def _synthetic_stops(self, count, seed=7):
+        import random
+        rng = random.Random(seed)
+        return [(i, f'zone-{i % 4}', 24.7136 + rng.uniform(-0.2, 0.2), 46.6753 + rng.uniform(-0.2, 0.2))
+                for i in range(count)]
+
+    def test_two_opt_never_lengthens_nearest_neighbour_route(self):
+        import time
+        from delivery.routing import plan_routes
+        stops = self._synthetic_stops(1000)
+        depot = (24.7136, 46.6753)
+
+        baseline = plan_routes(depot, stops, max_stops=40, max_passes=0)
+        started = time.monotonic()
+        routes = plan_routes(depot, stops, max_stops=40)
+        elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 5)
+        self.assertEqual(sorted(k for r in routes for k in r['keys']), list(range(1000)))
+        self.assertTrue(all(len(r['keys']) <= 40 for r in routes))
+        self.assertLess(sum(r['distance_km'] for r in routes), sum(r['distance_km'] for r in baseline))
+
+    def test_two_opt_reaches_local_optimum(self):
+        from delivery.routing import distance_matrix, nearest_neighbour, two_opt
+        points = [(24.7136, 46.6753)] + [(s[2], s[3]) for s in self._synthetic_stops(40)]
+        dist = distance_matrix(points)
+        route = two_opt(nearest_neighbour(dist), dist, max_passes=500)
+        self.assertEqual(route[0], 0)
+        n = len(route)
+        for i in range(1, n - 1):
+            for k in range(i + 1, n):
+                a, b, c = route[i - 1], route[i], route[k]
+                gain = dist[a, c] - dist[a, b]
+                if k + 1 < n:
+                    gain += dist[b, route[k + 1]] - dist[c, route[k + 1]]
+                self.assertGreaterEqual(gain, -1e-9)
+
+    def _seed(self, deliveries=12, drivers=2):
+        from decimal import Decimal
+        from drivers.models import DriverProfile
+        for i, (_key, zone, lat, lng) in enumerate(self._synthetic_stops(deliveries)):
+            address = Address.objects.create(tenant=self.tenant, zone=zone, latitude=Decimal(f'{lat:.6f}'),
+                                             longitude=Decimal(f'{lng:.6f}'))
+            Delivery.objects.create(tenant=self.tenant, order_reference=f'ORD-R-{i}', address=address, fee=5)
+        Delivery.objects.create(tenant=self.tenant, order_reference='ORD-R-NOADDR')
+        for i in range(drivers):
+            driver = DriverProfile.objects.create(first_name='D', last_name=str(i), phone=f'05000000{i}',
+                                                  registration_id=f'DRV-R-{i}', status='available')
+            driver.assigned_businesses.add(self.tenant)
+
+    def test_optimise_routes_assigns_in_bulk(self):
+        from drivers.models import DriverAssignment
+        from delivery.models import DeliveryEvent
+        from delivery.routing import optimise_routes
+        self._seed(deliveries=12, drivers=2)
+
+        summary = optimise_routes(self.tenant, max_stops=5)
+
+        # 4 zones of 3 stops -> 4 routes, but only 2 drivers
+        self.assertEqual(len(summary['routes']), 2)
+        assigned = Delivery.objects.filter(tenant=self.tenant, status='assigned')
+        self.assertEqual(assigned.count(), 6)
+        self.assertEqual(DriverAssignment.objects.filter(business=self.tenant).count(), 6)
+        self.assertEqual(DeliveryEvent.objects.filter(to_status='assigned').count(), 6)
+        # the delivery without coordinates is not routable and not reported
+        self.assertEqual(len(summary['unassigned']), 6)
+        for route in summary['routes']:
+            rows = Delivery.objects.filter(route_id=route['route_id']).order_by('route_sequence')
+            self.assertEqual([d.pk for d in rows], route['delivery_ids'])
+            self.assertEqual([d.route_sequence for d in rows], list(range(1, len(rows) + 1)))
+
+        # drivers with an active assignment are not offered new routes
+        self.assertEqual(optimise_routes(self.tenant, max_stops=5)['routes'], [])
+
+    def test_dry_run_writes_nothing(self):
+        from drivers.models import DriverAssignment
+        from delivery.routing import optimise_routes
+        self._seed(deliveries=6, drivers=1)
+        summary = optimise_routes(self.tenant, max_stops=10, dry_run=True)
+        self.assertEqual(len(summary['routes']), 1)
+        self.assertFalse(DriverAssignment.objects.exists())
+        self.assertFalse(Delivery.objects.filter(status='assigned').exists())
+
+
+class DispatchSchedulerTest(TestCase):
+    """Automatic dispatch: matching, atomic driver booking and offers."""
+
+    def setUp(self):
+        from decimal import Decimal
+        from django.utils import timezone
+        self.tenant = Tenant.objects.create(slug='dispatch', name='Dispatch Tenant',
+                                            business_latitude=Decimal('24.713600'),
+                                            business_longitude=Decimal('46.675300'))
+        self.now = timezone.now()
+        address = Address.objects.create(tenant=self.tenant, zone='z', latitude=Decimal('24.75'),
+                                         longitude=Decimal('46.70'))
+        self.deliveries = [
+            Delivery.objects.create(tenant=self.tenant, order_reference=f'ORD-D-{i}', tracking_number=f'TRK-D-{i}',
+                                    address=address, fee=7)
+            for i in range(3)
+        ]
+
+    def _driver(self, name, lat, lng, rating=0, user=None, **extra):
+        from decimal import Decimal
+        from drivers.models import DriverProfile
+        fields = dict(
+            first_name=name, last_name='Driver', phone=f'05{abs(hash(name)) % 10 ** 8:08d}',
+            registration_id=f'DRV-{name}', status='available', verification_status='approved',
+            current_latitude=Decimal(str(lat)), current_longitude=Decimal(str(lng)),
+            last_location_update=self.now, average_rating=Decimal(str(rating)), user=user)
+        fields.update(extra)
+        driver = DriverProfile.objects.create(**fields)
+        driver.assigned_businesses.add(self.tenant)
+        return driver
+
+    def test_oldest_delivery_gets_best_driver_and_drivers_become_busy(self):
+        from drivers.models import DriverAssignment
+        from delivery.dispatch import dispatch_tenant
+        near = self._driver('near', 24.7140, 46.6760)
+        rated = self._driver('rated', 24.7300, 46.6900, rating=5)   # ~2.3 km away, 10 km rating bonus
+        self._driver('far', 25.5, 47.5)                              # well beyond the pickup radius
+        self._driver('stale', 24.7136, 46.6753, last_location_update=None)
+
+        offers = dispatch_tenant(self.tenant)
+
+        self.assertEqual(len(offers), 2)
+        first = DriverAssignment.objects.get(delivery=self.deliveries[0])
+        second = DriverAssignment.objects.get(delivery=self.deliveries[1])
+        self.assertEqual(first.driver, rated)
+        self.assertEqual(second.driver, near)
+        self.assertEqual(first.delivery_fee, 7)
+        near.refresh_from_db()
+        rated.refresh_from_db()
+        self.assertEqual((near.status, rated.status), ('busy', 'busy'))
+        self.assertEqual(Delivery.objects.filter(pk=self.deliveries[2].pk, status='pending').count(), 1)
+
+        # nobody is left to book, and already matched deliveries are not offered again
+        self.assertEqual(dispatch_tenant(self.tenant), [])
+        self.assertEqual(DriverAssignment.objects.count(), 2)
+
+    def test_busy_driver_is_not_double_booked_by_another_tenant(self):
+        from decimal import Decimal
+        from drivers.models import DriverAssignment
+        from delivery.dispatch import dispatch_tenant
+        driver = self._driver('shared', 24.7140, 46.6760)
+        other = Tenant.objects.create(slug='dispatch-b', name='B', business_latitude=Decimal('24.713600'),
+                                      business_longitude=Decimal('46.675300'))
+        driver.assigned_businesses.add(other)
+        Delivery.objects.create(tenant=other, order_reference='ORD-B', address=self.deliveries[0].address)
+
+        dispatch_tenant(self.tenant)
+        self.assertEqual(dispatch_tenant(other), [])
+        self.assertEqual(DriverAssignment.objects.filter(driver=driver).count(), 1)
+
+    def test_offer_pushed_to_driver_socket_after_commit(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from django.test import override_settings
+        from delivery.dispatch import dispatch_tenant
+        user = User.objects.create_user('driver_user', 'du@test.com', 'pass')
+        self._driver('socket', 24.7140, 46.6760, user=user)
+
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}):
+            layer = get_channel_layer()
+            channel = async_to_sync(layer.new_channel)()
+            async_to_sync(layer.group_add)(f'user_{user.id}', channel)
+            with self.captureOnCommitCallbacks(execute=True):
+                dispatch_tenant(self.tenant)
+            message = async_to_sync(layer.receive)(channel)
+
+        self.assertEqual(message['type'], 'notification')
+        self.assertEqual(message['payload']['type'], 'dispatch.offer')
+        self.assertEqual(message['payload']['delivery_id'], self.deliveries[0].pk)
+
+    def test_fan_out_only_for_enabled_tenants_and_one_tick_per_tenant(self):
+        from unittest import mock
+        from django.core.cache import cache
+        from django.test import override_settings
+        from delivery.tasks import dispatch_pending_deliveries, dispatch_tenant_deliveries
+
+        with mock.patch('delivery.tasks.dispatch_tenant_deliveries.delay') as delay:
+            self.assertEqual(dispatch_pending_deliveries.run()['tenants'], 0)
+            with override_settings(DELIVERY_AUTO_DISPATCH_TENANTS=['dispatch']):
+                self.assertEqual(dispatch_pending_deliveries.run()['tenants'], 1)
+        delay.assert_called_once_with(str(self.tenant.pk))
+
+        cache.add(f'delivery:dispatch-lock:{self.tenant.pk}', 'other-worker')
+        try:
+            self.assertEqual(dispatch_tenant_deliveries.run(str(self.tenant.pk))['status'], 'skipped')
+        finally:
+            cache.delete(f'delivery:dispatch-lock:{self.tenant.pk}')
+        self.assertEqual(dispatch_tenant_deliveries.run(str(self.tenant.pk))['status'], 'success')
+
+
+    def test_expired_tick_does_not_release_a_newer_lock(self):
+        from unittest import mock
+        from django.core.cache import cache
+        from delivery.tasks import dispatch_tenant_deliveries
+
+        lock_key = f'delivery:dispatch-lock:{self.tenant.pk}'
+
+        def slow_tick(tenant):
+            # the lock expired mid-tick and another worker took it
+            cache.set(lock_key, 'newer-tick')
+            return []
+
+        try:
+            with mock.patch('delivery.dispatch.dispatch_tenant', slow_tick):
+                self.assertEqual(dispatch_tenant_deliveries.run(str(self.tenant.pk))['status'], 'success')
+            self.assertEqual(cache.get(lock_key), 'newer-tick')
+        finally:
+            cache.delete(lock_key)
+
+class DeliveryEtaTest(TestCase):
+    """Speed profiles from location history and batch ETA estimates."""
+
+    def setUp(self):
+        from decimal import Decimal
+        from django.utils import timezone
+        from drivers.models import DriverAssignment, DriverProfile
+        self.now = timezone.now()
+        self.tenant = Tenant.objects.create(slug='eta', name='ETA Tenant')
+        self.address = Address.objects.create(tenant=self.tenant, zone='North', latitude=Decimal('24.800000'),
+                                              longitude=Decimal('46.700000'))
+        self.delivery = Delivery.objects.create(tenant=self.tenant, order_reference='ORD-ETA', address=self.address,
+                                                status='in_transit')
+        self.driver = DriverProfile.objects.create(
+            first_name='Eta', last_name='Driver', phone='0599999999', registration_id='DRV-ETA',
+            current_latitude=Decimal('24.710068'), current_longitude=Decimal('46.700000'),  # 10 km south
+            last_location_update=self.now)
+        self.assignment = DriverAssignment.objects.create(driver=self.driver, delivery=self.delivery,
+                                                          business=self.tenant, status='started')
+
+    def _record_trip(self, start, minutes, km_per_minute):
+        from datetime import timedelta
+        from decimal import Decimal
+        from drivers.models import LocationHistory
+        step = km_per_minute / 111.195
+        for i in range(minutes + 1):
+            point = LocationHistory.objects.create(driver=self.driver, assignment=self.assignment,
+                                                   latitude=Decimal(f'{24.6 + i * step:.6f}'),
+                                                   longitude=Decimal('46.700000'))
+            LocationHistory.objects.filter(pk=point.pk).update(timestamp=start + timedelta(minutes=i))
+
+    def test_rebuild_speed_profiles_per_zone_and_hour(self):
+        from datetime import timedelta
+        from delivery.eta import rebuild_speed_profiles
+        from delivery.models import SpeedProfile
+        start = self.now.replace(minute=5, second=0, microsecond=0) - timedelta(days=1)
+        self._record_trip(start, minutes=15, km_per_minute=0.5)   # 30 km/h
+
+        self.assertEqual(rebuild_speed_profiles(now=self.now), 2)
+
+        zone = SpeedProfile.objects.get(tenant=self.tenant, zone='north')
+        tenant_wide = SpeedProfile.objects.get(tenant=self.tenant, zone='')
+        self.assertAlmostEqual(zone.hourly_kmh[start.hour], 30, delta=0.5)
+        self.assertEqual(tenant_wide.hourly_kmh[start.hour], zone.hourly_kmh[start.hour])
+        self.assertIsNone(zone.hourly_kmh[(start.hour + 12) % 24])
+
+    def test_speed_table_falls_back_to_tenant_then_default(self):
+        from delivery.eta import SpeedTable
+        hourly = [None] * 24
+        hourly[8] = 40.0
+        table = SpeedTable([(1, 'north', hourly), (1, '', [20.0] * 24)])
+        speeds = table.speeds([1, 1, 2], ['North', 'north', 'north'], [8, 9, 8])
+        self.assertEqual(speeds.tolist(), [40.0, 20.0, 25.0])
+
+    def test_estimates_and_emails_only_material_changes(self):
+        from datetime import timedelta
+        from decimal import Decimal
+        from unittest import mock
+        from delivery.eta import estimate_etas
+
+        with mock.patch('delivery.tasks.send_delivery_eta_update.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                first = estimate_etas(now=self.now)
+            # 10 km * 1.3 route factor at the 25 km/h default speed
+            self.assertEqual(first['notified'], [(self.delivery.pk, 32)])
+            delay.assert_called_once_with(self.delivery.pk, 32)
+            self.delivery.refresh_from_db()
+            self.assertEqual(self.delivery.estimated_arrival, self.now + timedelta(minutes=32))
+
+            # a minute later, same position: the arrival time moved by a minute, no email
+            with self.captureOnCommitCallbacks(execute=True):
+                second = estimate_etas(now=self.now + timedelta(minutes=1))
+            self.assertEqual(second['estimated'], 1)
+            self.assertEqual(second['notified'], [])
+
+            # the driver went the wrong way: 20 km out now, customer is told again
+            self.driver.current_latitude = Decimal('24.620136')
+            self.driver.last_location_update = self.now + timedelta(minutes=2)
+            self.driver.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                third = estimate_etas(now=self.now + timedelta(minutes=2))
+            self.assertEqual(len(third['notified']), 1)
+            self.assertEqual(delay.call_count, 2)
+
+    def test_deliveries_not_in_transit_are_skipped(self):
+        from delivery.eta import estimate_etas
+        Delivery.objects.filter(pk=self.delivery.pk).update(status='delivered')
+        self.assertEqual(estimate_etas(now=self.now)['estimated'], 0)
+
+
+class DeliveryOrderLinkTest(TestCase):
+    """Deliveries resolve their customer through the order foreign key."""
+
+    def setUp(self):
+        from crm.models import Customer
+        from pos.models import Order
+        self.tenant = Tenant.objects.create(slug='orders', name='Orders Tenant')
+        self.other = Tenant.objects.create(slug='orders-other', name='Other Tenant')
+        self.customer = Customer.objects.create(tenant=self.tenant, first_name='Sara', email='sara@example.com')
+        self.order = Order.objects.create(tenant=self.tenant, customer=self.customer, status='paid')
+        self.foreign_order = Order.objects.create(tenant=self.other, status='paid')
+
+    def test_backfill_links_matching_orders_of_the_same_tenant(self):
+        from io import StringIO
+        from django.core.management import call_command
+        linked = Delivery.objects.create(tenant=self.tenant, order_reference=f'ORD-{self.order.pk}')
+        cross_tenant = Delivery.objects.create(tenant=self.tenant, order_reference=f'ORD-{self.foreign_order.pk}')
+        garbage = Delivery.objects.create(tenant=self.tenant, order_reference='walk-in')
+        # rows from before the order link existed
+        Delivery.objects.update(order=None)
+
+        out = StringIO()
+        call_command('backfill_delivery_orders', '--batch-size', '2', stdout=out)
+
+        self.assertIn('Linked 1 deliveries', out.getvalue())
+        linked.refresh_from_db()
+        cross_tenant.refresh_from_db()
+        garbage.refresh_from_db()
+        self.assertEqual(linked.order_id, self.order.pk)
+        self.assertIsNone(cross_tenant.order_id)
+        self.assertIsNone(garbage.order_id)
+
+    def test_status_notification_emails_order_customer_in_one_query(self):
+        from django.core import mail
+        from delivery.tasks import notify_delivery_status_change
+        # another order of the tenant must not be picked up by accident
+        from pos.models import Order
+        Order.objects.create(tenant=self.tenant, status='paid')
+        delivery = Delivery.objects.create(tenant=self.tenant, order_reference='custom', order=self.order,
+                                           status='in_transit', tracking_number='TRK-ORD')
+
+        with self.assertNumQueries(1):
+            result = notify_delivery_status_change.run(delivery.pk, 'picked_up', 'in_transit')
+
+        self.assertTrue(result['customer_notified'])
+        self.assertEqual(mail.outbox[-1].to, ['sara@example.com'])
+
+    def test_eta_update_uses_order_link(self):
+        from django.core import mail
+        from delivery.tasks import send_delivery_eta_update
+        delivery = Delivery.objects.create(tenant=self.tenant, order_reference='custom', order=self.order,
+                                           status='in_transit')
+        self.assertEqual(send_delivery_eta_update.run(delivery.pk, 75)['status'], 'success')
+        self.assertIn('1h 15m', mail.outbox[-1].body)
+
+        unlinked = Delivery.objects.create(tenant=self.tenant, order_reference='walk-in', status='in_transit')
+        self.assertEqual(send_delivery_eta_update.run(unlinked.pk, 10)['reason'], 'no_customer_email')
+
+    def test_create_links_order_named_by_reference(self):
+        from delivery.serializers import DeliverySerializer
+        serializer = DeliverySerializer(data={'order_reference': f'ORD-{self.order.pk}'})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.save(tenant=self.tenant).order_id, self.order.pk)
+        other = Delivery.objects.create(tenant=self.other, order_reference=f'ORD-{self.order.pk}')
+        self.assertIsNone(other.order_id)
+
+
+class OverdueSweeperTest(TestCase):
+    """Overdue sweep fans out one alert task per tenant."""
+
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        User = get_user_model()
+        self.late = timezone.now() - timedelta(days=2)
+        self.tenants = [Tenant.objects.create(slug=f'late-{i}', name=f'Late {i}') for i in range(2)]
+        self.deliveries = {}
+        for i, tenant in enumerate(self.tenants):
+            for role in ('owner', 'manager'):
+                User.objects.create_user(username=f'{role}-{i}', email=f'{role}-{i}@example.com', password='x',
+                                         tenant=tenant, role=role)
+            self.deliveries[tenant.pk] = [
+                Delivery.objects.create(tenant=tenant, order_reference=f'LATE-{i}-{n}', tracking_number=f'TRK-{i}-{n}',
+                                        status='in_transit', expected_delivery=self.late).pk
+                for n in range(3)
+            ]
+        # not overdue: delivered, or due in the future
+        Delivery.objects.create(tenant=self.tenants[0], order_reference='DONE', status='delivered',
+                                expected_delivery=self.late)
+        Delivery.objects.create(tenant=self.tenants[0], order_reference='SOON', status='in_transit',
+                                expected_delivery=timezone.now() + timedelta(days=2))
+
+    def test_coordinator_queues_one_task_per_tenant_from_one_query(self):
+        from unittest import mock
+        from delivery.tasks import check_overdue_deliveries
+
+        with mock.patch('delivery.tasks.notify_overdue_deliveries.delay') as delay, self.assertNumQueries(1):
+            result = check_overdue_deliveries.run()
+
+        self.assertEqual(result['overdue_count'], 6)
+        self.assertEqual(result['tasks_queued'], 2)
+        calls = {args[0]: sorted(args[1]) for args, _kwargs in delay.call_args_list}
+        self.assertEqual(calls, {str(t.pk): sorted(self.deliveries[t.pk]) for t in self.tenants})
+
+    def test_tenant_task_bulk_inserts_notifications_and_sends_over_one_connection(self):
+        from unittest import mock
+        from django.core import mail
+        from notifications.models import Notification
+        from delivery.tasks import notify_overdue_deliveries
+
+        tenant = self.tenants[0]
+        ids = self.deliveries[tenant.pk]
+        Delivery.objects.filter(pk=ids[0]).update(status='delivered')
+
+        with mock.patch('django.core.mail.get_connection', wraps=mail.get_connection) as get_connection, \
+                self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(6):
+            # deliveries, managers, their preferences, one insert, two for the unread counters
+            result = notify_overdue_deliveries.run(str(tenant.pk), ids)
+
+        get_connection.assert_called_once()
+        self.assertEqual(result['overdue_count'], 2)
+        self.assertEqual(result['notifications_sent'], 2)
+        self.assertEqual(result['emails_sent'], 2)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['manager-0@example.com', 'owner-0@example.com'])
+        self.assertEqual(Notification.objects.filter(recipient__tenant=tenant).count(), 2)
+        self.assertNotIn('TRK-0-0', mail.outbox[0].body)
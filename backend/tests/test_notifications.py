@@ -0,0 +1,737 @@
+"""
+Tests for the central notification dispatcher (notifications.dispatch).
+"""
+import json
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from tenants.models import Tenant
+from notifications.models import Notification, Subscription
+from notifications.dispatch import notify, render
+from users.models import UserNotificationPreferences
+
+User = get_user_model()
+
+
+class NotifyTest(TestCase):
+    """Batching, preference routing and channel push of notify()."""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(slug='notify', name='Notify Tenant')
+        self.users = [
+            User.objects.create_user(f'user{i}', f'user{i}@example.com', 'pass', tenant=self.tenant, role='manager')
+            for i in range(4)
+        ]
+        # user1 does not want emails, user2 has delivery updates off altogether
+        self._preferences(self.users[1], email_notifications=False)
+        self._preferences(self.users[2], notify_delivery_updates=False)
+        self.data = {'delivery_id': 7, 'tracking_number': 'TRK-7'}
+
+    def _preferences(self, user, **flags):
+        # preferences hang off the users.CustomUser profile linked to the account
+        from users.models import CustomUser
+        profile = CustomUser.objects.create(username=user.username, registration_id=f'REG-{user.username}',
+                                            account=user)
+        return UserNotificationPreferences.objects.create(user=profile, **flags)
+
+    def test_bulk_inserts_and_routes_by_preferences(self):
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(5):
+            # recipients, preferences, one insert, two for the unread counters
+            result = notify(User.objects.filter(tenant=self.tenant), 'delivery_failed', self.data,
+                            channels=['in_app', 'email'])
+
+        self.assertEqual(result['recipients'], 3)
+        self.assertEqual(result['in_app'], 3)
+        self.assertEqual(result['email'], 2)
+        rows = Notification.objects.filter(title='Delivery Failed - TRK-7')
+        self.assertEqual(sorted(rows.values_list('recipient__username', flat=True)), ['user0', 'user1', 'user3'])
+        self.assertEqual(rows.first().data, self.data)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['user0@example.com', 'user3@example.com'])
+        self.assertIn('TRK-7 has failed', mail.outbox[0].body)
+
+    def test_external_channels_wait_for_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            notify([self.users[0]], 'delivery_failed', self.data, channels=['in_app', 'email'])
+            self.assertEqual(len(mail.outbox), 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_in_app_rows_pushed_to_user_group(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+
+        user = self.users[0]
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}):
+            layer = get_channel_layer()
+            channel = async_to_sync(layer.new_channel)()
+            async_to_sync(layer.group_add)(f'user_{user.id}', channel)
+            with self.captureOnCommitCallbacks(execute=True):
+                result = notify([user.id], 'delivery_assigned', self.data, context={'address': '1 Main St'})
+            message = async_to_sync(layer.receive)(channel)
+
+        self.assertEqual(message['type'], 'notification')
+        self.assertEqual(message['payload']['type'], 'notification.created')
+        self.assertEqual(message['payload']['id'], result['notifications'][0].pk)
+        self.assertEqual(message['payload']['body'], 'New delivery assigned. Address: 1 Main St')
+
+    def test_web_push_only_to_subscribed_users_who_allow_it(self):
+        self._preferences(self.users[3], push_notifications=False)
+        for user in (self.users[0], self.users[3]):
+            Subscription.objects.create(user=user, endpoint=f'https://push.example.com/{user.pk}', keys={'auth': 'a'})
+
+        with mock.patch('notifications.webpush.push', return_value=201) as push, \
+                mock.patch('notifications.tasks.send_web_push_notifications.delay', side_effect=ConnectionError), \
+                self.captureOnCommitCallbacks(execute=True):
+            notify([self.users[0], self.users[3]], 'low_stock', {'product_count': 2},
+                   channels=['web_push'], context={'product_list': '- A\n- B'})
+
+        push.assert_called_once()
+        subscription, payload = push.call_args[0]
+        self.assertEqual(subscription['endpoint'], f'https://push.example.com/{self.users[0].pk}')
+        self.assertIn('Low Stock Alert: 2 product(s)', payload)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_preferences_of_an_unlinked_profile_with_the_same_username_are_ignored(self):
+        from users.models import CustomUser
+        # a profile of someone else who happens to share user0's username
+        stranger = CustomUser.objects.create(username=self.users[0].username, registration_id='REG-stranger')
+        UserNotificationPreferences.objects.create(user=stranger, notify_delivery_updates=False)
+
+        result = notify([self.users[0]], 'delivery_failed', self.data)
+        self.assertEqual(result['in_app'], 1)
+
+    def test_link_user_accounts_links_unique_email_matches_in_the_tenant(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from users.models import CustomUser
+        User.objects.create_user('twin', 'user0@example.com', 'pass', role='cashier')  # no tenant
+        User.objects.create_user('twin-a', 'shared@example.com', 'pass', tenant=self.tenant)
+        User.objects.create_user('twin-b', 'shared@example.com', 'pass', tenant=self.tenant)
+        mine = CustomUser.objects.create(username='p0', registration_id='REG-p0', email='USER0@example.com',
+                                         tenant=self.tenant)
+        shared = CustomUser.objects.create(username='p1', registration_id='REG-p1', email='shared@example.com',
+                                           tenant=self.tenant)
+        # user3's email, but user3 has no profile yet and this one sits in no tenant
+        elsewhere = CustomUser.objects.create(username='p3', registration_id='REG-p3', email='user3@example.com')
+
+        out = StringIO()
+        call_command('link_user_accounts', stdout=out)
+
+        self.assertIn('Linked 1 profiles', out.getvalue())
+        mine.refresh_from_db()
+        shared.refresh_from_db()
+        elsewhere.refresh_from_db()
+        self.assertEqual(mine.account_id, self.users[0].pk)
+        self.assertIsNone(shared.account_id)
+        self.assertIsNone(elsewhere.account_id)
+
+    def test_inactive_users_and_unknown_channels(self):
+        User.objects.filter(pk=self.users[0].pk).update(is_active=False)
+        self.assertEqual(notify([self.users[0].pk], 'low_stock', {'product_count': 1},
+                                context={'product_list': ''})['recipients'], 0)
+        with self.assertRaises(ValueError):
+            notify([self.users[1]], 'low_stock', {}, channels=['sms'])
+
+    def test_render_ad_hoc_template(self):
+        self.assertEqual(render({'title': 'Hi {name}', 'body': '{count} new'}, {'count': 3}, {'name': 'Sam'}),
+                         ('Hi Sam', '3 new'))
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """Minimal local SMTP server: records messages and connections, refuses chosen recipients."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, refuse=()):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.refuse = set(refuse)
+        self.messages = []
+        self.connections = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self._reply('220 stand-in ESMTP')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO', 'NOOP', 'RSET'):
+                recipients = [] if verb == 'RSET' else recipients
+                self._reply('250 OK')
+            elif verb == 'MAIL':
+                recipients = []
+                self._reply('250 OK')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip().strip('<>')
+                if address in self.server.refuse:
+                    self._reply('550 No such user')
+                else:
+                    recipients.append(address)
+                    self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for data_line in iter(self.rfile.readline, b''):
+                    if data_line == b'.\r\n':
+                        break
+                    data.append(data_line)
+                self.server.messages.append((recipients, b''.join(data).decode()))
+                self._reply('250 OK queued')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Not implemented')
+
+
+class EmailQueueTest(TestCase):
+    """Queued email backend, pooled delivery against a local SMTP stand-in, retries and dead letters."""
+
+    def setUp(self):
+        self.smtp = SMTPStandIn(refuse={'nobody@example.com'})
+        self.settings_override = override_settings(
+            EMAIL_BACKEND='notifications.mail.QueuedEmailBackend',
+            EMAIL_DELIVERY_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.smtp.port, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+            EMAIL_USE_TLS=False, EMAIL_RATE_LIMIT_PER_SECOND=0,
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        from notifications.mail import pool
+        pool.discard()
+        self.settings_override.disable()
+        self.smtp.stop()
+
+    def _queue(self, *recipients, **kwargs):
+        with mock.patch('notifications.mail.schedule_flush'):
+            for recipient in recipients:
+                mail.send_mail(f'Hello {recipient}', 'Body', 'shop@example.com', [recipient], **kwargs)
+
+    def test_send_mail_only_queues(self):
+        from notifications.models import QueuedEmail
+        with mock.patch('notifications.tasks.flush_email_queue.apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True):
+            mail.send_mail('Hi', 'Body', 'shop@example.com', ['a@example.com'], html_message='<b>Body</b>')
+            mail.send_mail('Hi', 'Body', 'shop@example.com', ['b@example.com'])
+
+        self.assertEqual(QueuedEmail.objects.count(), 2)
+        self.assertEqual(self.smtp.connections, 0)
+        # both messages ride on one scheduled flush
+        apply_async.assert_called_once()
+        self.assertEqual(QueuedEmail.objects.get(to=['a@example.com']).alternatives, [['<b>Body</b>', 'text/html']])
+
+    def test_flushes_reuse_one_pooled_connection(self):
+        from notifications.mail import flush_queue
+        from notifications.models import QueuedEmail
+
+        self._queue('a@example.com', 'b@example.com', 'c@example.com')
+        self.assertEqual(flush_queue(batch_size=2), {'claimed': 2, 'sent': 2, 'retried': 0, 'dead': 0})
+        self._queue('d@example.com')
+        self.assertEqual(flush_queue()['sent'], 2)
+
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual([r for r, _data in self.smtp.messages],
+                         [['a@example.com'], ['b@example.com'], ['c@example.com'], ['d@example.com']])
+        self.assertFalse(QueuedEmail.objects.exists())
+
+    def test_attachments_survive_the_queue(self):
+        from notifications.mail import flush_queue
+        message = mail.EmailMessage('Receipt', 'Attached', 'shop@example.com', ['a@example.com'])
+        message.attach('receipt.pdf', b'%PDF-1.4 test', 'application/pdf')
+        with mock.patch('notifications.mail.schedule_flush'):
+            message.send()
+
+        flush_queue()
+        self.assertIn('filename="receipt.pdf"', self.smtp.messages[0][1])
+
+    def test_refused_recipient_goes_to_dead_letters(self):
+        from notifications.mail import flush_queue, requeue_dead_letters
+        from notifications.models import EmailDeadLetter, QueuedEmail
+
+        self._queue('nobody@example.com', 'a@example.com')
+        self.assertEqual(flush_queue(), {'claimed': 2, 'sent': 1, 'retried': 0, 'dead': 1})
+
+        dead = EmailDeadLetter.objects.get()
+        self.assertEqual(dead.to, ['nobody@example.com'])
+        self.assertIn('SMTPRecipientsRefused', dead.last_error)
+        self.assertFalse(QueuedEmail.objects.exists())
+
+        with mock.patch('notifications.mail.schedule_flush'), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(requeue_dead_letters(EmailDeadLetter.objects.all()), 1)
+        self.assertEqual(QueuedEmail.objects.get().to, ['nobody@example.com'])
+
+    def test_unreachable_server_retries_with_backoff_then_dead_letters(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from notifications.mail import flush_queue
+        from notifications.models import EmailDeadLetter, QueuedEmail
+
+        self._queue('a@example.com')
+        self.smtp.stop()
+        now = timezone.now()
+        with override_settings(EMAIL_MAX_ATTEMPTS=2, EMAIL_RETRY_BASE_SECONDS=60, EMAIL_TIMEOUT=1):
+            self.assertEqual(flush_queue(now=now)['retried'], 1)
+            row = QueuedEmail.objects.get()
+            self.assertEqual((row.status, row.attempts), ('pending', 1))
+            self.assertEqual(row.next_attempt_at, now + timedelta(seconds=60))
+            # not due yet
+            self.assertEqual(flush_queue(now=now + timedelta(seconds=30))['claimed'], 0)
+            self.assertEqual(flush_queue(now=now + timedelta(seconds=61))['dead'], 1)
+
+        self.assertEqual(EmailDeadLetter.objects.get().attempts, 2)
+        self.smtp = SMTPStandIn()
+
+    def test_rate_limit_spreads_sends_over_seconds(self):
+        from notifications.mail import RateLimiter
+        limiter = RateLimiter(per_second=2)
+        with mock.patch('notifications.mail.time') as clock:
+            clock.time.side_effect = [100.2, 100.3, 100.4, 100.5, 101.1]
+            for _ in range(3):
+                limiter.wait()
+        clock.sleep.assert_called_once()
+        self.assertAlmostEqual(clock.sleep.call_args[0][0], 0.5)
+
+
+class PushStandIn(ThreadingHTTPServer):
+    """Local push service: answers 201, or the status configured for an endpoint path."""
+    daemon_threads = True
+
+    def __init__(self, statuses=None):
+        super().__init__(('127.0.0.1', 0), _PushHandler)
+        self.statuses = statuses or {}
+        self.requests = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def endpoint(self, name):
+        return f'http://127.0.0.1:{self.server_address[1]}/push/{name}'
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _PushHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append((self.path, {k.lower(): v for k, v in self.headers.items()}, body))
+        status = self.server.statuses.get(self.path.rsplit('/', 1)[-1], 201)
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def subscription_keys():
+    """p256dh / auth keys like a browser would generate them."""
+    import base64
+    import os
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    public = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+    encode = lambda raw: base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+    return {'p256dh': encode(public), 'auth': encode(os.urandom(16))}
+
+
+def vapid_private_key():
+    from py_vapid import Vapid, b64urlencode
+    vapid = Vapid()
+    vapid.generate_keys()
+    return b64urlencode(vapid.private_key.private_numbers().private_value.to_bytes(32, 'big'))
+
+
+class WebPushTest(TestCase):
+    """Concurrent fan-out, pruning of expired subscriptions and metrics, against a local push service."""
+
+    def setUp(self):
+        from notifications import webpush
+        self.push_service = PushStandIn(statuses={'expired': 410, 'unknown': 404, 'broken': 500})
+        self.settings_override = override_settings(VAPID_PRIVATE_KEY=vapid_private_key(), WEB_PUSH_MAX_WORKERS=4)
+        self.settings_override.enable()
+        webpush.reset_metrics()
+        self.user = User.objects.create_user('pushed', 'pushed@example.com', 'pass')
+        self.subscriptions = {
+            name: Subscription.objects.create(user=self.user, endpoint=self.push_service.endpoint(name),
+                                              keys=subscription_keys())
+            for name in ('phone', 'laptop', 'expired', 'unknown', 'broken')
+        }
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.push_service.stop()
+
+    def test_fans_out_to_every_subscription_and_prunes_gone_ones(self):
+        from notifications.webpush import metrics, send_to_users
+
+        result = send_to_users([self.user.pk], '{"title": "Hi"}')
+
+        self.assertEqual(result, {'sent': 2, 'failed': 1, 'pruned': 2})
+        self.assertEqual(len(self.push_service.requests), 5)
+        self.assertEqual(sorted(Subscription.objects.values_list('endpoint', flat=True)),
+                         sorted(self.subscriptions[n].endpoint for n in ('phone', 'laptop', 'broken')))
+        self.assertEqual(metrics(), {'sent': 2, 'failed': 1, 'pruned': 2})
+
+        _path, headers, body = self.push_service.requests[0]
+        self.assertTrue(headers['authorization'].startswith('vapid t='))
+        self.assertEqual(headers['content-encoding'], 'aes128gcm')
+        self.assertNotIn(b'Hi', body)
+
+    def test_vapid_header_signed_once_per_push_service(self):
+        from py_vapid import Vapid02
+        from notifications.webpush import send_to_users
+
+        with mock.patch.object(Vapid02, 'sign', autospec=True, side_effect=Vapid02.sign) as sign:
+            send_to_users([self.user.pk], '{}')
+            send_to_users([self.user.pk], '{}')
+        self.assertEqual(sign.call_count, 1)
+
+    def test_unreachable_push_service_counts_as_failed(self):
+        from notifications.webpush import send_to_subscriptions
+        self.push_service.stop()
+        sub = self.subscriptions['phone']
+        result = send_to_subscriptions([(sub.pk, sub.endpoint, sub.keys)], '{}')
+        self.assertEqual(result, {'sent': 0, 'failed': 1, 'pruned': 0})
+        self.assertTrue(Subscription.objects.filter(pk=sub.pk).exists())
+        self.push_service = PushStandIn()
+
+
+class UnreadCounterTest(TestCase):
+    """Unread counters follow creates and mark_read; the list pages by keyset."""
+
+    def setUp(self):
+        from rest_framework.test import APIRequestFactory
+        from notifications.views import NotificationViewSet
+        self.factory = APIRequestFactory()
+        self.view = NotificationViewSet
+        self.tenant = Tenant.objects.create(slug='unread', name='Unread Tenant')
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'pass', tenant=self.tenant)
+        self.other = User.objects.create_user('other', 'other@example.com', 'pass', tenant=self.tenant)
+
+    def _call(self, method, action, data=None, **params):
+        from rest_framework.test import force_authenticate
+        request = getattr(self.factory, method)('/', data if method == 'post' else params, format='json')
+        force_authenticate(request, user=self.user)
+        return self.view.as_view({method: action})(request)
+
+    def test_counters_follow_create_notify_and_mark_read(self):
+        from notifications.unread import tenant_unread, unread_count
+        first = Notification.objects.create(recipient=self.user, title='One')
+        Notification.objects.create(recipient=self.user, title='Already read', read=True)
+        notify([self.user, self.other], {'title': 'Two'})
+        notify([self.user], {'title': 'Three'})
+        self.assertEqual(unread_count(self.user), 3)
+        self.assertEqual(unread_count(self.other), 1)
+        self.assertEqual(tenant_unread(self.tenant), 4)
+
+        # marking an already read notification twice does not count twice
+        self.assertEqual(self._call('post', 'mark_read', {'ids': [first.pk]}).data['unread'], 2)
+        self.assertEqual(self._call('post', 'mark_read', {'ids': [first.pk]}).data['marked'], 0)
+        self.assertEqual(self._call('get', 'unread_count').data, {'unread': 2})
+        self.assertEqual(self._call('post', 'mark_read', {'all': True}).data['unread'], 0)
+        self.assertEqual(unread_count(self.other), 1)
+
+    def test_recount_after_delete(self):
+        from notifications.unread import recount, unread_count
+        rows = [Notification.objects.create(recipient=self.user, title=f'N{i}') for i in range(3)]
+        Notification.objects.filter(pk=rows[0].pk).delete()
+        recount([self.user.pk, self.other.pk])
+        self.assertEqual(unread_count(self.user), 2)
+        self.assertEqual(unread_count(self.other), 0)
+
+    def test_list_pages_by_cursor(self):
+        from datetime import timedelta
+        from urllib.parse import parse_qs, urlparse
+        from django.utils import timezone
+        now = timezone.now()
+        rows = Notification.objects.bulk_create([
+            Notification(recipient=self.user, title=f'N{i}') for i in range(5)
+        ])
+        # two share a timestamp, so the id breaks the tie
+        for i, row in enumerate(rows):
+            Notification.objects.filter(pk=row.pk).update(created_at=now - timedelta(minutes=min(i, 3)))
+        Notification.objects.create(recipient=self.other, title='Not mine')
+
+        seen = []
+        page = self._call('get', 'list', page_size=2)
+        while True:
+            seen += [n['title'] for n in page.data['results']]
+            if not page.data['next']:
+                break
+            cursor = parse_qs(urlparse(page.data['next']).query)['cursor'][0]
+            page = self._call('get', 'list', page_size=2, cursor=cursor)
+        self.assertEqual(seen, ['N0', 'N1', 'N2', 'N4', 'N3'])
+        self.assertNotIn('page', page.data)
+
+
+class RetentionTest(TestCase):
+    """Repeated alerts fold into one row; old read rows move to compressed archives."""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.media = tempfile.mkdtemp()
+        self.private = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.private, ignore_errors=True)
+        storage = override_settings(
+            MEDIA_ROOT=self.media, DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+            NOTIFICATION_ARCHIVE_STORAGE={'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                                          'OPTIONS': {'location': self.private}})
+        storage.enable()
+        self.addCleanup(storage.disable)
+        self.tenant = Tenant.objects.create(slug='retention', name='Retention Tenant')
+        self.user = User.objects.create_user('keeper', 'keeper@example.com', 'pass', tenant=self.tenant)
+        self.other = User.objects.create_user('peer', 'peer@example.com', 'pass', tenant=self.tenant)
+
+    def _age(self, rows, days):
+        from datetime import timedelta
+        from django.utils import timezone
+        Notification.objects.filter(pk__in=[r.pk for r in rows]).update(
+            created_at=timezone.now() - timedelta(days=days))
+
+    def test_compact_folds_identical_alerts_per_user(self):
+        from notifications.retention import compact
+        from notifications.unread import unread_count
+        data = {'product_ids': [1, 2, 3]}
+        for days in (3, 2, 1):
+            result = notify([self.user, self.other], {'title': 'Low stock', 'body': 'A, B, C'}, data)
+            self._age(result['notifications'], days)
+        Notification.objects.filter(recipient=self.user).update(read=True)
+        notify([self.user], {'title': 'Low stock', 'body': 'A, B, C'}, data)
+        notify([self.user], {'title': 'Low stock', 'body': 'A, B'}, data)
+        # written before fingerprints were stored
+        Notification.objects.filter(recipient=self.other).update(fingerprint='')
+
+        self.assertEqual(compact(batch_size=1), {'groups': 2, 'removed': 5})
+
+        mine = Notification.objects.get(recipient=self.user, body='A, B, C')
+        self.assertEqual(mine.occurrences, 4)
+        self.assertFalse(mine.read)
+        self.assertLess(mine.first_occurred_at, mine.created_at)
+        self.assertEqual(Notification.objects.get(recipient=self.other).occurrences, 3)
+        self.assertEqual(unread_count(self.user), 2)
+        self.assertEqual(unread_count(self.other), 1)
+        self.assertEqual(compact(), {'groups': 0, 'removed': 0})
+
+    def test_archive_moves_old_read_rows_in_batches(self):
+        from notifications.retention import archive, read_archive
+        old_read = [Notification.objects.create(recipient=self.user, title=f'Old {i}', read=True)
+                    for i in range(5)]
+        old_unread = Notification.objects.create(recipient=self.user, title='Old unread')
+        recent = Notification.objects.create(recipient=self.user, title='Recent', read=True)
+        self._age(old_read + [old_unread], 120)
+
+        result = archive(days=90, batch_size=2)
+
+        self.assertEqual(result['archived'], 5)
+        self.assertEqual(len(result['files']), 3)
+        self.assertTrue(all(name.endswith('.jsonl.gz') for name in result['files']))
+        self.assertEqual(set(Notification.objects.values_list('pk', flat=True)), {old_unread.pk, recent.pk})
+        archived = [row for name in result['files'] for row in read_archive(name)]
+        self.assertEqual([row['title'] for row in archived], [f'Old {i}' for i in range(5)])
+        self.assertEqual(archived[0]['recipient_id'], self.user.pk)
+
+    def test_archives_never_go_to_the_public_media_storage(self):
+        import os
+        from django.core.files.storage import default_storage
+        from notifications.retention import archive, archive_storage
+        rows = [Notification.objects.create(recipient=self.user, title='Old', read=True)]
+        self._age(rows, 120)
+
+        name = archive(days=90)['files'][0]
+
+        self.assertTrue(os.path.exists(os.path.join(self.private, name)))
+        self.assertFalse(default_storage.exists(name))
+        self.assertNotEqual(archive_storage().location, default_storage.location)
+
+    def test_s3_archive_storage_is_private_whatever_the_media_acl(self):
+        from notifications.retention import archive_storage
+        with override_settings(NOTIFICATION_ARCHIVE_STORAGE={
+                'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage',
+                'OPTIONS': {'bucket_name': 'archive-bucket', 'default_acl': 'private',
+                            'querystring_auth': True, 'custom_domain': None}},
+                AWS_DEFAULT_ACL='public-read', AWS_S3_CUSTOM_DOMAIN='media.example.com'):
+            storage = archive_storage()
+        self.assertEqual(storage.default_acl, 'private')
+        self.assertTrue(storage.querystring_auth)
+        self.assertIsNone(storage.custom_domain)
+
+    def test_max_batches_bounds_one_run(self):
+        from notifications.retention import archive
+        rows = [Notification.objects.create(recipient=self.user, title=f'Old {i}', read=True) for i in range(5)]
+        self._age(rows, 120)
+        self.assertEqual(archive(days=90, batch_size=2, max_batches=1)['archived'], 2)
+        self.assertEqual(archive(days=90, batch_size=2)['archived'], 3)
+
+
+class SocketClient:
+    """Minimal WebSocket client over the ASGI interface (channels.testing needs daphne)."""
+
+    def __init__(self, app, path, query_string):
+        from asgiref.testing import ApplicationCommunicator
+        self.app = ApplicationCommunicator(app, {
+            'type': 'websocket', 'path': path, 'query_string': query_string.encode(), 'headers': [],
+            'subprotocols': [],
+        })
+
+    async def connect(self):
+        await self.app.send_input({'type': 'websocket.connect'})
+        return (await self.app.receive_output(1))['type'] == 'websocket.accept'
+
+    async def receive_output(self, timeout=1):
+        return await self.app.receive_output(timeout)
+
+    async def receive_json_from(self, timeout=1):
+        message = await self.app.receive_output(timeout)
+        return json.loads(message['text'])
+
+    async def send_json_to(self, data):
+        await self.app.send_input({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def disconnect(self):
+        await self.app.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await self.app.wait(1)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class NotificationSocketTest(TestCase):
+    """JWT handshake without loading the user, presence, heartbeat and backpressure."""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(slug='sockets', name='Socket Tenant')
+        self.user = User.objects.create_user('socket', 'socket@example.com', 'pass', tenant=self.tenant)
+
+    def _token(self, **claims):
+        from rest_framework_simplejwt.tokens import AccessToken
+        token = AccessToken.for_user(self.user)
+        for name, value in claims.items():
+            token[name] = value
+        return str(token)
+
+    def _communicator(self, token):
+        from channels.routing import URLRouter
+        from notifications.middleware import JWTAuthMiddlewareStack
+        from notifications.routing import websocket_urlpatterns
+        app = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        return SocketClient(app, '/ws/notifications/', f'token={token}')
+
+    async def test_token_claims_authenticate_and_register_presence(self):
+        from channels.layers import get_channel_layer
+        from notifications import presence
+        tenant_id = str(self.tenant.pk)
+        with mock.patch('notifications.middleware._tenant_id') as lookup:
+            socket = self._communicator(self._token(tenant_id=tenant_id))
+            connected = await socket.connect()
+        self.assertTrue(connected)
+        lookup.assert_not_called()
+        layer = get_channel_layer()
+        self.assertEqual(await presence.online(layer, tenant_id), {str(self.user.pk)})
+
+        await layer.group_send(f'user_{self.user.pk}', {'type': 'notification', 'payload': {'id': 1}})
+        self.assertEqual(await socket.receive_json_from(), {'id': 1})
+
+        await socket.disconnect()
+        self.assertEqual(await presence.online(layer, tenant_id), set())
+
+    async def test_tenant_looked_up_once_for_tokens_without_claim(self):
+        from django.core.cache import cache
+        from channels.layers import get_channel_layer
+        from notifications import presence
+        await cache.adelete(f'ws:tenant:{self.user.pk}')
+        socket = self._communicator(self._token())
+        connected = await socket.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await presence.online(get_channel_layer(), str(self.tenant.pk)), {str(self.user.pk)})
+        await socket.disconnect()
+
+    async def test_bad_tokens_are_refused(self):
+        from datetime import timedelta
+        from rest_framework_simplejwt.tokens import AccessToken
+        expired = AccessToken.for_user(self.user)
+        expired.set_exp(lifetime=-timedelta(minutes=1))
+        for token in ('not-a-token', str(expired), self._token()[:-2]):
+            connected = await self._communicator(token).connect()
+            self.assertFalse(connected)
+
+    async def test_tokens_of_deactivated_users_are_refused(self):
+        from asgiref.sync import sync_to_async
+        token = self._token(tenant_id=str(self.tenant.pk))
+        user = await User.objects.aget(pk=self.user.pk)
+        user.is_active = False
+        await sync_to_async(user.save)()
+        connected = await self._communicator(token).connect()
+        self.assertFalse(connected)
+
+    @override_settings(WS_HEARTBEAT_SECONDS=0.05, WS_HEARTBEAT_TIMEOUT_SECONDS=0.12)
+    async def test_heartbeat_pings_and_closes_silent_sockets(self):
+        socket = self._communicator(self._token(tenant_id=str(self.tenant.pk)))
+        await socket.connect()
+        self.assertEqual(await socket.receive_json_from(), {'type': 'ping'})
+        await socket.send_json_to({'type': 'pong'})
+        self.assertEqual(await socket.receive_json_from(), {'type': 'ping'})
+        # no answer any more
+        while True:
+            message = await socket.receive_output(timeout=1)
+            if message['type'] == 'websocket.close':
+                break
+        self.assertEqual(message['code'], 4008)
+
+    @override_settings(WS_SEND_QUEUE_SIZE=2)
+    async def test_slow_client_gets_resync_instead_of_backlog(self):
+        import asyncio
+        from channels.layers import get_channel_layer
+        from notifications.consumers import NotificationsConsumer
+        release = asyncio.Event()
+        send_json = NotificationsConsumer.send_json
+
+        async def slow_send_json(consumer, content, close=False):
+            await release.wait()
+            await send_json(consumer, content, close)
+
+        with mock.patch.object(NotificationsConsumer, 'send_json', slow_send_json):
+            socket = self._communicator(self._token(tenant_id=str(self.tenant.pk)))
+            await socket.connect()
+            layer = get_channel_layer()
+            for i in range(6):
+                await layer.group_send(f'user_{self.user.pk}', {'type': 'notification', 'payload': {'id': i}})
+            await asyncio.sleep(0.1)
+            release.set()
+            messages = []
+            while not messages or messages[-1].get('type') != 'notification.resync':
+                messages.append(await socket.receive_json_from())
+            await socket.disconnect()
+
+        delivered = [m['id'] for m in messages[:-1]]
+        self.assertLessEqual(len(delivered), 3)
+        self.assertEqual(delivered, sorted(delivered))
+        self.assertEqual(len(delivered) + messages[-1]['dropped'], 6)
@@ -57,4 +57,206 @@ def test_cashier_cannot_list_payments_but_manager_can():
     c2 = APIClient()
     c2.force_authenticate(user=manager)
     resp2 = c2.get('/api/payments/payments/')
-    assert resp2.status_code == 200
\ No newline at end of file
+    assert resp2.status_code == 200
+
+def _jwt_request(token, action='list'):
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    request = Request(APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}'),
+                      authenticators=[JWTAuthentication()])
+    request.user  # authenticate
+    return request
+
+
+class _PaymentsView:
+    allowed_roles = ['owner', 'manager']
+    allowed_action_roles = {'pay': ['cashier']}
+
+    def __init__(self, action):
+        self.action = action
+
+
+@pytest.mark.django_db
+def test_roles_authorised_from_token_claims_without_queries(django_assert_num_queries):
+    from accounts.permissions import RolesAllowed
+    from accounts.tokens import ClaimsTokenObtainPairSerializer
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    User = get_user_model()
+    tenant = Tenant.objects.create(slug='claims', name='Claims')
+    User.objects.create_user('claims-cashier', 'cc@example.com', 'pass', tenant=tenant, role='cashier')
+
+    serializer = ClaimsTokenObtainPairSerializer(data={'username': 'claims-cashier', 'password': 'pass'})
+    assert serializer.is_valid(), serializer.errors
+    access = serializer.validated_data['access']
+    claims = JWTAuthentication().get_validated_token(access)
+    assert (claims['role'], claims['tenant_id']) == ('cashier', str(tenant.pk))
+
+    # the user is loaded once by the authenticator, the permission adds nothing
+    request = _jwt_request(access)
+    with django_assert_num_queries(0):
+        assert RolesAllowed().has_permission(request, _PaymentsView('pay'))
+        assert not RolesAllowed().has_permission(request, _PaymentsView('list'))
+
+
+@pytest.mark.django_db
+def test_role_change_revokes_claims_until_refresh():
+    from accounts.permissions import RolesAllowed
+    from accounts.tokens import ClaimsTokenRefreshSerializer, add_claims, is_revoked
+    from rest_framework.exceptions import AuthenticationFailed
+    from rest_framework_simplejwt.tokens import RefreshToken
+    User = get_user_model()
+    tenant = Tenant.objects.create(slug='revoke', name='Revoke')
+    user = User.objects.create_user('promoted', 'p@example.com', 'pass', tenant=tenant, role='cashier')
+    refresh = add_claims(RefreshToken.for_user(user), user)
+    access = refresh.access_token
+
+    user = User.objects.get(pk=user.pk)
+    user.role = 'manager'
+    user.save()
+    assert is_revoked(access)
+    # stale claim says cashier, the database says manager
+    assert RolesAllowed().has_permission(_jwt_request(str(access)), _PaymentsView('list'))
+
+    serializer = ClaimsTokenRefreshSerializer(data={'refresh': str(refresh)})
+    assert serializer.is_valid(), serializer.errors
+    fresh = _jwt_request(serializer.validated_data['access']).auth
+    assert fresh['role'] == 'manager' and not is_revoked(fresh)
+
+    user.is_active = False
+    user.save()
+    with pytest.raises(AuthenticationFailed):
+        ClaimsTokenRefreshSerializer(data={'refresh': str(refresh)}).is_valid()
+
+
+@pytest.mark.django_db
+def test_bulk_update_of_claim_fields_revokes_claims():
+    from accounts.tokens import add_claims, is_revoked
+    from rest_framework_simplejwt.tokens import AccessToken
+    User = get_user_model()
+    tenant = Tenant.objects.create(slug='bulk-revoke', name='Bulk Revoke')
+    demoted = User.objects.create_user('demoted', 'd@example.com', 'pass', tenant=tenant, role='manager')
+    renamed = User.objects.create_user('renamed', 'r@example.com', 'pass', tenant=tenant, role='manager')
+    demoted_token = add_claims(AccessToken.for_user(demoted), demoted)
+    renamed_token = add_claims(AccessToken.for_user(renamed), renamed)
+
+    assert User.objects.filter(pk=renamed.pk).update(first_name='Ren') == 1
+    assert User.objects.filter(pk=demoted.pk).update(role='cashier') == 1
+    assert is_revoked(demoted_token)
+    assert not is_revoked(renamed_token)
+
+
+def test_per_process_cache_warns_when_claim_auth_is_on(settings):
+    from accounts.checks import claims_revocation_cache
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    assert [w.id for w in claims_revocation_cache(None)] == ['accounts.W001']
+
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                                   'LOCATION': 'redis://redis:6379/0'}}
+    assert claims_revocation_cache(None) == []
+
+
+@pytest.fixture
+def principal_caches():
+    from accounts import principal
+    for cache in (principal.users, principal.tenants):
+        cache.invalidate()
+        cache.reset_stats()
+    return principal
+
+
+def _claims_token(user):
+    from accounts.tokens import add_claims
+    from rest_framework_simplejwt.tokens import AccessToken
+    return str(add_claims(AccessToken.for_user(user), user))
+
+
+def _principal_request(token):
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from accounts.principal import ClaimsJWTAuthentication
+    request = Request(APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}'),
+                      authenticators=[ClaimsJWTAuthentication()])
+    return request.user
+
+
+@pytest.mark.django_db
+def test_principal_from_claims_uses_cached_tenant_and_user(principal_caches, django_assert_num_queries):
+    User = get_user_model()
+    tenant = Tenant.objects.create(slug='principal', name='Principal')
+    user = User.objects.create_user('principal', 'principal@example.com', 'pass', tenant=tenant, role='manager')
+    token = _claims_token(user)
+
+    with django_assert_num_queries(2):
+        # user and tenant cache misses
+        principal = _principal_request(token)
+        assert isinstance(principal, User) and principal.pk == user.pk
+        assert principal.tenant == tenant and principal.role == 'manager'
+    with django_assert_num_queries(0):
+        # fields outside the claims came with the cached user row
+        assert principal.email == 'principal@example.com'
+        assert principal.first_name == ''
+    with django_assert_num_queries(0):
+        again = _principal_request(token)
+        assert again.tenant.name == 'Principal' and again.email == 'principal@example.com'
+    assert list(Product.objects.filter(tenant=again.tenant)) == []
+
+    stats = principal_caches.stats()
+    assert stats['tenant'] == {'hits': 1, 'misses': 1, 'size': 1, 'hit_rate': 0.5}
+    assert (stats['user']['hits'], stats['user']['misses']) == (1, 1)
+
+
+@pytest.mark.django_db
+def test_principal_save_writes_only_changed_fields(principal_caches):
+    User = get_user_model()
+    tenant = Tenant.objects.create(slug='principal-save', name='Principal Save')
+    user = User.objects.create_user('saver', 'old@example.com', 'pass', tenant=tenant, role='cashier')
+    principal = _principal_request(_claims_token(user))
+    principal.email  # fill from the cache
+    User.objects.filter(pk=user.pk).update(email='new@example.com')
+
+    principal.first_name = 'Sam'
+    principal.save()
+
+    user.refresh_from_db()
+    assert (user.first_name, user.email) == ('Sam', 'new@example.com')
+    # the cached row was dropped on save
+    assert principal_caches.users.stats()['size'] == 0
+
+
+@pytest.mark.django_db
+def test_principal_of_an_inactive_or_deleted_user_is_rejected(principal_caches):
+    from django.db.models import QuerySet
+    from rest_framework.exceptions import AuthenticationFailed
+    User = get_user_model()
+    user = User.objects.create_user('leaver', 'leaver@example.com', 'pass', role='cashier')
+    token = _claims_token(user)
+    assert _principal_request(token).pk == user.pk
+
+    # a write that skips save() and revocation (raw SQL, another service); the cached row expires
+    QuerySet.update(User.objects.filter(pk=user.pk), is_active=False)
+    principal_caches.users.invalidate()
+    with pytest.raises(AuthenticationFailed) as exc:
+        _principal_request(token)
+    assert exc.value.get_codes() == 'user_inactive'
+
+    User.objects.filter(pk=user.pk).delete()
+    principal_caches.users.invalidate()
+    with pytest.raises(AuthenticationFailed) as exc:
+        _principal_request(token)
+    assert exc.value.get_codes() == 'user_not_found'
+
+
+@pytest.mark.django_db
+def test_revoked_or_claimless_tokens_load_the_user(principal_caches):
+    from rest_framework_simplejwt.tokens import AccessToken
+    User = get_user_model()
+    user = User.objects.create_user('legacy', 'legacy@example.com', 'pass', role='cashier')
+    token = _claims_token(user)
+    user.role = 'manager'
+    user.save()
+
+    for raw in (token, str(AccessToken.for_user(user))):
+        loaded = _principal_request(raw)
+        assert loaded.role == 'manager'
+        assert not getattr(loaded, '_from_claims', False)
@@ -0,0 +1,37 @@
+from collections import defaultdict
+
+
+def _key(email, tenant_id):
+    return email.strip().lower(), tenant_id
+
+
+def link_accounts(CustomUser, Account, dry_run=False, batch_size=1000):
+    """Link unlinked CustomUser profiles to the Account (AUTH_USER_MODEL) with the same email in the same tenant.
+
+    Only one-to-one matches are linked: an email shared by several profiles or
+    several accounts of a tenant, or an account already linked, is left alone.
+    Usernames are never compared, the two tables assign them independently.
+    Takes the model classes so migrations can pass historical ones. Returns
+    (linked, unmatched) counts over the unlinked profiles with an email.
+    """
+    accounts = defaultdict(list)
+    for pk, email, tenant_id in Account.objects.exclude(email='').values_list('pk', 'email', 'tenant_id'):
+        accounts[_key(email, tenant_id)].append(pk)
+    taken = set(CustomUser.objects.filter(account__isnull=False).values_list('account_id', flat=True))
+
+    profiles = defaultdict(list)
+    unlinked = CustomUser.objects.filter(account__isnull=True).exclude(email='')
+    for pk, email, tenant_id in unlinked.values_list('pk', 'email', 'tenant_id'):
+        profiles[_key(email, tenant_id)].append(pk)
+
+    updates = []
+    unmatched = 0
+    for key, profile_ids in profiles.items():
+        account_ids = accounts.get(key, [])
+        if len(profile_ids) == 1 and len(account_ids) == 1 and account_ids[0] not in taken:
+            updates.append(CustomUser(pk=profile_ids[0], account_id=account_ids[0]))
+        else:
+            unmatched += len(profile_ids)
+    if updates and not dry_run:
+        CustomUser.objects.bulk_update(updates, ['account'], batch_size=batch_size)
+    return len(updates), unmatched
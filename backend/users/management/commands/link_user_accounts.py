@@ -0,0 +1,21 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from users.account_links import link_accounts
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = ('Link users.CustomUser profiles to their accounts.User by email within the same tenant, so '
+            'notify() applies their notification preferences. Ambiguous or missing matches are left unlinked.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Count matches without saving')
+
+    def handle(self, *args, **options):
+        linked, unmatched = link_accounts(CustomUser, get_user_model(), dry_run=options['dry_run'],
+                                          batch_size=options['batch_size'])
+        verb = 'Would link' if options['dry_run'] else 'Linked'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {linked} profiles to their accounts; {unmatched} profiles had no unique match"
+        ))
@@ -0,0 +1,181 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:24
+
+import django.contrib.auth.models
+import django.contrib.auth.validators
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('tenants', '0002_alter_tenant_options_tenant_business_address_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomUser',
+            fields=[
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('username', models.CharField(error_messages={'unique': 'A user with that username already exists.'}, help_text='Required. 150 characters or fewer. Letters, digits and @/./+/-/_ only.', max_length=150, unique=True, validators=[django.contrib.auth.validators.UnicodeUsernameValidator()], verbose_name='username')),
+                ('first_name', models.CharField(blank=True, max_length=150, verbose_name='first name')),
+                ('last_name', models.CharField(blank=True, max_length=150, verbose_name='last name')),
+                ('email', models.EmailField(blank=True, max_length=254, verbose_name='email address')),
+                ('is_staff', models.BooleanField(default=False, help_text='Designates whether the user can log into this admin site.', verbose_name='staff status')),
+                ('is_active', models.BooleanField(default=True, help_text='Designates whether this user should be treated as active. Unselect this instead of deleting accounts.', verbose_name='active')),
+                ('date_joined', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date joined')),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('user_type', models.CharField(choices=[('customer', 'Customer'), ('business_owner', 'Business Owner'), ('driver', 'Driver'), ('staff', 'Business Staff'), ('master_admin', 'Master Admin')], default='customer', max_length=20)),
+                ('phone_number', models.CharField(blank=True, db_index=True, max_length=50)),
+                ('registration_id', models.CharField(db_index=True, help_text='Unique ID for global search', max_length=50, unique=True)),
+                ('profile_picture', models.URLField(blank=True)),
+                ('date_of_birth', models.DateField(blank=True, null=True)),
+                ('gender', models.CharField(blank=True, choices=[('male', 'Male'), ('female', 'Female'), ('other', 'Other')], max_length=10)),
+                ('bio', models.TextField(blank=True)),
+                ('address_line_1', models.CharField(blank=True, max_length=255)),
+                ('address_line_2', models.CharField(blank=True, max_length=255)),
+                ('city', models.CharField(blank=True, max_length=100)),
+                ('state', models.CharField(blank=True, max_length=100)),
+                ('postal_code', models.CharField(blank=True, max_length=20)),
+                ('country', models.CharField(blank=True, max_length=100)),
+                ('latitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('longitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('is_verified', models.BooleanField(default=False)),
+                ('email_verified', models.BooleanField(default=False)),
+                ('phone_verified', models.BooleanField(default=False)),
+                ('email_verification_token', models.CharField(blank=True, max_length=255)),
+                ('phone_verification_token', models.CharField(blank=True, max_length=255)),
+                ('last_login_ip', models.GenericIPAddressField(blank=True, null=True)),
+                ('last_login_device', models.CharField(blank=True, max_length=255)),
+                ('two_factor_enabled', models.BooleanField(default=False)),
+                ('newsletter_subscribed', models.BooleanField(default=True)),
+                ('marketing_emails', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('groups', models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.group', verbose_name='groups')),
+                ('tenant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='users', to='tenants.tenant')),
+                ('user_permissions', models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.permission', verbose_name='user permissions')),
+            ],
+            options={
+                'verbose_name': 'User',
+                'verbose_name_plural': 'Users',
+            },
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserNotificationPreferences',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notify_order_placed', models.BooleanField(default=True)),
+                ('notify_order_confirmed', models.BooleanField(default=True)),
+                ('notify_order_shipped', models.BooleanField(default=True)),
+                ('notify_order_delivered', models.BooleanField(default=True)),
+                ('notify_promotions', models.BooleanField(default=True)),
+                ('notify_new_products', models.BooleanField(default=False)),
+                ('notify_special_offers', models.BooleanField(default=True)),
+                ('notify_account_changes', models.BooleanField(default=True)),
+                ('notify_security_alerts', models.BooleanField(default=True)),
+                ('notify_delivery_requests', models.BooleanField(default=True)),
+                ('notify_delivery_updates', models.BooleanField(default=True)),
+                ('notify_incident_updates', models.BooleanField(default=True)),
+                ('notify_support_responses', models.BooleanField(default=True)),
+                ('email_notifications', models.BooleanField(default=True)),
+                ('sms_notifications', models.BooleanField(default=True)),
+                ('push_notifications', models.BooleanField(default=True)),
+                ('in_app_notifications', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='notification_preferences', to='users.customuser')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserLoginHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('login_time', models.DateTimeField(auto_now_add=True)),
+                ('logout_time', models.DateTimeField(blank=True, null=True)),
+                ('ip_address', models.GenericIPAddressField()),
+                ('device_info', models.CharField(blank=True, max_length=255)),
+                ('browser', models.CharField(blank=True, max_length=100)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='login_history', to='users.customuser')),
+            ],
+            options={
+                'ordering': ['-login_time'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CustomerProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('loyalty_points', models.IntegerField(default=0)),
+                ('loyalty_tier', models.CharField(choices=[('bronze', 'Bronze'), ('silver', 'Silver'), ('gold', 'Gold'), ('platinum', 'Platinum')], default='bronze', max_length=20)),
+                ('total_spent', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('total_orders', models.IntegerField(default=0)),
+                ('preferred_delivery_address', models.TextField(blank=True)),
+                ('preferred_payment_method', models.CharField(blank=True, max_length=50)),
+                ('average_rating', models.DecimalField(decimal_places=2, default=0, max_digits=3, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(5)])),
+                ('total_reviews', models.IntegerField(default=0)),
+                ('is_active', models.BooleanField(default=True)),
+                ('is_blocked', models.BooleanField(default=False)),
+                ('blocked_reason', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='customers', to='tenants.tenant')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='customer_profile', to='users.customuser')),
+            ],
+            options={
+                'verbose_name': 'Customer Profile',
+                'verbose_name_plural': 'Customer Profiles',
+            },
+        ),
+        migrations.CreateModel(
+            name='BusinessOwnerProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('id_document_type', models.CharField(blank=True, choices=[('passport', 'Passport'), ('national_id', 'National ID'), ('driver_license', 'Driver License')], max_length=20)),
+                ('id_document_number', models.CharField(blank=True, max_length=100)),
+                ('id_document_image', models.URLField(blank=True)),
+                ('bank_account_verified', models.BooleanField(default=False)),
+                ('total_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('total_orders_processed', models.IntegerField(default=0)),
+                ('average_customer_rating', models.DecimalField(decimal_places=2, default=0, max_digits=3, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(5)])),
+                ('can_create_staff', models.BooleanField(default=True)),
+                ('can_create_drivers', models.BooleanField(default=True)),
+                ('can_modify_commission', models.BooleanField(default=False)),
+                ('notification_email', models.EmailField(blank=True, max_length=254)),
+                ('notification_phone', models.CharField(blank=True, max_length=50)),
+                ('is_approved', models.BooleanField(default=False)),
+                ('is_suspended', models.BooleanField(default=False)),
+                ('suspension_reason', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tenant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='owner_profile', to='tenants.tenant')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='business_profile', to='users.customuser')),
+            ],
+            options={
+                'verbose_name': 'Business Owner Profile',
+                'verbose_name_plural': 'Business Owner Profiles',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['registration_id'], name='users_custo_registr_a5aeb9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['phone_number'], name='users_custo_phone_n_f2d675_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['user_type'], name='users_custo_user_ty_f25e6c_idx'),
+        ),
+    ]
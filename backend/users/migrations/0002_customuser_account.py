@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_existing_profiles(apps, schema_editor):
+    from users.account_links import link_accounts
+
+    app_label, model_name = settings.AUTH_USER_MODEL.split('.')
+    link_accounts(apps.get_model('users', 'CustomUser'), apps.get_model(app_label, model_name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='account',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(link_existing_profiles, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -21,6 +22,10 @@ class CustomUser(AbstractUser):
     
     # Multi-tenant relationship
     tenant = models.ForeignKey(Tenant, on_delete=models.SET_NULL, null=True, blank=True, related_name='users')
+    # the accounts.User (AUTH_USER_MODEL) this profile belongs to; notification
+    # preferences reach the dispatcher through it
+    account = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='+')
     
     # Profile Information
     phone_number = models.CharField(max_length=50, blank=True, db_index=True)
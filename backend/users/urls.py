@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import RegisterView, MeView
+from .views import RegisterView, MeView, PrincipalCacheStatsView
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -8,6 +8,7 @@ from rest_framework_simplejwt.views import (
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('me/', MeView.as_view(), name='me'),
+    path('principal-cache/', PrincipalCacheStatsView.as_view(), name='principal_cache_stats'),
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 ]
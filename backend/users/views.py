@@ -1,4 +1,4 @@
-from rest_framework import generics, permissions, response
+from rest_framework import generics, permissions, response, views
 from .serializers import RegisterSerializer, UserSerializer
 from django.contrib.auth import get_user_model
 
@@ -17,3 +17,12 @@ class MeView(generics.RetrieveAPIView):
 
     def get_object(self):
         return self.request.user
+
+
+class PrincipalCacheStatsView(views.APIView):
+    """Hit rate of this process' user / tenant cache behind token authentication."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        from accounts.principal import stats
+        return response.Response(stats())